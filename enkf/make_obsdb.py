@@ -0,0 +1,75 @@
+from __future__ import print_function
+from sqgturb import RandomStreams, ObservationOperator
+from sqgturb.obsdb import ObsDatabaseWriter
+import numpy as np
+from netCDF4 import Dataset
+import sys
+
+# generate an ob database (sqgturb/obsdb.py) from a nature run, for use by
+# sqg_enkf.py (obsfile setting).  Obs are boundary temp at grid points,
+# sampled exactly as in sqg_enkf.py (same random number streams), so
+# experiments that read the database see the obs they would have
+# generated, without reading the nature run to make them.
+
+if len(sys.argv) < 2:
+   msg="""
+python make_obsdb.py obsfile
+   """
+   raise SystemExit(msg)
+obsfile = sys.argv[1]
+
+filename_truth = '../examples/sqg_N512_N128_3hrly_blockmean.nc' # file name for nature run to draw obs
+
+# if nobs > 0, each ob time nobs ob locations are randomly sampled (without
+# replacement) from the model grid
+# if nobs < 0, fixed network of every Nth grid point used (N = -nobs)
+nobs = 4096 # number of obs to assimilate (randomly distributed)
+#nobs = -1 # fixed network, every -nobs grid points. nobs=-1 obs at all pts.
+levob = [0,1] # levels observed
+oberrstdev = 1.0 # ob error standard deviation in K
+seed = 42 # random seed (same as sqg_enkf.py)
+nassim = None # number of cycles (None for all nature run times)
+
+rng = RandomStreams(seed=seed)
+nc_truth = Dataset(filename_truth)
+pv_truth = nc_truth.variables['pv']
+obtimes = nc_truth.variables['t'][:]
+if nassim is None: nassim = len(obtimes)
+scalefact = nc_truth.f*nc_truth.theta0/nc_truth.g
+L = nc_truth.L
+x = nc_truth.variables['x'][:]
+y = nc_truth.variables['y'][:]
+x, y = np.meshgrid(x, y)
+ny, nx = x.shape
+if nobs < 0:
+    nobs = (nx//nobs)**2
+    fixed = True
+else:
+    fixed = False
+
+db = ObsDatabaseWriter(obsfile,L,nx,ny=ny,filename_truth=filename_truth,\
+     nobs=nobs,fixed=int(fixed),levob=levob,oberrstdev=oberrstdev,seed=seed)
+for ntime in range(nassim):
+    if not fixed:
+        p = np.ones((ny,nx),np.float64)/(nx*ny)
+        indxob = rng.generator(purpose='oblocs',cycle=ntime).choice(nx*ny,nobs,replace=False,p=p.ravel())
+    else:
+        mask = np.zeros((ny,nx),bool)
+        nskip = int(nx/np.sqrt(nobs))
+        # if every other grid point observed, shift every other time step
+        # so every grid point is observed in 2 cycle.
+        if nskip == 2 and ntime%2:
+            mask[1:ny:nskip,1:nx:nskip] = True
+        else:
+            mask[0:ny:nskip,0:nx:nskip] = True
+        indxob = np.arange(0,nx*ny).reshape(ny,nx)[mask.nonzero()].ravel()
+    H = ObservationOperator(L,nx,indxob=indxob,ny=ny,levob=levob,scalefact=scalefact)
+    pvob = H(pv_truth[ntime]).astype(np.float32)
+    for k in range(len(levob)):
+        pvob[k] += rng.normal(scale=oberrstdev,size=nobs,dtype=np.float64,\
+                   level=k,purpose='oberrs',cycle=ntime) # add ob errors
+    oberrvar = oberrstdev**2*np.ones(nobs,np.float32)
+    db.add_cycle(obtimes[ntime],x.ravel()[indxob],y.ravel()[indxob],pvob,oberrvar,\
+                 levob,indxob=indxob)
+    print('cycle %s time %s nobs %s' % (ntime,obtimes[ntime],nobs))
+db.close()
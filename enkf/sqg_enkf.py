@@ -1,9 +1,17 @@
 from __future__ import print_function
-from sqgturb import SQG, rfft2, irfft2, RandomPattern
+from sqgturb import SQG, rfft2, irfft2, RandomPattern, RandomStreams
 import numpy as np
 from netCDF4 import Dataset
-import sys, time, os
-from sqgturb.enkf_utils import  cartdist,enkf_update,gaspcohn
+import sys, time, os, ast, multiprocessing
+from sqgturb.enkf_utils import  enkf_update,enkf_update_fft,gaspcohn,gaspcohn_sparse,\
+     GridLocalization
+from sqgturb.obprep import superob, thin
+from sqgturb.obsdb import ObsDatabase
+from sqgturb.cycling import CyclingPipeline
+from sqgturb.precision import get_dtype
+from sqgturb.obsoperator import ObservationOperator
+from sqgturb.ensstate import EnsembleState
+from sqgturb.ensstats import ensemble_moments
 
 # EnKF cycling for SQG turbulence model model with boundary temp obs,
 # horizontal and vertical localization.  Relaxation to prior spread
@@ -18,17 +26,22 @@ python sqg_enkf.py hcovlocal_scale covinflate1 covinflate2
    raise SystemExit(msg)
 
 # horizontal covariance localization length scale in meters.
+# (inf for no horizontal localization, global ETKF update).
 hcovlocal_scale = float(sys.argv[1])
 # vertical covariance localization factor
 # if < 0, default used (vcovlocal_fact = L_r/hcovlocal_scale,
 # where L_r is Rossby radius)
 #vcovlocal_fact = float(sys.argv[2])
 vcovlocal_fact = -1
-# stochastic parameterization parameters
-amp = np.asarray(eval(sys.argv[2]),np.float)
-hcorr = np.asarray(eval(sys.argv[3]),np.float)
-tcorr = np.asarray(eval(sys.argv[4]),np.float)
+# stochastic parameterization parameters (numbers, or lists with a value
+# for each pattern, e.g. [1.0,0.5]).
+amp = np.asarray(ast.literal_eval(sys.argv[2]),float)
+hcorr = np.asarray(ast.literal_eval(sys.argv[3]),float)
+tcorr = np.asarray(ast.literal_eval(sys.argv[4]),float)
 nsamples = 2
+# evolve random patterns every pattern_update_interval time steps
+# (random winds linearly interpolated in time in between).
+pattern_update_interval = 1
 # inflation parameters
 # (covinflate2 <= 0 for RTPS inflation
 # (http://journals.ametsoc.org/doi/10.1175/MWR-D-11-00276.1),
@@ -48,13 +61,25 @@ savedata = None # if not None, netcdf filename to save data.
 
 profile = False # turn on profiling?
 
+# precision of model, random patterns, ensemble and localization weights
+# ('single' or 'double'). EnKF reductions are always done in double precision.
+precision = 'single'
+
 use_letkf = False # use serial EnSRF
+# LETKF weights computed every letkf_weight_interval grid points and
+# interpolated ('bilinear' or 'spectral') to the full grid.
+letkf_weight_interval = 1
+letkf_weight_interp = 'bilinear'
+enkf_nproc = 1 # number of processes for EnKF (LETKF or serial EnSRF) update
 
 # if nobs > 0, each ob time nobs ob locations are randomly sampled (without
 # replacement) from the model grid
 # if nobs < 0, fixed network of every Nth grid point used (N = -nobs)
 nobs = 4096 # number of obs to assimilate (randomly distributed)
 #nobs = -1 # fixed network, every -nobs grid points. nobs=-1 obs at all pts.
+# if obsfile is not None, obs are read from this ob database (made by
+# make_obsdb.py) instead (nobs is then taken from the database).
+obsfile = None
 
 # if levob=0, sfc temp obs used.  if 1, lid temp obs used. If [0,1] obs at both
 # boundaries.
@@ -62,6 +87,26 @@ levob = [0,1]; levob = list(levob); levob.sort()
 
 direct_insertion = False # only relevant for nobs=-1, levob=[0,1]
 if direct_insertion: print('# direct insertion!')
+# only relevant for nobs=-1 (obs at all grid points).  Localized update
+# with covariances applied by fft convolution and a conjugate gradient
+# solve in ob space (enkf_update_fft), instead of serial EnSRF/LETKF.
+fft_update = False
+
+# ob preprocessing (obprep.py) before the update.
+# obs_reduction = None (use all obs), 'superob' (average obs in boxes
+# (superob_method='box') or clusters within a radius ('radius') of
+# superob_size grid lengths, superob_corr is the error correlation of the
+# obs in a superob) or 'thin' (keep one ob per thin_spacing x thin_spacing
+# grid lengths).
+obs_reduction = None
+superob_method = 'box'; superob_size = 4; superob_corr = 0.
+thin_spacing = 2
+
+# cycling pipeline (sqgturb/cycling.py):  obs and localization are computed
+# up to pipeline_prefetch cycles ahead, and output and error spectra in
+# background threads (overlapping the update and forecast).
+# pipeline_prefetch = 0 for sequential cycling (same results).
+pipeline_prefetch = 1
 
 nanals = 40 # ensemble members
 
@@ -76,24 +121,49 @@ filename_climo = '../examples/sqg_N128_3hrly.nc' # file name for forecast model
 # truncated model
 filename_truth = '../examples/sqg_N512_N128_3hrly_blockmean.nc' # file name for nature run to draw obs
 
+# climo and nature run files can be passed in already read into memory
+# (dict preloaded with Dataset-like 'climo' and 'truth' entries), when this
+# script is run by the parameter sweep runner (sqg_enkf_sweep.py).
+preloaded = globals().get('preloaded')
+if preloaded is not None:
+    filename_climo = preloaded['climo'].filename
+    filename_truth = preloaded['truth'].filename
+# any of the settings above can also be changed by the sweep runner (dict
+# settings of names and values).
+settings = globals().get('settings')
+if settings: globals().update(settings)
+dtype = get_dtype(precision)
+# the parallel EnKF update starts worker processes, which daemonic
+# processes (e.g. sqg_enkf_sweep.py pool workers) cannot do.
+if enkf_nproc > 1 and multiprocessing.current_process().daemon:
+    raise ValueError('enkf_nproc > 1 not possible in a daemonic process')
+
 print('# filename_modelclimo=%s' % filename_climo)
 print('# filename_truth=%s' % filename_truth)
 
 # fix random seed for reproducibility.
-np.random.seed(42)
+# (independent random number streams for each purpose/member/level/cycle, so
+# results do not depend on the order random numbers are drawn).
+rng = RandomStreams(seed=42)
 
 # get model info
-nc_climo = Dataset(filename_climo)
+if preloaded is not None:
+    nc_climo = preloaded['climo']
+else:
+    nc_climo = Dataset(filename_climo)
 # parameter used to scale PV to temperature units.
 scalefact = nc_climo.f*nc_climo.theta0/nc_climo.g
 # initialize qg model instances for each ensemble member.
 x = nc_climo.variables['x'][:]
 y = nc_climo.variables['y'][:]
 pv_climo = nc_climo.variables['pv']
-indxran = np.random.choice(pv_climo.shape[0],size=nanals,replace=False)
+indxran = rng.generator(purpose='ensinit').choice(pv_climo.shape[0],size=nanals,replace=False)
 x, y = np.meshgrid(x, y)
 nx = len(x); ny = len(y)
-pvens = np.empty((nanals,2,ny,nx),np.float32)
+# ensemble state, pvens (nanals,2,ny,nx) and xens (nanals,2,ny*nx) are views
+# of the same buffer.
+ens = EnsembleState(nanals,ny,nx,precision=precision)
+pvens = ens.grid; xens = ens.flat
 dt = nc_climo.dt
 if diff_efold == None: diff_efold=nc_climo.diff_efold
 # get OMP_NUM_THREADS (threads to use) from environment.
@@ -108,20 +178,22 @@ else:
         stdev = amp # psi units are m**2/s
     else:
         raise ValueError('illegal random pattern norm')
-    rp = RandomPattern(hcorr*nc_climo.L/nx,tcorr*dt,nc_climo.L,nx,dt,nsamples=nsamples,stdev=stdev,norm=rp_norm)
+    rp = RandomPattern(hcorr*nc_climo.L/nx,tcorr*dt,nc_climo.L,nx,dt,nsamples=nsamples,stdev=stdev,norm=rp_norm,\
+                       precision=precision)
 rpatterns = []; models = []
 for nanal in range(nanals):
     pvens[nanal] = pv_climo[indxran[nanal]]
     if rp is not None:
-        rpx = rp.copy(seed=nanal)
+        rpx = rp.copy(seed=rng.generator(member=nanal,purpose='pattern'))
         rpatterns.append(rpx)
     else:
         rpx = None
     models.append(\
-    SQG(pvens[nanal],random_pattern=rpx,\
+    SQG(pvens[nanal],random_pattern=rpx,pattern_update_interval=pattern_update_interval,\
     nsq=nc_climo.nsq,f=nc_climo.f,dt=dt,U=nc_climo.U,H=nc_climo.H,\
     r=nc_climo.r,tdiab=nc_climo.tdiab,symmetric=nc_climo.symmetric,\
-    diff_order=nc_climo.diff_order,diff_efold=diff_efold,threads=threads))
+    diff_order=nc_climo.diff_order,diff_efold=diff_efold,threads=threads,\
+    precision=precision))
 
 # default vertical localization scale
 Lr = np.sqrt(models[0].nsq)*models[0].H/models[0].f
@@ -132,27 +204,38 @@ print("# hcovlocal=%g vcovlocal=%s diff_efold=%s levob=%s covinf1=%s covinf2=%s
      (hcovlocal_scale/1000.,vcovlocal_fact,diff_efold,levob,covinflate1,covinflate2,nanals))
 
 # nature run
-nc_truth = Dataset(filename_truth)
+if preloaded is not None:
+    nc_truth = preloaded['truth']
+else:
+    nc_truth = Dataset(filename_truth)
 pv_truth = nc_truth.variables['pv']
 # set up arrays for obs and localization function
 if nobs < 0:
     nskip = -nobs
     if nx%nobs != 0:
         raise ValueError('nx must be divisible by nobs')
-    nobs = (nx/nobs)**2
+    nobs = (nx//nobs)**2
     print('# nobs = %s' % nobs)
     fixed = True
 else:
     fixed = False
-oberrvar = oberrstdev**2*np.ones(nobs,np.float)
-pvob = np.empty((len(levob),nobs),np.float)
-covlocal = np.empty((ny,nx),np.float)
-covlocal_tmp = np.empty((nobs,nx*ny),np.float)
-xens = np.empty((nanals,2,nx*ny),np.float)
-if not use_letkf:
-    obcovlocal = np.empty((nobs,nobs),np.float)
+if obsfile is not None:
+    # obs streamed from ob database by cycle (the same obs for every
+    # experiment, the nature run is then only read for verification).
+    obsdb = ObsDatabase(obsfile)
+    nobs = int(obsdb.attrs['nobs']); fixed = bool(obsdb.attrs['fixed'])
+    print('# obs from %s, nobs = %s' % (obsfile,nobs))
 else:
-    obcovlocal = None
+    obsdb = None
+use_fft_update = fft_update and fixed and nobs == nx*ny and np.isfinite(hcovlocal_scale) \
+                 and obs_reduction is None
+if use_fft_update: print('# localized update by fft convolution')
+# obs are at grid points, localization computed by shifting a precomputed
+# stencil (cached, so only computed once for a fixed network).
+if np.isfinite(hcovlocal_scale):
+    localization = GridLocalization(nx,ny,nc_climo.L,hcovlocal_scale,precision=precision)
+else:
+    localization = None # no horizontal localization
 obtimes = nc_truth.variables['t'][:]
 assim_interval = obtimes[1]-obtimes[0]
 assim_timesteps = int(np.round(assim_interval/models[0].dt))
@@ -193,7 +276,7 @@ if savedata is not None:
    z = nc.createDimension('z',2)
    t = nc.createDimension('t',None)
    obs = nc.createDimension('obs',nobs)
-   ens = nc.createDimension('ens',nanals)
+   ensdim = nc.createDimension('ens',nanals)
    pv_t =\
    nc.createVariable('pv_t',np.float32,('t','z','y','x'),zlib=True)
    pv_b =\
@@ -225,37 +308,68 @@ if savedata is not None:
 kespec_errmean = None; kespec_sprdmean = None
 
 ncount = 0; nanals2 = 4
-for ntime in range(nassim):
 
-    # check model clock
-    if models[0].t != obtimes[ntime]:
-        raise ValueError('model/ob time mismatch %s vs %s' %\
-        (models[0].t, obtimes[ntime]))
-
-    t1 = time.time()
-    if not fixed:
-        p = np.ones((ny,nx),np.float)/(nx*ny)
-        #psave = p.copy()
-        #p[ny/4:3*ny/4,nx/4:3*nx/4] = 4.*psave[ny/4:3*ny/4,nx/4:3*nx/4]
-        #p = p - p.sum()/(nx*ny) + 1./(nx*ny)
-        indxob = np.random.choice(nx*ny,nobs,replace=False,p=p.ravel())
+def make_obs(ntime):
+    # obs, forward operator and localization for cycle ntime.  Depends
+    # only on ntime, so can be computed ahead (in the obs stage of the
+    # cycling pipeline).
+    with pipeline.io_lock:
+        truth = pv_truth[ntime]
+    obcovlocal = None # not needed for LETKF
+    if obsdb is not None:
+        # obs for this cycle from ob database.
+        with pipeline.io_lock:
+            pvob, oberrvar, xob, yob, indxob = obsdb.cycle(ntime,levob)
+        if obsdb.times[ntime] != obtimes[ntime]:
+            raise ValueError('ob database/ob time mismatch %s vs %s' %\
+            (obsdb.times[ntime], obtimes[ntime]))
+        if indxob is None:
+            raise ValueError('obs in database must be at grid points')
+        pvob = pvob.astype(dtype); oberrvar = oberrvar.astype(dtype)
+        H = ObservationOperator(nc_climo.L,nx,indxob=indxob,ny=ny,levob=levob,\
+                                scalefact=scalefact)
     else:
-        mask = np.zeros((ny,nx),np.bool)
-        nskip = int(nx/np.sqrt(nobs))
-        # if every other grid point observed, shift every other time step
-        # so every grid point is observed in 2 cycle.
-        if nskip == 2 and ntime%2:
-            mask[1:ny:nskip,1:nx:nskip] = True
+        if not fixed:
+            p = np.ones((ny,nx),float)/(nx*ny)
+            #psave = p.copy()
+            #p[ny/4:3*ny/4,nx/4:3*nx/4] = 4.*psave[ny/4:3*ny/4,nx/4:3*nx/4]
+            #p = p - p.sum()/(nx*ny) + 1./(nx*ny)
+            indxob = rng.generator(purpose='oblocs',cycle=ntime).choice(nx*ny,nobs,replace=False,p=p.ravel())
         else:
-            mask[0:ny:nskip,0:nx:nskip] = True
-        tmp = np.arange(0,nx*ny).reshape(ny,nx)
-        indxob = tmp[mask.nonzero()].ravel()
-    for k in range(len(levob)):
-        # surface temp obs
-        pvob[k] = scalefact*pv_truth[ntime,k,:,:].ravel()[indxob]
-        pvob[k] += np.random.normal(scale=oberrstdev,size=nobs) # add ob errors
-    xob = x.ravel()[indxob]
-    yob = y.ravel()[indxob]
+            mask = np.zeros((ny,nx),bool)
+            nskip = int(nx/np.sqrt(nobs))
+            # if every other grid point observed, shift every other time step
+            # so every grid point is observed in 2 cycle.
+            if nskip == 2 and ntime%2:
+                mask[1:ny:nskip,1:nx:nskip] = True
+            else:
+                mask[0:ny:nskip,0:nx:nskip] = True
+            tmp = np.arange(0,nx*ny).reshape(ny,nx)
+            indxob = tmp[mask.nonzero()].ravel()
+        # forward operator (obs of boundary temp at grid points).
+        H = ObservationOperator(nc_climo.L,nx,indxob=indxob,ny=ny,levob=levob,\
+                                scalefact=scalefact)
+        pvob = H(truth).astype(dtype)
+        for k in range(len(levob)):
+            pvob[k] += rng.normal(scale=oberrstdev,size=nobs,dtype=np.float64,\
+                       level=k,purpose='oberrs',cycle=ntime) # add ob errors
+        oberrvar = oberrstdev**2*np.ones(nobs,dtype)
+        xob = x.ravel()[indxob]
+        yob = y.ravel()[indxob]
+    obs_all = (pvob, xob, yob) # all obs (saved, before superobbing/thinning)
+    # superobbing or thinning (superobs are not at grid points, so
+    # the operator averages the operators for the original obs).
+    if obs_reduction == 'superob':
+        pvob, oberrvar, xob, yob, groups = superob(xob,yob,pvob,oberrvar,\
+        nc_climo.L,superob_size*nc_climo.L/nx,method=superob_method,obcorr=superob_corr)
+        H = ObservationOperator(nc_climo.L,nx,indxob=indxob,ny=ny,levob=levob,\
+                                scalefact=scalefact,groups=groups)
+    elif obs_reduction == 'thin':
+        keep = thin(xob,yob,nc_climo.L,thin_spacing*nc_climo.L/nx)
+        indxob = indxob[keep]; pvob = pvob[:,keep]; oberrvar = oberrvar[keep]
+        xob = xob[keep]; yob = yob[keep]
+        H = ObservationOperator(nc_climo.L,nx,indxob=indxob,ny=ny,levob=levob,\
+                                scalefact=scalefact)
     # plot ob network
     #import matplotlib.pyplot as plt
     #plt.contourf(x,y,pv_truth[0,1,...],15)
@@ -264,76 +378,133 @@ for ntime in range(nassim):
     #plt.show()
     #raise SystemExit
     # compute covariance localization function for each ob
-    if not fixed or ntime == 0:
-        for nob in range(nobs):
-            dist = cartdist(xob[nob],yob[nob],x,y,nc_climo.L,nc_climo.L)
-            covlocal = gaspcohn(dist/hcovlocal_scale)
-            covlocal_tmp[nob] = covlocal.ravel()
-            dist = cartdist(xob[nob],yob[nob],xob,yob,nc_climo.L,nc_climo.L)
-            if not use_letkf: obcovlocal[nob] = gaspcohn(dist/hcovlocal_scale)
-            # plot covariance localization
-            #import matplotlib.pyplot as plt
-            #plt.contourf(x,y,covlocal,15)
-            #plt.show()
-            #raise SystemExit
+    # (sparse matrices, only nonzero weights stored)
+    # (covlocal=None for no localization, enkf_update then uses global ETKF)
+    if localization is None:
+        covlocal = None
+    elif use_fft_update:
+        covlocal = None # taper applied by fft convolution
+    elif obs_reduction == 'superob':
+        covlocal = gaspcohn_sparse(xob,yob,x,y,nc_climo.L,nc_climo.L,\
+                   hcovlocal_scale).astype(dtype)
+        if not use_letkf:
+            obcovlocal = gaspcohn_sparse(xob,yob,xob,yob,nc_climo.L,nc_climo.L,\
+                         hcovlocal_scale).astype(dtype)
+    else:
+        covlocal = localization.covlocal(indxob)
+        if not use_letkf:
+            obcovlocal = localization.obcovlocal(indxob)
+    # plot covariance localization
+    #import matplotlib.pyplot as plt
+    #plt.contourf(x,y,covlocal[0].toarray().reshape((ny,nx)),15)
+    #plt.show()
+    #raise SystemExit
+    return dict(truth=truth,indxob=indxob,H=H,pvob=pvob,oberrvar=oberrvar,\
+                obs_all=obs_all,covlocal=covlocal,obcovlocal=obcovlocal)
+
+def save_background(ntime,truth,pvb,pvob,xob,yob):
+    with pipeline.io_lock:
+        pv_t[ntime] = truth
+        pv_b[ntime,:,:,:] = pvb
+        pv_obs[ntime] = pvob
+        x_obs[ntime] = xob
+        y_obs[ntime] = yob
+
+def save_analysis(ntime,pva,inflation_factor):
+    with pipeline.io_lock:
+        pv_a[ntime,:,:,:] = pva
+        tvar[ntime] = obtimes[ntime]
+        inf[ntime] = inflation_factor
+        nc.sync()
+
+def error_spectra(ntime,pvfcstmean,pvfcst):
+    # accumulate forecast error and spread kinetic energy spectra
+    # (pvfcst holds the first nanals2 members).
+    global kespec_errmean, kespec_sprdmean, ncount
+    with pipeline.io_lock:
+        truth = pv_truth[ntime+1]
+    pverrspec = scalefact*rfft2(pvfcstmean - truth)
+    psispec = models[0].invert(pverrspec)
+    psispec = psispec/(models[0].N*np.sqrt(2.))
+    kespec = (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real
+    if kespec_errmean is None:
+        kespec_errmean =\
+        (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real
+    else:
+        kespec_errmean = kespec_errmean + kespec
+    for nanal in range(nanals2):
+        pvsprdspec = scalefact*rfft2(pvfcst[nanal] - pvfcstmean)
+        psispec = models[0].invert(pvsprdspec)
+        psispec = psispec/(models[0].N*np.sqrt(2.))
+        kespec = (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real
+        if kespec_sprdmean is None:
+            kespec_sprdmean =\
+            (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real/nanals2
+        else:
+            kespec_sprdmean = kespec_sprdmean+kespec/nanals2
+    ncount += 1
+
+pipeline = CyclingPipeline(make_obs,nassim,prefetch=pipeline_prefetch)
+for ntime in range(nassim):
+
+    # check model clock
+    if models[0].t != obtimes[ntime]:
+        raise ValueError('model/ob time mismatch %s vs %s' %\
+        (models[0].t, obtimes[ntime]))
+
+    t1 = time.time()
+    # obs for this cycle (computed while the previous cycle ran, if
+    # pipeline_prefetch > 0).
+    obdata = pipeline.obs(ntime)
+    truth = obdata['truth']; H = obdata['H']
+    pvob = obdata['pvob']; oberrvar = obdata['oberrvar']
+    covlocal = obdata['covlocal']; obcovlocal = obdata['obcovlocal']
 
     # first-guess spread (need later to compute inflation factor)
-    fsprd = ((pvens - pvens.mean(axis=0))**2).sum(axis=0)/(nanals-1)
+    # (mean, variance and error of mean from one pass over the ensemble)
+    pvensmean_b, fsprd, pverr_b = ens.moments(truth)
 
     # compute forward operator.
     # hxens is ensemble in observation space.
-    hxens = np.empty((nanals,len(levob),nobs),np.float)
-    for nanal in range(nanals):
-        for k in range(len(levob)):
-            hxens[nanal,k,...] = scalefact*pvens[nanal,k,...].ravel()[indxob] # surface pv obs
-    hxensmean_b = hxens.mean(axis=0)
-    obsprd = ((hxens-hxensmean_b)**2).sum(axis=0)/(nanals-1)
+    hxens = H(pvens)
+    hxensmean_b, obsprd, obfits = ensemble_moments(hxens,pvob)
     # innov stats for background
-    obfits = pvob - hxensmean_b
-    obfits_b = (obfits**2).mean()
-    obbias_b = obfits.mean()
+    obfits_b = obfits.mean()
+    obbias_b = (pvob - hxensmean_b).mean()
     obsprd_b = obsprd.mean()
-    pvensmean_b = pvens.mean(axis=0).copy()
-    pverr_b = (scalefact*(pvensmean_b-pv_truth[ntime]))**2
-    pvsprd_b = ((scalefact*(pvensmean_b-pvens))**2).sum(axis=0)/(nanals-1)
+    pverr_b = scalefact**2*pverr_b
+    pvsprd_b = scalefact**2*fsprd
 
     if savedata is not None:
-        pv_t[ntime] = pv_truth[ntime]
-        pv_b[ntime,:,:,:] = scalefact*pvens
-        pv_obs[ntime] = pvob
-        x_obs[ntime] = xob
-        y_obs[ntime] = yob
+        pipeline.output(save_background,ntime,truth,scalefact*pvens,*obdata['obs_all'])
 
-    # EnKF update
-    # create 1d state vector.
-    for nanal in range(nanals):
-        xens[nanal] = pvens[nanal].reshape((2,nx*ny))
-    # update state vector.
-    if direct_insertion and nobs == nx*ny and levob == [0,1]:
+    # EnKF update (in place, xens is a (nanals,2,nx*ny) view of pvens).
+    if direct_insertion and nobs == nx*ny and levob == [0,1] and obs_reduction is None:
         for nanal in range(nanals):
             xens[nanal] =\
-            pv_truth[ntime].reshape(2,nx*ny) + \
-            np.random.normal(scale=oberrstdev,size=(2,nx*ny))/scalefact
-        xens = xens - xens.mean(axis=0) + \
-        pv_truth[ntime].reshape(2,nx*ny) + \
-        np.random.normal(scale=oberrstdev,size=(2,nx*ny))/scalefact
+            truth.reshape(2,nx*ny) + \
+            rng.normal(scale=oberrstdev,size=(2,nx*ny),dtype=np.float64,\
+            member=nanal,purpose='directinsertion',cycle=ntime)/scalefact
+        ens.remove_mean()
+        xens += truth.reshape(2,nx*ny) + \
+        rng.normal(scale=oberrstdev,size=(2,nx*ny),dtype=np.float64,\
+        purpose='directinsertion_mean',cycle=ntime)/scalefact
+    elif use_fft_update:
+        xens, niter = enkf_update_fft(xens,hxens,pvob,oberrvar,localization,levob,vcovlocal_fact)
+        if profile: print('conjugate gradient iterations',niter)
     else:
-        xens =\
-        enkf_update(xens,hxens,pvob,oberrvar,covlocal_tmp,levob,vcovlocal_fact,obcovlocal=obcovlocal)
-    # back to 3d state vector
-    for nanal in range(nanals):
-        pvens[nanal] = xens[nanal].reshape((2,ny,nx))
+        ens.update(hxens,pvob,oberrvar,covlocal,levob,vcovlocal_fact,obcovlocal=obcovlocal,
+                   weight_interval=letkf_weight_interval,
+                   weight_interp=letkf_weight_interp,nx=nx,nproc=enkf_nproc)
     t2 = time.time()
     if profile: print('cpu time for EnKF update',t2-t1)
 
     # forward operator on posterior ensemble.
-    for nanal in range(nanals):
-        for k in range(len(levob)):
-            hxens[nanal,k,...] = scalefact*pvens[nanal,k,...].ravel()[indxob] # surface pv obs
+    hxens = H(pvens)
 
     # ob space diagnostics
-    hxensmean_a = hxens.mean(axis=0)
-    obsprd_a = (((hxens-hxensmean_a)**2).sum(axis=0)/(nanals-1)).mean()
+    hxensmean_a, obsprd_a = ensemble_moments(hxens)
+    obsprd_a = obsprd_a.mean()
     # expected value is HPaHT (obsprd_a).
     obinc_a = ((hxensmean_a-hxensmean_b)*(pvob-hxensmean_a)).mean()
     # expected value is HPbHT (obsprd_b).
@@ -341,39 +512,24 @@ for ntime in range(nassim):
     # expected value R (oberrvar).
     omaomb = ((pvob-hxensmean_a)*(pvob-hxensmean_b)).mean()
 
-    # posterior multiplicative inflation.
-    pvensmean_a = pvens.mean(axis=0)
-    pvprime = pvens-pvensmean_a
-    asprd = (pvprime**2).sum(axis=0)/(nanals-1)
-    if covinflate2 < 0:
-        # relaxation to prior stdev (Whitaker & Hamill 2012)
-        asprd = np.sqrt(asprd); fsprd = np.sqrt(fsprd)
-        inflation_factor = 1.+covinflate1*(fsprd-asprd)/asprd
-    else:
-        # Hodyss et al 2016 inflation (covinflate1=covinflate2=1 works well in perfect
-        # model, linear gaussian scenario)
-        # inflation = asprd + (asprd/fsprd)**2((fsprd/nanals)+2*inc**2/(nanals-1))
-        inc = pvensmean_a - pvensmean_b
-        inflation_factor = covinflate1*asprd + \
-        (asprd/fsprd)**2*((fsprd/nanals) + covinflate2*(2.*inc**2/(nanals-1)))
-        inflation_factor = np.sqrt(inflation_factor/asprd)
-    pvprime = pvprime*inflation_factor
-    pvens = pvprime + pvensmean_a
+    # posterior multiplicative inflation (in place).
+    # (covinflate2 < 0 for RTPS, otherwise Hodyss et al)
+    pvensmean_a, asprd, pverr_a = ens.moments(truth)
+    inflation_factor = ens.inflate(fsprd,covinflate1,covinflate2,\
+                       ensmean_b=pvensmean_b,moments=(pvensmean_a,asprd))
 
     # print out analysis error, spread and innov stats for background
-    pverr_a = (scalefact*(pvensmean_a-pv_truth[ntime]))**2
-    pvsprd_a = ((scalefact*(pvensmean_a-pvens))**2).sum(axis=0)/(nanals-1)
+    # (inflation multiplies posterior spread by inflation_factor**2).
+    pverr_a = scalefact**2*pverr_a
+    pvsprd_a = scalefact**2*asprd*inflation_factor**2
     print("%s %g %g %g %g %g %g %g %g %g %g %g" %\
     (ntime,np.sqrt(pverr_a.mean()),np.sqrt(pvsprd_a.mean()),\
      np.sqrt(pverr_b.mean()),np.sqrt(pvsprd_b.mean()),\
      obinc_b,obsprd_b,obinc_a,obsprd_a,omaomb/oberrvar.mean(),obbias_b,inflation_factor.mean()))
 
-    # save data.
+    # save data (in background, during forecast).
     if savedata is not None:
-        pv_a[ntime,:,:,:] = scalefact*pvens
-        tvar[ntime] = obtimes[ntime]
-        inf[ntime] = inflation_factor
-        nc.sync()
+        pipeline.output(save_analysis,ntime,scalefact*pvens,inflation_factor)
 
     # run forecast ensemble to next analysis time
     t1 = time.time()
@@ -389,29 +545,11 @@ for ntime in range(nassim):
     t2 = time.time()
     if profile: print('cpu time for ens forecast',t2-t1)
 
+    # forecast error spectra (in background, during next cycle).
     if ntime >= nassim_spinup:
-        pvfcstmean = pvens.mean(axis=0)
-        pverrspec = scalefact*rfft2(pvfcstmean - pv_truth[ntime+1])
-        psispec = models[0].invert(pverrspec)
-        psispec = psispec/(models[0].N*np.sqrt(2.))
-        kespec = (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real
-        if kespec_errmean is None:
-            kespec_errmean =\
-            (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real
-        else:
-            kespec_errmean = kespec_errmean + kespec
-        for nanal in range(nanals2):
-            pvsprdspec = scalefact*rfft2(pvens[nanal] - pvfcstmean)
-            psispec = models[0].invert(pvsprdspec)
-            psispec = psispec/(models[0].N*np.sqrt(2.))
-            kespec = (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real
-            if kespec_sprdmean is None:
-                kespec_sprdmean =\
-                (models[0].ksqlsq*(psispec*np.conjugate(psispec))).real/nanals2
-            else:
-                kespec_sprdmean = kespec_sprdmean+kespec/nanals2
-        ncount += 1
+        pipeline.diagnose(error_spectra,ntime,pvens.mean(axis=0),pvens[:nanals2].copy())
 
+pipeline.close()
 if savedata: nc.close()
 
 kespec_sprdmean = kespec_sprdmean/ncount
@@ -421,13 +559,13 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 N = models[0].N
-k = np.abs((N*np.fft.fftfreq(N))[0:(N/2)+1])
+k = np.abs((N*np.fft.fftfreq(N))[0:(N//2)+1])
 l = N*np.fft.fftfreq(N)
 k,l = np.meshgrid(k,l)
 ktot = np.sqrt(k**2+l**2)
-ktotmax = (N/2)+1
-kespec_err = np.zeros(ktotmax,np.float)
-kespec_sprd = np.zeros(ktotmax,np.float)
+ktotmax = (N//2)+1
+kespec_err = np.zeros(ktotmax,float)
+kespec_sprd = np.zeros(ktotmax,float)
 for i in range(kespec_errmean.shape[2]):
     for j in range(kespec_errmean.shape[1]):
         totwavenum = ktot[j,i]
@@ -439,7 +577,7 @@ for i in range(kespec_errmean.shape[2]):
 
 print('# mean error/spread',kespec_errmean.sum(), kespec_sprdmean.sum())
 plt.figure()
-wavenums = np.arange(ktotmax,dtype=np.float)
+wavenums = np.arange(ktotmax,dtype=float)
 for n in range(1,ktotmax):
     print('# ',wavenums[n],kespec_err[n],kespec_sprd[n])
 plt.loglog(wavenums[1:-1],kespec_err[1:-1],color='r')
@@ -0,0 +1,208 @@
+from __future__ import print_function
+import sys, os, itertools, runpy, traceback, multiprocessing, contextlib
+
+# cores (threads) used by each experiment.  The thread limits (OpenMP and
+# BLAS, used by the LETKF eigensolves and matrix products) are set before
+# numpy is imported, since the BLAS thread pools are sized when it is
+# loaded, and the worker processes inherit them.
+cores_per_expt = 1
+for name in ['OMP_NUM_THREADS','OPENBLAS_NUM_THREADS','MKL_NUM_THREADS']:
+    os.environ[name] = str(cores_per_expt)
+
+import numpy as np
+from netCDF4 import Dataset
+from multiprocessing import shared_memory
+
+# parameter sweep for sqg_enkf.py.
+# The nature run and climo files are read once into shared memory, and
+# one experiment for each combination of the parameters in sweep is run
+# in a pool of worker processes, each experiment using cores_per_expt
+# threads.  sqg_enkf.py is run (with runpy) with the
+# parameters as command line arguments and the in-memory files passed in
+# (preloaded), so it does no file reads.
+# The output of each experiment goes to outdir/<exptname>.log as it runs
+# (line buffered), and outdir/<exptname>.done is written when it finishes.
+# Finished experiments are skipped if the sweep is restarted.  The per-cycle
+# stats lines of all experiments (finished or not) are collected in
+# outdir/sweep_stats.txt, with a summary (means over cycles >= nskip_stats)
+# in outdir/sweep_summary.txt.
+# The pool workers are daemonic processes, which cannot start processes of
+# their own, so the experiments must use enkf_nproc = 1 (the parallel EnKF
+# update is not available, use cores_per_expt threads instead).
+# 'python sqg_enkf_sweep.py smoke' runs a smoke test sweep instead (2
+# experiments with a few cycles of an N=32 model, with climo and nature run
+# files made by make_smoke_files, in outdir smoke).
+
+# parameters (sqg_enkf.py command line arguments, in argv_order).
+sweep = dict(hcovlocal_scale=[1000.e3,1500.e3,2000.e3],\
+             covinflate1=[0.5,0.7,0.9],\
+             amp=['0'],hcorr=['0'],tcorr=['0'])
+argv_order = ['hcovlocal_scale','amp','hcorr','tcorr','covinflate1']
+
+driver = os.path.join(os.path.dirname(os.path.abspath(__file__)),'sqg_enkf.py')
+filename_climo = '../examples/sqg_N128_3hrly.nc' # file name for forecast model climo
+filename_truth = '../examples/sqg_N512_N128_3hrly_blockmean.nc' # file name for nature run
+outdir = 'sweep'
+
+# cores available.
+ncores = int(os.getenv('SWEEP_NCORES',multiprocessing.cpu_count()))
+nskip_stats = 80 # spinup cycles excluded from summary
+# sqg_enkf.py settings changed for all experiments (names and values).
+settings = {}
+
+smoke = len(sys.argv) > 1 and sys.argv[1] == 'smoke'
+if smoke:
+    sweep = dict(hcovlocal_scale=[2000.e3],covinflate1=[0.5,0.7],\
+                 amp=['0'],hcorr=['0'],tcorr=['0'])
+    settings = dict(nanals=8,nassim=6,nassim_spinup=2,nobs=256)
+    outdir = 'smoke'; nskip_stats = 2
+    filename_climo = os.path.join(outdir,'smoke_climo.nc')
+    filename_truth = os.path.join(outdir,'smoke_truth.nc')
+
+stats_names = ['pverr_a','pvsprd_a','pverr_b','pvsprd_b','obinc_b','osprd_b',\
+               'obinc_a','obsprd_a','omaomb/oberr','obbias_b','inflation']
+
+class InMemoryDataset:
+    # stand-in for a netCDF Dataset that has been read into memory
+    # (global attributes as attributes, variables as numpy arrays).
+    def __init__(self, filename, attrs, variables):
+        self.__dict__.update(attrs)
+        self.filename = filename
+        self.variables = variables
+    def close(self):
+        pass
+
+def read_shared(filename):
+    # read all variables of netCDF file into shared memory blocks.
+    # returns (filename, attrs, specs) and the blocks (to unlink at end).
+    nc = Dataset(filename)
+    attrs = dict((name,nc.getncattr(name)) for name in nc.ncattrs())
+    specs = {}; blocks = []
+    for name, var in nc.variables.items():
+        data = np.asarray(var[:])
+        shm = shared_memory.SharedMemory(create=True,size=max(data.nbytes,1))
+        np.ndarray(data.shape,data.dtype,buffer=shm.buf)[...] = data
+        specs[name] = (shm.name,data.shape,data.dtype.str)
+        blocks.append(shm)
+    nc.close()
+    return (filename,attrs,specs), blocks
+
+_preloaded = None; _blocks = []
+def attach(files):
+    # worker initializer:  attach to shared memory copies of files.
+    global _preloaded
+    _preloaded = {}
+    for key, (filename,attrs,specs) in files.items():
+        variables = {}
+        for name, (shmname,shape,dtype) in specs.items():
+            shm = shared_memory.SharedMemory(name=shmname)
+            _blocks.append(shm)
+            variables[name] = np.ndarray(shape,dtype,buffer=shm.buf)
+        _preloaded[key] = InMemoryDataset(filename,attrs,variables)
+
+def make_smoke_files(filename_climo, filename_truth, N=32, ntimes=40, nspinup=100):
+    # climo and nature run (ntimes 3 hourly states each, after nspinup) of
+    # an N=32 model for the smoke test sweep.
+    from sqgturb import SQG
+    nsq = 1.e-4; f = 1.e-4; g = 9.8; theta0 = 300; H = 10.e3; U = 30
+    L = 20.*np.sqrt(nsq)*H/f; dt = 1800.; diff_efold = 86400./2; tdiab = 10.*86400
+    pv = np.random.RandomState(42).normal(0,100.,size=(2,N,N)).astype(np.float32)
+    model = SQG(pv,nsq=nsq,f=f,U=U,H=H,r=0.,tdiab=tdiab,dt=dt,diff_order=8,\
+                diff_efold=diff_efold,symmetric=True,precision='single')
+    model.timesteps = 6
+    for n in range(nspinup): pv = model.advance(pv)
+    for filename in [filename_climo,filename_truth]:
+        nc = Dataset(filename,'w')
+        nc.f = f; nc.g = g; nc.theta0 = theta0; nc.nsq = nsq; nc.U = U; nc.H = H
+        nc.L = L; nc.dt = dt; nc.r = 0.; nc.tdiab = tdiab; nc.symmetric = 1
+        nc.diff_order = 8; nc.diff_efold = diff_efold
+        nc.createDimension('t',None); nc.createDimension('z',2)
+        nc.createDimension('y',N); nc.createDimension('x',N)
+        pvvar = nc.createVariable('pv',np.float32,('t','z','y','x'))
+        tvar = nc.createVariable('t',np.float32,('t',))
+        xvar = nc.createVariable('x',np.float32,('x',))
+        yvar = nc.createVariable('y',np.float32,('y',))
+        xvar[:] = np.arange(0,L,L/N); yvar[:] = np.arange(0,L,L/N)
+        for ntime in range(ntimes):
+            pv = model.advance(pv)
+            pvvar[ntime] = pv; tvar[ntime] = model.t
+        nc.close()
+
+def expt_name(params):
+    return '_'.join('%s%s' % (key,str(params[key]).replace(' ','')) for key in argv_order)
+
+def run_expt(params):
+    # run one experiment in a worker process, output to <exptname>.log.
+    name = expt_name(params)
+    sys.argv = [driver]+[str(params[key]) for key in argv_order]
+    os.environ['exptname'] = name
+    with open(name+'.log','w',1) as f, contextlib.redirect_stdout(f):
+        try:
+            runpy.run_path(driver,init_globals=dict(preloaded=_preloaded,\
+                           settings=settings),run_name='__main__')
+        except BaseException:
+            traceback.print_exc(file=f)
+            return name, False
+    open(name+'.done','w').close()
+    return name, True
+
+def read_stats(name):
+    # per-cycle stats lines (ntime + stats_names) from experiment log.
+    rows = []
+    if not os.path.exists(name+'.log'): return rows
+    for line in open(name+'.log'):
+        fields = line.split()
+        if line.startswith('#') or len(fields) != len(stats_names)+1: continue
+        try:
+            rows.append([int(fields[0])]+[float(field) for field in fields[1:]])
+        except ValueError:
+            continue
+    return rows
+
+if __name__ == '__main__':
+    if settings.get('enkf_nproc',1) > 1:
+        raise ValueError('enkf_nproc must be 1 in a sweep (workers are daemonic)')
+    keys = sorted(sweep.keys())
+    expts = [dict(zip(keys,values)) for values in itertools.product(*[sweep[key] for key in keys])]
+    if not os.path.isdir(outdir): os.makedirs(outdir)
+    if smoke and not os.path.exists(filename_truth):
+        make_smoke_files(filename_climo,filename_truth)
+    files = {}; blocks = []
+    for key, filename in [('climo',filename_climo),('truth',filename_truth)]:
+        files[key], b = read_shared(filename); blocks += b
+    os.chdir(outdir)
+    todo = [params for params in expts if not os.path.exists(expt_name(params)+'.done')]
+    nworkers = max(1,min(ncores//cores_per_expt,len(todo)))
+    print('# %s experiments (%s to run) on %s workers with %s cores each' %\
+          (len(expts),len(todo),nworkers,cores_per_expt))
+    try:
+        if todo:
+            # new process for each experiment (maxtasksperchild=1), so no
+            # state is carried over between experiments.
+            pool = multiprocessing.Pool(nworkers,initializer=attach,initargs=(files,),\
+                                        maxtasksperchild=1)
+            for name, ok in pool.imap_unordered(run_expt,todo):
+                print('# %s %s' % (name,'done' if ok else 'failed (see log)'))
+                sys.stdout.flush()
+            pool.close(); pool.join()
+    finally:
+        for shm in blocks:
+            shm.close(); shm.unlink()
+
+    # collect stats.
+    table = open('sweep_stats.txt','w'); summary = open('sweep_summary.txt','w')
+    header = ' '.join(argv_order)
+    table.write('# %s ntime %s\n' % (header,' '.join(stats_names)))
+    summary.write('# %s ncycles complete %s\n' % (header,' '.join(stats_names)))
+    for params in expts:
+        name = expt_name(params)
+        pvalues = ' '.join(str(params[key]).replace(' ','') for key in argv_order)
+        rows = read_stats(name)
+        for row in rows:
+            table.write('%s %s %s\n' % (pvalues,row[0],' '.join('%g' % val for val in row[1:])))
+        rows = [row for row in rows if row[0] >= nskip_stats]
+        if rows:
+            means = np.array(rows)[:,1:].mean(axis=0)
+            summary.write('%s %s %s %s\n' % (pvalues,len(rows),\
+                          os.path.exists(name+'.done'),' '.join('%g' % val for val in means)))
+    table.close(); summary.close()
@@ -9,7 +9,10 @@ threads = int(os.getenv('OMP_NUM_THREADS','1'))
 #filenamein = sys.argv[1]
 #fcstlen = int(sys.argv[2])
 #diff_efold = float(sys.argv[3])
-diff_efold = float(sys.argv[1])
+# diff_efold can be a comma separated list of values, forecasts for all
+# values are run together as one batched model integration.
+diff_efold = np.array([float(x) for x in sys.argv[1].split(',')])
+nparams = len(diff_efold)
 filenamein = 'sqg_N512_N128_3hrly_blockmean.nc'
 fcstlen = 8
 if len(sys.argv) > 2:
@@ -25,7 +28,7 @@ nc = Dataset(filenamein)
 pv = nc['pv'][0]
 dt = 600 # time step in seconds
 norder = 8
-model = SQG(pv,nsq=nc.nsq,f=nc.f,U=nc.U,H=nc.H,r=nc.r,tdiab=nc.tdiab,dt=dt,
+model = SQG(pv[np.newaxis]*np.ones((nparams,1,1,1),pv.dtype),nsq=nc.nsq,f=nc.f,U=nc.U,H=nc.H,r=nc.r,tdiab=nc.tdiab,dt=dt,
             diff_order=norder,diff_efold=diff_efold,
             dealias=bool(nc.dealias),symmetric=bool(nc.symmetric),threads=threads,
             precision='single')
@@ -36,13 +39,13 @@ if ntimes < 0:
     ntimes = len(nc.dimensions['t'])
 
 N = model.N
-pverrsq_mean = np.zeros((2,N,N),np.float32)
+pverrsq_mean = np.zeros((nparams,2,N,N),np.float32)
 kespec_errmean = None
 for n in range(ntimes-fcstlen):
-    pvfcst = model.advance(nc['pv'][n])
+    pvfcst = model.advance(nc['pv'][n][np.newaxis]*np.ones((nparams,1,1,1),pv.dtype))
     pvtruth = nc['pv'][n+fcstlen]
     pverrsq = (scalefact*(pvfcst - pvtruth))**2
-    if verbose: print n,np.sqrt(pverrsq.mean())
+    if verbose: print(n,np.sqrt(pverrsq.mean(axis=(-3,-2,-1))))
     pverrsq_mean += pverrsq/(ntimes-fcstlen)
 
     pverrspec = scalefact*rfft2(pvfcst - pvtruth)
@@ -55,7 +58,8 @@ for n in range(ntimes-fcstlen):
     else:
         kespec_errmean = kespec_errmean + kespec/(ntimes-fcstlen)
 
-print 'diff_efold=',diff_efold,' mean error=',np.sqrt(pverrsq_mean.mean())
+for nparam in range(nparams):
+    print('diff_efold=',diff_efold[nparam],' mean error=',np.sqrt(pverrsq_mean[nparam].mean()))
 
 #vmin = 0; vmax = 4
 #import matplotlib
@@ -65,21 +69,21 @@ print 'diff_efold=',diff_efold,' mean error=',np.sqrt(pverrsq_mean.mean())
 #im = plt.imshow(np.sqrt(pverrsq_mean[1]),cmap=plt.cm.hot_r,interpolation='nearest',origin='lower',vmin=vmin,vmax=vmax)
 #plt.title('mean error')
 
-k = np.abs((N*np.fft.fftfreq(N))[0:(N/2)+1])
+k = np.abs((N*np.fft.fftfreq(N))[0:(N//2)+1])
 l = N*np.fft.fftfreq(N)
 k,l = np.meshgrid(k,l)
 ktot = np.sqrt(k**2+l**2)
-ktotmax = (model.N/2)+1
-kespec_err = np.zeros(ktotmax,np.float)
-for i in range(kespec_errmean.shape[2]):
-    for j in range(kespec_errmean.shape[1]):
+ktotmax = (model.N//2)+1
+kespec_err = np.zeros((nparams,ktotmax),float)
+for i in range(kespec_errmean.shape[-1]):
+    for j in range(kespec_errmean.shape[-2]):
         totwavenum = ktot[j,i]
         if int(totwavenum) < ktotmax:
-            kespec_err[int(totwavenum)] = kespec_err[int(totwavenum)] +\
-            kespec_errmean[:,j,i].mean(axis=0)
+            kespec_err[:,int(totwavenum)] = kespec_err[:,int(totwavenum)] +\
+            kespec_errmean[...,j,i].mean(axis=-1)
 
 #plt.figure()
-#wavenums = np.arange(ktotmax,dtype=np.float)
+#wavenums = np.arange(ktotmax,dtype=float)
 #wavenums[0] = 1.
 #idealke = 2.*kespec_err[1]*wavenums**(-5./3,)
 #plt.loglog(wavenums,kespec_err,color='k')
@@ -2,6 +2,7 @@ from netCDF4 import Dataset
 import numpy as np
 import sys, os
 from sqgturb import SQG, RandomPattern, rfft2, irfft2
+from sqgturb.ensstats import ensemble_moments, RunningStats
 
 # get OMP_NUM_THREADS (threads to use) from environment.
 threads = int(os.getenv('OMP_NUM_THREADS','1'))
@@ -46,12 +47,12 @@ modeld = SQG(pv,nsq=nc.nsq,f=nc.f,U=nc.U,H=nc.H,r=nc.r,tdiab=nc.tdiab,dt=dt,
              diff_order=norder,diff_efold=diff_efold_det,
              dealias=True,symmetric=bool(nc.symmetric),threads=threads,
              precision='single')
-print '# random pattern amp,hcorr,tcorr,norm,nsamples = ',amp, \
-hcorr,tcorr,rp.norm,rp.nsamples
+print('# random pattern amp,hcorr,tcorr,norm,nsamples = ',amp, \
+hcorr,tcorr,rp.norm,rp.nsamples)
 fcstlenmax = 80
 fcstleninterval = 4
 fcstlenspectra = [4,16,40,80]
-fcsttimes = fcstlenmax/fcstleninterval
+fcsttimes = fcstlenmax//fcstleninterval
 outputinterval = fcstleninterval*(nc['t'][1]-nc['t'][0])
 forecast_timesteps = int(outputinterval/models[nanal].dt)
 modeld.timesteps = int(outputinterval/modeld.dt)
@@ -59,16 +60,17 @@ scalefact = nc.f*nc.theta0/nc.g
 ntimes = len(nc.dimensions['t'])
 
 N = modeld.N
-pverrsq_mean = np.zeros((fcsttimes,2,N,N),np.float)
-pverrsqd_mean = np.zeros((fcsttimes,2,N,N),np.float)
-pvspread_mean = np.zeros((fcsttimes,2,N,N),np.float)
-pvens = np.zeros((nanals,2,N,N),np.float)
-kespec_errmean = np.zeros((fcsttimes,2,N,N/2+1),np.float)
-kespec_sprdmean = np.zeros((fcsttimes,2,N,N/2+1),np.float)
+# streaming domain mean error and spread statistics for each forecast time.
+pverrsq_mean = [RunningStats(reduce_axes=(-3,-2,-1)) for nfcst in range(fcsttimes)]
+pverrsqd_mean = [RunningStats(reduce_axes=(-3,-2,-1)) for nfcst in range(fcsttimes)]
+pvspread_mean = [RunningStats(reduce_axes=(-3,-2,-1)) for nfcst in range(fcsttimes)]
+pvens = np.zeros((nanals,2,N,N),float)
+kespec_errmean = np.zeros((fcsttimes,2,N,N//2+1),float)
+kespec_sprdmean = np.zeros((fcsttimes,2,N,N//2+1),float)
 #ntimes = 120 # for debuggin
 ncount = len(range(0,ntimes-fcstlenmax,16))
-print '# ',ncount,'forecasts',fcsttimes,'forecast times',forecast_timesteps,\
-      'time steps for forecast interval'
+print('# ',ncount,'forecasts',fcsttimes,'forecast times',forecast_timesteps,\
+      'time steps for forecast interval')
 
 for n in range(0,ntimes-fcstlenmax,16):
     pvspecic = rfft2(nc['pv'][n])
@@ -84,15 +86,15 @@ for n in range(0,ntimes-fcstlenmax,16):
         for nanal in range(nanals):
             pvens[nanal] = irfft2(models[nanal].pvspec)
         pvfcstd = irfft2(modeld.pvspec)
-        pvfcstmean = pvens.mean(axis=0)
         pvtruth = nc['pv'][n+fcstlen]
-        pverrsq = (scalefact*(pvfcstmean - pvtruth))**2
+        # ensemble mean, spread and error in one pass over members.
+        pvfcstmean, pvspread, pverrsq = ensemble_moments(pvens,pvtruth)
+        pverrsq = scalefact**2*pverrsq; pvspread = scalefact**2*pvspread
         pverrsqd = (scalefact*(pvfcstd - pvtruth))**2
-        pvspread = ((scalefact*(pvens-pvfcstmean))**2).sum(axis=0)/(nanals-1)
-        if verbose: print n,fcstlen,np.sqrt(pverrsq.mean()),np.sqrt(pverrsqd.mean()),np.sqrt(pvspread.mean())
-        pvspread_mean[nfcst] += pvspread/ncount
-        pverrsq_mean[nfcst] += pverrsq/ncount
-        pverrsqd_mean[nfcst] += pverrsqd/ncount
+        if verbose: print(n,fcstlen,np.sqrt(pverrsq.mean()),np.sqrt(pverrsqd.mean()),np.sqrt(pvspread.mean()))
+        pvspread_mean[nfcst].update(pvspread)
+        pverrsq_mean[nfcst].update(pverrsq)
+        pverrsqd_mean[nfcst].update(pverrsqd)
 
         if fcstlen in fcstlenspectra:
             pverrspec = scalefact*rfft2(pvfcstmean - pvtruth)
@@ -108,13 +110,13 @@ for n in range(0,ntimes-fcstlenmax,16):
                 kespec = (modeld.ksqlsq*(psispec*np.conjugate(psispec))).real
                 kespec_sprdmean[nfcst] += kespec/(nanals*ncount)
 
-#print 'fcstlen = ',fcstlen, 'mean error =',np.sqrt(pverrsq_mean.mean()),np.sqrt(pverrsqd_mean.mean()),np.sqrt(pvspread_mean.mean())
+#print('fcstlen = ',fcstlen, 'mean error =',np.sqrt(pverrsq_mean.mean()),np.sqrt(pverrsqd_mean.mean()),np.sqrt(pvspread_mean.mean()))
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 for nfcst in range(fcsttimes):
     fcstlen = (nfcst+1)*fcstleninterval
-    print fcstlen,np.sqrt(pverrsq_mean[nfcst].mean()),np.sqrt(pverrsqd_mean[nfcst].mean()),np.sqrt(pvspread_mean[nfcst].mean())
+    print(fcstlen,np.sqrt(pverrsq_mean[nfcst].mean),np.sqrt(pverrsqd_mean[nfcst].mean),np.sqrt(pvspread_mean[nfcst].mean))
     if fcstlen in fcstlenspectra:
         #vmin = 0; vmax = 4
         #im = plt.imshow(np.sqrt(pvspread_mean[1]),cmap=plt.cm.hot_r,interpolation='nearest',origin='lower',vmin=vmin,vmax=vmax)
@@ -123,13 +125,13 @@ for nfcst in range(fcsttimes):
         #im = plt.imshow(np.sqrt(pverrsq_mean[1]),cmap=plt.cm.hot_r,interpolation='nearest',origin='lower',vmin=vmin,vmax=vmax)
         #plt.title('mean error')
 
-        k = np.abs((N*np.fft.fftfreq(N))[0:(N/2)+1])
+        k = np.abs((N*np.fft.fftfreq(N))[0:(N//2)+1])
         l = N*np.fft.fftfreq(N)
         k,l = np.meshgrid(k,l)
         ktot = np.sqrt(k**2+l**2)
-        ktotmax = N/2+1
-        kespec_err = np.zeros(ktotmax,np.float)
-        kespec_sprd = np.zeros(ktotmax,np.float)
+        ktotmax = N//2+1
+        kespec_err = np.zeros(ktotmax,float)
+        kespec_sprd = np.zeros(ktotmax,float)
         for i in range(kespec_errmean[nfcst].shape[2]):
             for j in range(kespec_errmean[nfcst].shape[1]):
                 totwavenum = ktot[j,i]
@@ -139,7 +141,7 @@ for nfcst in range(fcsttimes):
                     kespec_sprd[int(totwavenum)] = kespec_sprd[int(totwavenum)] +\
                     kespec_sprdmean[nfcst,:,j,i].mean(axis=0)
         plt.figure()
-        wavenums = np.arange(ktotmax,dtype=np.float)
+        wavenums = np.arange(ktotmax,dtype=float)
         wavenums[0] = 1.
         idealke = 2.*kespec_err[1]*wavenums**(-5./3,)
         plt.loglog(wavenums,kespec_err,color='k')
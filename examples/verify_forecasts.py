@@ -0,0 +1,91 @@
+from __future__ import print_function
+from netCDF4 import Dataset
+import numpy as np
+import sys, os
+from sqgturb import SQG, RandomPattern
+from sqgturb.randompattern import RandomPatternBatch
+from sqgturb.verification import verify_forecasts
+
+# ensemble forecast verification against a nature run (like
+# run_forecast_ran.py), with all members for batch_size start times
+# integrated together as one batched model state (sqgturb/verification.py).
+# prints rms error of ensemble mean and spread for each lead time, and
+# plots error and spread spectra.
+
+# get OMP_NUM_THREADS (threads to use) from environment.
+threads = int(os.getenv('OMP_NUM_THREADS','1'))
+
+if len(sys.argv) < 6:
+   msg="""
+python verify_forecasts.py filenamein amp hcorr tcorr norm [nanals] [batch_size]
+   """
+   raise SystemExit(msg)
+filenamein = sys.argv[1]
+amp = float(sys.argv[2])
+hcorr = float(sys.argv[3])
+tcorr = float(sys.argv[4])
+norm = sys.argv[5]
+nanals = int(sys.argv[6]) if len(sys.argv) > 6 else 10
+batch_size = int(sys.argv[7]) if len(sys.argv) > 7 else 4
+verbose=False
+
+diff_efold=86400./2.
+nsamples = 2
+dt = 600. # time step in seconds
+norder = 8
+fcstlenmax = 80
+fcstleninterval = 4
+fcstlenspectra = [4,16,40,80]
+startinterval = 16
+
+nc = Dataset(filenamein)
+scalefact = nc.f*nc.theta0/nc.g
+pv = nc['pv'][0]
+N = pv.shape[-1]
+ntimes = len(nc.dimensions['t'])
+if norm == 'pv':
+    stdev= amp/scalefact # amp given in units of K (for psi units are m**2/s)
+elif norm == 'psi':
+    stdev = amp # psi units are m**2/s
+else:
+    raise ValueError('illegal random pattern norm')
+if amp > 0:
+    rp = RandomPattern(hcorr*nc.L/N,tcorr*dt,nc.L,N,dt,nsamples=nsamples,stdev=stdev,norm=norm)
+    # independent pattern for each member and start time in batch.
+    rp = RandomPatternBatch([rp.copy(seed=n) for n in range(batch_size*nanals)],\
+                            shape=(batch_size,nanals))
+else:
+    rp = None
+# batched model, pv[batch_size,nanals,2,N,N]
+pvbatch = np.zeros((batch_size,nanals)+pv.shape,pv.dtype)
+model = SQG(pvbatch,nsq=nc.nsq,f=nc.f,U=nc.U,H=nc.H,r=nc.r,tdiab=nc.tdiab,dt=dt,
+            diff_order=norder,diff_efold=diff_efold,random_pattern=rp,
+            dealias=bool(nc.dealias),symmetric=bool(nc.symmetric),threads=threads,
+            precision='single')
+outputinterval = nc['t'][1]-nc['t'][0]
+timesteps = int(outputinterval/model.dt)
+leads = range(fcstleninterval,fcstlenmax+1,fcstleninterval)
+starts = range(0,ntimes-fcstlenmax,startinterval)
+print('# random pattern amp,hcorr,tcorr,norm,nsamples = ',amp,hcorr,tcorr,norm,nsamples)
+print('# ',len(starts),'forecasts',nanals,'members',batch_size,'start times per batch')
+
+stats = verify_forecasts(model,nc['pv'],starts,leads,timesteps,nanals=nanals,\
+        scalefact=scalefact,spectra_leads=fcstlenspectra,batch_size=batch_size,\
+        verbose=verbose)
+nc.close()
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+print('# lead rmse spread')
+for fcstlen in leads:
+    print(fcstlen,stats.rmse(fcstlen),stats.spread(fcstlen))
+    if fcstlen in fcstlenspectra:
+        wavenums, kespec_err, kespec_sprd = stats.spectra(fcstlen)
+        plt.figure()
+        wavenums = wavenums.astype(np.float64); wavenums[0] = 1.
+        plt.loglog(wavenums,kespec_err,color='k')
+        plt.loglog(wavenums,kespec_sprd,color='b')
+        plt.title('error (black) and spread (blue) spectra for hr %s' %\
+                int(3*fcstlen),fontsize=12)
+        plt.savefig('%sherr_spectrum_hcorr%s.png' % (3*fcstlen,hcorr))
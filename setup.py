@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 short_desc = "A program for simulating surface quasi-geostropic turbulence"
 setup(
   name = 'sqgturb',
@@ -8,13 +8,6 @@ setup(
   author_email = 'jeffrey dot s dot whitaker at noaa dot gov',
   url = 'https://github.com/jswhit/sqgturb',
   packages = ['sqgturb'],
-  requires = ['numpy']
+  python_requires = '>=3.6',
+  install_requires = ['numpy>=1.17','scipy']
 )
-
-
-
-
-
-
-
-
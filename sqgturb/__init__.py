@@ -16,11 +16,23 @@ time stepping (dealiasing with 2/3 rule, hyperdiffusion treated implicitly).
 
 Jeff Whitaker December, 2016 <jeffrey.s.whitaker@noaa.gov>
 """
-from sqg import SQG,  rfft2, irfft2
-from sqgens import SQGEns
-from randompattern_sample import RandomPatternSample
-from randompattern import RandomPattern
-from randompattern_ens import RandomPatternEns
-import enkf_utils
+from .sqg import SQG,  rfft2, irfft2
+from .sqgens import SQGEns
+from .randompattern_sample import RandomPatternSample
+from .randompattern import RandomPattern
+from .randompattern_ens import RandomPatternEns
+from .rngstreams import RandomStreams
+from .obsoperator import ObservationOperator
+from . import precision
+from .ensstate import EnsembleState
+from . import ensstats
+from . import obprep
+from .cycling import CyclingPipeline
+from . import obsdb
+from . import verification
+from . import enkf_utils
 
-__all__=['SQG','rfft2','irfft2','enkf_utils','RandomPattern','RandomPatternSample']
+__all__=['SQG','rfft2','irfft2','enkf_utils','RandomPattern','RandomPatternSample',\
+         'RandomStreams','precision','ObservationOperator',\
+         'EnsembleState','ensstats','obprep','CyclingPipeline','obsdb',\
+         'verification']
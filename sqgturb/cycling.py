@@ -0,0 +1,116 @@
+from __future__ import print_function
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+class _Stage:
+    # tasks run in order by one background thread, with at most
+    # max_pending tasks queued (submit blocks until the oldest finishes).
+    # With executor=None tasks run immediately in the caller's thread.
+    def __init__(self, executor, max_pending):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = deque()
+
+    def submit(self, fn, *args, **kwargs):
+        if self.executor is None:
+            fn(*args, **kwargs)
+            return
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result() # re-raises errors from fn
+        self.pending.append(self.executor.submit(fn, *args, **kwargs))
+
+    def flush(self):
+        while self.pending:
+            self.pending.popleft().result()
+
+class CyclingPipeline:
+    def __init__(self, prepare_obs, ncycles, prefetch=1, processes=False,\
+                 max_pending=2):
+        """
+        pipelined data assimilation cycling.  Work in a cycle that does not
+        depend on the ensemble is overlapped with the update and forecast:
+
+        obs stage:  prepare_obs(ntime) returns what the update for cycle
+        ntime needs from the observations (obs, forward operator,
+        localization, ...).  It must depend only on ntime (e.g. obs
+        drawn with RandomStreams keyed by cycle), and is run up to prefetch
+        cycles ahead in a background thread (in prefetch worker processes
+        if processes=True, prepare_obs must then be picklable and any
+        state it changes is not seen by the caller).  obs(ntime) returns
+        the result for cycle ntime.
+
+        output and diagnostics stages:  functions submitted with output()
+        (e.g. netCDF writes) and diagnose() (e.g. error spectra) run in
+        submission order, in one background thread per stage, overlapping
+        the next forecast or update.  Their arguments must not be changed
+        after submission (pass copies of arrays that are updated in
+        place).  At most max_pending tasks are queued in each stage.
+
+        Since each stage runs its tasks in order, and only the caller's
+        thread touches the ensemble, the results are exactly those of
+        sequential cycling, which is what prefetch=0 gives (everything run
+        in the caller's thread, in the order called).
+
+        io_lock is a lock to hold around netCDF/HDF5 reads and writes (which
+        are not thread safe) in any stage.  Errors in a stage are raised in
+        the caller's thread, by obs() or the next submission to (or close()
+        of) that stage.
+        """
+        self.prepare_obs = prepare_obs
+        self.ncycles = ncycles
+        self.prefetch = prefetch
+        self.io_lock = threading.RLock()
+        self._futures = {}
+        if prefetch > 0:
+            if processes:
+                self._obs_executor = ProcessPoolExecutor(max_workers=prefetch)
+            else:
+                self._obs_executor = ThreadPoolExecutor(max_workers=1)
+            self._output = _Stage(ThreadPoolExecutor(max_workers=1),max_pending)
+            self._diagnose = _Stage(ThreadPoolExecutor(max_workers=1),max_pending)
+        else:
+            self._obs_executor = None
+            self._output = _Stage(None,max_pending)
+            self._diagnose = _Stage(None,max_pending)
+
+    def obs(self, ntime):
+        """
+        result of prepare_obs(ntime) (cycles up to ntime+prefetch are
+        started in the background).
+        """
+        if self._obs_executor is None:
+            return self.prepare_obs(ntime)
+        for n in range(ntime,min(ntime+self.prefetch+1,self.ncycles)):
+            if n not in self._futures:
+                self._futures[n] = self._obs_executor.submit(self.prepare_obs,n)
+        # drop results for earlier cycles (not used).
+        for n in [n for n in self._futures if n < ntime]:
+            self._futures.pop(n).cancel()
+        return self._futures.pop(ntime).result()
+
+    def output(self, fn, *args, **kwargs):
+        """run fn(*args,**kwargs) in the output stage"""
+        self._output.submit(fn, *args, **kwargs)
+
+    def diagnose(self, fn, *args, **kwargs):
+        """run fn(*args,**kwargs) in the diagnostics stage"""
+        self._diagnose.submit(fn, *args, **kwargs)
+
+    def close(self):
+        """wait for all output and diagnostics tasks, and shut down workers"""
+        try:
+            self._output.flush()
+            self._diagnose.flush()
+        finally:
+            for n in list(self._futures):
+                self._futures.pop(n).cancel()
+            for stage in [self._output, self._diagnose]:
+                if stage.executor is not None: stage.executor.shutdown()
+            if self._obs_executor is not None: self._obs_executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
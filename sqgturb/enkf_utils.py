@@ -1,4 +1,12 @@
 import numpy as np
+import multiprocessing
+from scipy.sparse import csr_matrix, csc_matrix, issparse, vstack
+from scipy.spatial import cKDTree
+from .precision import get_dtype, accum_dtype
+try: # numba compiled serial EnSRF inner loop (optional)
+    from numba import njit
+except ImportError:
+    njit = None
 
 # function definitions.
 
@@ -24,67 +32,757 @@ def gaspcohn(r):
                + 4.0 - 2.0 / (3.0 * rr), taper)
     return taper
 
-def enkf_update(xens,hxens,obs,oberrs,covlocal,levob,vcovlocal_fact,obcovlocal=None):
-    """serial potter method or LETKF (if obcovlocal is None)"""
+def gaspcohn_sparse(xob,yob,x,y,xmax,ymax,hcovlocal_scale):
+    """
+    Gaspari-Cohn localization weights between obs at (xob,yob) and
+    points at (x,y) on doubly periodic plane, returned as a scipy.sparse
+    csr matrix (nobs, npoints).  Only pairs closer than hcovlocal_scale
+    (where taper is nonzero) are found (with a periodic kd-tree) and
+    stored, so memory scales as nobs times the localization footprint.
+    """
+    def tree(x,y):
+        pts = np.column_stack((np.ravel(x)%xmax,np.ravel(y)%ymax))
+        return cKDTree(pts.astype(np.float64),boxsize=(xmax,ymax))
+    dist = tree(xob,yob).sparse_distance_matrix(tree(x,y),hcovlocal_scale,\
+           output_type='ndarray')
+    taper = gaspcohn(dist['v']/hcovlocal_scale)
+    return csr_matrix((taper,(dist['i'],dist['j'])),shape=(np.size(xob),np.size(x)))
 
-    nanals, nlevs, ndim = xens.shape; nobs = obs.shape[-1]
-    xmean = xens.mean(axis=0); xprime = xens-xmean
-    hxmean = hxens.mean(axis=0); hxprime = hxens-hxmean
-    nlevob = len(levob); fact = np.array([1.,1.],np.float)
+class GridLocalization:
+    def __init__(self,nx,ny,L,hcovlocal_scale,precision=None):
+        """
+        Gaspari-Cohn localization for obs located at grid points of a
+        doubly periodic (ny,nx) grid with domain size L.
 
-    if obcovlocal is not None:  # serial EnSRF update
+        The taper depends only on the grid offset between ob and
+        state point, so one stencil (offsets and weights) is computed here
+        and the weights for each ob are obtained by shifting the stencil
+        indices (no distance computations).  The results for the last
+        ob network are cached, so fixed networks are only computed once.
+        Weights are stored in 'single' or 'double' precision (default
+        from precision.py).
+        """
+        self.nx = nx; self.ny = ny; self.L = L
+        self.hcovlocal_scale = hcovlocal_scale
+        dx = L/nx; dy = L/ny
+        # offsets within localization radius (each periodic image once).
+        di = np.arange(-((nx-1)//2),nx//2+1)
+        dj = np.arange(-((ny-1)//2),ny//2+1)
+        di = di[np.abs(di*dx) < hcovlocal_scale]
+        dj = dj[np.abs(dj*dy) < hcovlocal_scale]
+        di, dj = np.meshgrid(di, dj)
+        taper = gaspcohn(np.sqrt((di*dx)**2+(dj*dy)**2)/hcovlocal_scale)
+        mask = taper > 1.e-10
+        self.di = di[mask]; self.dj = dj[mask]
+        self.taper = taper[mask].astype(get_dtype(precision))
+        self._indxob = None
 
-        for kob in range(nlevob):
-            fact[:] = 1.; fact[1-kob] = vcovlocal_fact
-            for nob,ob,oberr in zip(np.arange(nobs),obs[kob],oberrs):
-                ominusf = ob-hxmean[kob,nob].copy()
-                hxens = hxprime[:,kob,nob].copy().reshape((nanals, 1))
-                hpbht = (hxens**2).sum()/(nanals-1)
-                gainfact = ((hpbht+oberr)/hpbht*\
-                           (1.-np.sqrt(oberr/(hpbht+oberr))))
-                # state space update
-                # only update points closer than localization radius to ob
-                mask = covlocal[nob,:] > 1.e-10
-                for k in range(2):
-                    pbht = (xprime[:,k,mask].T*hxens[:,0]).sum(axis=1)/float(nanals-1)
-                    kfgain = fact[k]*covlocal[nob,mask]*pbht/(hpbht+oberr)
-                    xmean[k,mask] = xmean[k,mask] + kfgain*ominusf
-                    xprime[:,k,mask] = xprime[:,k,mask] - gainfact*kfgain*hxens
-                # observation space update
-                # only update obs within localization radius
-                mask = obcovlocal[nob,:] > 1.e-10
-                for k in range(2):
-                    pbht = (hxprime[:,k,mask].T*hxens[:,0]).sum(axis=1)/float(nanals-1)
-                    kfgain = fact[k]*obcovlocal[nob,mask]*pbht/(hpbht+oberr)
-                    hxmean[k,mask] = hxmean[k,mask] + kfgain*ominusf
-                    hxprime[:,k,mask] = hxprime[:,k,mask] - gainfact*kfgain*hxens
-        return xmean + xprime
+    def _stencil_indices(self,indxob):
+        # flat grid indices (nobs,nstencil) of stencil points around each ob.
+        jo, io = np.divmod(np.asarray(indxob),self.nx)
+        j = (jo[:,np.newaxis]+self.dj)%self.ny
+        i = (io[:,np.newaxis]+self.di)%self.nx
+        return j*self.nx+i
 
-    else:  # LETKF update
+    def _update(self,indxob):
+        # compute localization for ob network (flat grid indices indxob,
+        # no repeated locations) if not already cached.
+        indxob = np.asarray(indxob)
+        if self._indxob is not None and np.array_equal(indxob,self._indxob):
+            return
+        nobs = len(indxob); ndim = self.nx*self.ny
+        nstencil = len(self.taper)
+        indx = self._stencil_indices(indxob)
+        indptr = nstencil*np.arange(nobs+1)
+        self._covlocal = csr_matrix((np.tile(self.taper,nobs),indx.ravel(),indptr),\
+                                    shape=(nobs,ndim))
+        # ob-ob weights: look up which stencil points are observed.
+        obmap = -np.ones(ndim,np.int64)
+        obmap[indxob] = np.arange(nobs)
+        obindx = obmap[indx]
+        mask = obindx >= 0
+        rows = np.repeat(np.arange(nobs),nstencil).reshape((nobs,nstencil))
+        self._obcovlocal = csr_matrix((np.tile(self.taper,nobs)[mask.ravel()],\
+                           (rows[mask],obindx[mask])),shape=(nobs,nobs))
+        self._indxob = indxob.copy()
+
+    def covlocal(self,indxob):
+        """sparse (nobs,nx*ny) ob to state localization weights"""
+        self._update(indxob)
+        return self._covlocal
+
+    def obcovlocal(self,indxob):
+        """sparse (nobs,nobs) ob to ob localization weights"""
+        self._update(indxob)
+        return self._obcovlocal
+
+    def kernelspec(self):
+        """
+        rfft2 (ny,nx//2+1) of the localization taper as a periodic
+        convolution kernel (taper at grid offset (dj,di) stored at
+        index (dj%ny,di%nx)), in double precision.  Used by
+        enkf_update_fft (obs at all grid points).
+        """
+        kernel = np.zeros((self.ny,self.nx),np.float64)
+        kernel[self.dj%self.ny,self.di%self.nx] = self.taper
+        return np.fft.rfft2(kernel)
+
+def _localization_csr(covlocal,thresh=1.e-10):
+    # compact (CSR) form of localization weights, keeping only
+    # entries > thresh (state points or obs affected by each ob).
+    if issparse(covlocal):
+        covlocal = csr_matrix(covlocal,copy=True)
+        covlocal.data[covlocal.data <= thresh] = 0.
+        covlocal.eliminate_zeros()
+    else:
+        covlocal = csr_matrix(np.where(covlocal > thresh, covlocal, 0.))
+    covlocal.sort_indices()
+    return covlocal
+
+def _serial_ensrf_ob(xmean,xprime,hxmean,hxprime,hxens,ominusf,oberr,\
+                     fact_state,fact_ob,covlocal,obcovlocal,nob):
+    # update state and ob priors for a single ob (ob prior perturbations
+    # hxens, innovation ominusf, error variance oberr, vertical
+    # localization factors fact_state, fact_ob for the level of the ob).
+    nanals = len(hxens)
+    hpbht = np.dot(hxens,hxens)/(nanals-1)
+    gainfact = ((hpbht+oberr)/hpbht*\
+               (1.-np.sqrt(oberr/(hpbht+oberr))))
+    # state space update
+    # only update points closer than localization radius to ob
+    i1 = covlocal.indptr[nob]; i2 = covlocal.indptr[nob+1]
+    indx = covlocal.indices[i1:i2]
+    xp = xprime[indx]
+    pbht = np.dot(xp,hxens)/(nanals-1)
+    kfgain = fact_state*covlocal.data[i1:i2,np.newaxis]*pbht/(hpbht+oberr)
+    xmean[indx] += kfgain*ominusf
+    xprime[indx] = xp - gainfact*kfgain[...,np.newaxis]*hxens
+    # observation space update
+    # only update obs within localization radius
+    i1 = obcovlocal.indptr[nob]; i2 = obcovlocal.indptr[nob+1]
+    indx = obcovlocal.indices[i1:i2]
+    hxp = hxprime[indx]
+    pbht = np.dot(hxp,hxens)/(nanals-1)
+    kfgain = fact_ob*obcovlocal.data[i1:i2,np.newaxis]*pbht/(hpbht+oberr)
+    hxmean[indx] += kfgain*ominusf
+    hxprime[indx] = hxp - gainfact*kfgain[...,np.newaxis]*hxens
+
+def _serial_ensrf_numpy(xmean,xprime,hxmean,hxprime,obs,oberrs,\
+                        fact_state,fact_ob,covlocal,obcovlocal):
+    # serial EnSRF, looping over obs. Arrays are in 'point-major' layout
+    # (xprime[ndim,2,nanals], hxprime[nobs,nlevob,nanals]), so the
+    # ensemble at the points affected by each ob is a contiguous gather.
+    nobs, nlevob, nanals = hxprime.shape
+    for kob in range(nlevob):
+        for nob in range(nobs):
+            ominusf = obs[kob,nob]-hxmean[nob,kob]
+            # inner products accumulated in double precision.
+            hxens = hxprime[nob,kob].astype(accum_dtype)
+            _serial_ensrf_ob(xmean,xprime,hxmean,hxprime,hxens,ominusf,\
+            oberrs[nob],fact_state[kob],fact_ob[kob],covlocal,obcovlocal,nob)
+
+def _csr_columns(covlocal,mask):
+    # csr matrix with only the columns where mask is True (column
+    # indices unchanged).
+    keep = mask[covlocal.indices]
+    indptr = np.concatenate(([0],np.cumsum(keep)))[covlocal.indptr]
+    return csr_matrix((covlocal.data[keep],covlocal.indices[keep],indptr),\
+                      shape=covlocal.shape)
+
+def _serial_ensrf_phases(obcovlocal,nlevob,max_phase=256):
+    # split the serial ob sequence (ob level by ob level) into phases of
+    # consecutive obs whose priors are not changed by the earlier obs in
+    # the same phase (no obcovlocal overlap), so the priors for a whole
+    # phase can be broadcast at once.  Returns the start of each phase
+    # (and the end of the last) in the sequence.
+    nobs = obcovlocal.shape[0]
+    starts = [0]; touched = np.zeros(nobs,bool); marked = []
+    for iob in range(nlevob*nobs):
+        nob = iob % nobs
+        if touched[nob] or iob-starts[-1] >= max_phase:
+            starts.append(iob)
+            for indx in marked: touched[indx] = False
+            marked = []
+        indx = obcovlocal.indices[obcovlocal.indptr[nob]:obcovlocal.indptr[nob+1]]
+        touched[indx] = True; marked.append(indx)
+    starts.append(nlevob*nobs)
+    return np.array(starts)
+
+def _serial_ensrf_worker(specs,rank,nproc,phases,fact_state,fact_ob,\
+                         covlocal,obcovlocal,barrier):
+    # serial EnSRF on one partition of state points and ob priors.  The
+    # owners of the obs in each phase broadcast their prior perturbations
+    # and innovations (through a double buffer, with one barrier per
+    # phase), then every worker updates its own points and obs, one ob
+    # at a time in the serial order (Anderson and Collins 2007).
+    shared = _SharedArrays(specs=specs); a = shared.arrays
+    try:
+        nobs, nlevob, nanals = a['hxprime'].shape
+        for nphase in range(len(phases)-1):
+            buf = a['bcast'][nphase % 2]
+            sequence = range(phases[nphase],phases[nphase+1])
+            for n, iob in enumerate(sequence):
+                kob, nob = divmod(iob,nobs)
+                if nob % nproc == rank:
+                    buf[n,:nanals] = a['hxprime'][nob,kob]
+                    buf[n,nanals] = a['obs'][kob,nob]-a['hxmean'][nob,kob]
+            barrier.wait()
+            for n, iob in enumerate(sequence):
+                kob, nob = divmod(iob,nobs)
+                _serial_ensrf_ob(a['xmean'],a['xprime'],a['hxmean'],\
+                a['hxprime'],buf[n,:nanals].copy(),buf[n,nanals],a['oberrs'][nob],\
+                fact_state[kob],fact_ob[kob],covlocal,obcovlocal,nob)
+    finally:
+        shared.close()
+
+def _serial_ensrf_parallel(xmean,xprime,hxmean,hxprime,obs,oberrs,\
+                           fact_state,fact_ob,covlocal,obcovlocal,nproc,phases):
+    # serial EnSRF with state points and ob priors distributed (round
+    # robin, so the points near each ob are spread over all workers)
+    # among nproc processes, one barrier per phase (_serial_ensrf_phases).
+    # Arrays are updated in place.
+    ndim = xprime.shape[0]; nobs, nlevob, nanals = hxprime.shape
+    max_phase = np.diff(phases).max()
+    arrays = {'xmean':xmean,'xprime':xprime,'hxmean':hxmean,'hxprime':hxprime,\
+              'obs':obs,'oberrs':oberrs,\
+              'bcast':np.zeros((2,max_phase,nanals+1),accum_dtype)}
+    shared = _SharedArrays(arrays)
+    try:
+        barrier = multiprocessing.Barrier(nproc)
+        procs = []
+        for rank in range(nproc):
+            p = multiprocessing.Process(target=_serial_ensrf_worker,\
+                args=(shared.specs,rank,nproc,phases,fact_state,fact_ob,\
+                _csr_columns(covlocal,np.arange(ndim) % nproc == rank),\
+                _csr_columns(obcovlocal,np.arange(nobs) % nproc == rank),\
+                barrier))
+            p.start(); procs.append(p)
+        # if a worker fails, release the others from the barrier.
+        while any(p.is_alive() for p in procs):
+            for p in procs:
+                p.join(0.1)
+                if p.exitcode not in (None,0): barrier.abort()
+        if any(p.exitcode != 0 for p in procs):
+            raise RuntimeError('serial EnSRF worker process failed')
+        for name in ['xmean','xprime','hxmean','hxprime']:
+            arrays[name][...] = shared.arrays[name]
+    finally:
+        shared.close()
+
+def _serial_ensrf_loops(xmean,xprime,hxmean,hxprime,obs,oberrs,\
+                        fact_state,fact_ob,indptr,indices,weights,\
+                        obindptr,obindices,obweights):
+    # explicit loop version of _serial_ensrf_numpy (compiled with numba).
+    nobs, nlevob, nanals = hxprime.shape
+    nlev = xprime.shape[1]
+    hxens = np.empty(nanals,np.float64)
+    for kob in range(nlevob):
+        for nob in range(nobs):
+            ominusf = obs[kob,nob]-hxmean[nob,kob]
+            oberr = oberrs[nob]
+            hpbht = 0.
+            for nanal in range(nanals):
+                hxens[nanal] = hxprime[nob,kob,nanal]
+                hpbht += hxens[nanal]**2
+            hpbht = hpbht/(nanals-1)
+            gainfact = ((hpbht+oberr)/hpbht*\
+                       (1.-np.sqrt(oberr/(hpbht+oberr))))
+            for i in range(indptr[nob],indptr[nob+1]):
+                n = indices[i]
+                for k in range(nlev):
+                    pbht = 0.
+                    for nanal in range(nanals):
+                        pbht += xprime[n,k,nanal]*hxens[nanal]
+                    pbht = pbht/(nanals-1)
+                    kfgain = fact_state[kob,k]*weights[i]*pbht/(hpbht+oberr)
+                    xmean[n,k] += kfgain*ominusf
+                    for nanal in range(nanals):
+                        xprime[n,k,nanal] -= gainfact*kfgain*hxens[nanal]
+            for i in range(obindptr[nob],obindptr[nob+1]):
+                n = obindices[i]
+                for k in range(nlevob):
+                    pbht = 0.
+                    for nanal in range(nanals):
+                        pbht += hxprime[n,k,nanal]*hxens[nanal]
+                    pbht = pbht/(nanals-1)
+                    kfgain = fact_ob[kob,k]*obweights[i]*pbht/(hpbht+oberr)
+                    hxmean[n,k] += kfgain*ominusf
+                    for nanal in range(nanals):
+                        hxprime[n,k,nanal] -= gainfact*kfgain*hxens[nanal]
+
+if njit is not None:
+    _serial_ensrf_numba = njit(cache=True)(_serial_ensrf_loops)
+else:
+    _serial_ensrf_numba = None
+
+def _letkf_covlocal(covlocal,fact):
+    # stack localization for each ob level (scaled by vertical
+    # localization factor) into (nlevob*nobs,ndim) CSC matrix.
+    covlocal_k = vstack([f*covlocal for f in fact]).tocsc()
+    covlocal_k.data[covlocal_k.data <= 1.e-10] = 0.
+    covlocal_k.eliminate_zeros()
+    return covlocal_k
+
+def _letkf_weights(hx,omf,oberrvar,covlocal,points,maxsize=2**24):
+    """
+    LETKF analysis weights (npts,nanals,nanals) for state points 'points'.
+    Points are grouped by number of local obs, and the local
+    eigenproblems for each group are solved with batched linear algebra
+    (R**-1 diagonal, stored as a vector), in double precision.  maxsize
+    limits the number of elements in work arrays.
+    """
+    nanals = hx.shape[0]
+    wts = np.empty((len(points),nanals,nanals),hx.dtype)
+    nlocal = covlocal.indptr[points+1]-covlocal.indptr[points]
+    for nob in np.unique(nlocal):
+        group = np.nonzero(nlocal == nob)[0]
+        npts = max(1,maxsize//(nanals*max(nob,nanals)))
+        for n1 in range(0,len(group),npts):
+            g = group[n1:n1+npts]
+            indx = covlocal.indptr[points[g]][:,np.newaxis]+np.arange(nob)
+            obindx = covlocal.indices[indx]
+            hxloc = hx[:,obindx].transpose((1,0,2)).astype(accum_dtype) # (npts,nanals,nob)
+            rinv = covlocal.data[indx].astype(accum_dtype)/oberrvar[obindx]
+            YbRinv = hxloc*rinv[:,np.newaxis,:]
+            pa = np.matmul(YbRinv,hxloc.transpose((0,2,1)))
+            pa += (nanals-1)*np.eye(nanals)
+            evals, eigs = np.linalg.eigh(pa)
+            painv = np.matmul(eigs/np.sqrt(evals)[:,np.newaxis,:],eigs.transpose((0,2,1)))
+            tmp = np.matmul(YbRinv,omf[obindx][...,np.newaxis].astype(accum_dtype))
+            tmp = np.matmul(painv,np.matmul(painv.transpose((0,2,1)),tmp))
+            wts[g] = np.sqrt(nanals-1)*painv + tmp
+    return wts
+
+def _letkf_update_points(xens,xmean,xprime,hx,omf,oberrvar,covlocal,points,\
+                         maxsize=2**24):
+    # LETKF update of xens[:,points] (one level), in chunks of points.
+    # xprime can be the same array as xens (each point is only updated
+    # from its own perturbations).
+    nanals = hx.shape[0]
+    npts = max(1,maxsize//nanals**2)
+    for n1 in range(0,len(points),npts):
+        p = points[n1:n1+npts]
+        wts = _letkf_weights(hx,omf,oberrvar,covlocal,p,maxsize=maxsize)
+        xens[:,p] = xmean[p] + np.einsum('pij,ip->jp',wts,xprime[:,p])
+
+class _SharedArrays:
+    # numpy arrays in multiprocessing.shared_memory blocks.  Created from
+    # a dict of arrays in the parent process, and attached to by name
+    # (using the specs attribute) in worker processes.
+    def __init__(self,arrays=None,specs=None):
+        # imported here, so only the parallel paths need python >= 3.8.
+        from multiprocessing import shared_memory
+        self.shm = {}; self.arrays = {}
+        if specs is None:
+            specs = {}
+            for name, arr in arrays.items():
+                arr = np.asarray(arr)
+                shm = shared_memory.SharedMemory(create=True,size=max(arr.nbytes,1))
+                self.shm[name] = shm
+                self.arrays[name] = np.ndarray(arr.shape,arr.dtype,buffer=shm.buf)
+                self.arrays[name][...] = arr
+                specs[name] = (shm.name,arr.shape,arr.dtype.str)
+            self.owner = True
+        else:
+            for name, (shmname,shape,dtype) in specs.items():
+                shm = shared_memory.SharedMemory(name=shmname)
+                self.shm[name] = shm
+                self.arrays[name] = np.ndarray(shape,dtype,buffer=shm.buf)
+            self.owner = False
+        self.specs = specs
+    def close(self):
+        self.arrays = {}
+        for shm in self.shm.values():
+            shm.close()
+            if self.owner: shm.unlink()
+        self.shm = {}
+
+def _grid_tiles(ndim,nx,tile_size):
+    # split ndim=ny*nx grid points into tile_size x tile_size tiles.
+    ny = ndim//nx; tiles = []
+    for j in range(0,ny,tile_size):
+        for i in range(0,nx,tile_size):
+            jj = np.arange(j,min(j+tile_size,ny)); ii = np.arange(i,min(i+tile_size,nx))
+            tiles.append((nx*jj[:,np.newaxis]+ii).ravel())
+    return tiles
+
+def _letkf_tile(arrays,k,points):
+    # LETKF update of tile 'points' on level k (arrays is a dict of
+    # work arrays, possibly in shared memory).  xens updated in place.
+    indptr = arrays['indptr%s' % k]
+    covlocal = csc_matrix((arrays['data%s' % k],arrays['indices%s' % k],indptr),\
+               shape=(len(arrays['omf']),len(indptr)-1))
+    # xens holds the perturbations on entry (updated in place).
+    _letkf_update_points(arrays['xens'][:,k],arrays['xmean'][k],\
+    arrays['xens'][:,k],arrays['hx'],arrays['omf'],arrays['oberrvar'],\
+    covlocal,points)
+
+_letkf_shared = None # work arrays attached in LETKF worker process
+def _letkf_worker_init(specs):
+    global _letkf_shared
+    _letkf_shared = _SharedArrays(specs=specs)
+def _letkf_worker(task):
+    _letkf_tile(_letkf_shared.arrays,*task)
+
+def _letkf_update_tiles(arrays,nx,nproc=1,tile_size=16):
+    # LETKF update by tiles of grid points, using nproc worker processes
+    # sharing the work arrays.  The same tiles (and hence the same
+    # arithmetic) are used for any nproc, so the result does not depend
+    # on the number of processes.
+    nanals, nlevs, ndim = arrays['xens'].shape
+    tiles = _grid_tiles(ndim,nx,tile_size)
+    tasks = []; cost = []
+    for k in range(nlevs):
+        nlocal = np.diff(arrays['indptr%s' % k])
+        for points in tiles:
+            tasks.append((k,points))
+            cost.append((nlocal[points]+nanals).sum())
+    if nproc <= 1:
+        for task in tasks:
+            _letkf_tile(arrays,*task)
+        return arrays['xens']
+    # most expensive tiles (most local obs) first, handed out one at a
+    # time to balance the load.
+    tasks = [tasks[n] for n in np.argsort(cost,kind='stable')[::-1]]
+    shared = _SharedArrays(arrays)
+    try:
+        pool = multiprocessing.Pool(nproc,initializer=_letkf_worker_init,\
+                                    initargs=(shared.specs,))
+        try:
+            for result in pool.imap_unordered(_letkf_worker,tasks,chunksize=1):
+                pass
+        finally:
+            pool.close(); pool.join()
+        arrays['xens'][...] = shared.arrays['xens']
+    finally:
+        shared.close()
+    return arrays['xens']
+
+def _interp_periodic(w,n,axis,method='bilinear'):
+    # interpolate w (periodic, every m-th point along axis) to n points.
+    nc = w.shape[axis]; m = n//nc
+    if method == 'bilinear':
+        i = np.arange(n)
+        fact = ((i % m)/float(m)).reshape((-1,)+(w.ndim-axis-1)*(1,))
+        return (1.-fact)*np.take(w,i//m,axis=axis) +\
+               fact*np.take(w,(i//m+1) % nc,axis=axis)
+    elif method == 'spectral':
+        # zero-pad fourier coefficients (nyquist coefficient split between
+        # positive and negative wavenumbers).
+        wspec = np.fft.rfft(w,axis=axis)
+        shape = list(wspec.shape); shape[axis] = n//2+1
+        wspec_pad = np.zeros(shape,wspec.dtype)
+        indx = [slice(None)]*w.ndim; indx[axis] = slice(0,nc//2+1)
+        wspec_pad[tuple(indx)] = wspec
+        if nc % 2 == 0:
+            indx[axis] = nc//2
+            wspec_pad[tuple(indx)] *= 0.5
+        return (float(n)/nc)*np.fft.irfft(wspec_pad,n,axis=axis)
+    else:
+        raise ValueError("weight_interp must be 'bilinear' or 'spectral'")
+
+def _letkf_update_interp(xens,xmean,xprime,hx,omf,oberrvar,covlocal,\
+                         nx,ny,m,method='bilinear'):
+    # LETKF update of xens[:,ny*nx] (one level) with weights computed every
+    # m-th grid point and interpolated to the full grid (Yang et al 2009,
+    # doi:10.1002/qj.371).
+    nanals = hx.shape[0]; nxc = nx//m; nyc = ny//m
+    points = (m*nx*np.arange(nyc)[:,np.newaxis]+m*np.arange(nxc)).ravel()
+    wts = _letkf_weights(hx,omf,oberrvar,covlocal,points)
+    wts = wts.reshape((nyc,nxc,nanals,nanals))
+    xprime = xprime.reshape((nanals,ny,nx))
+    # interpolate weights for one analysis member at a time.
+    for j in range(nanals):
+        wtsj = _interp_periodic(wts[...,j],nx,1,method=method)
+        wtsj = _interp_periodic(wtsj,ny,0,method=method)
+        xens[j] = xmean + np.einsum('yxi,iyx->yx',wtsj,xprime).ravel()
+
+def _no_localization(covlocal,thresh=1.e-6):
+    # true if all ob-state localization weights are (within thresh of) one.
+    if covlocal is None:
+        return True
+    if issparse(covlocal):
+        if covlocal.nnz < covlocal.shape[0]*covlocal.shape[1]:
+            return False
+        data = covlocal.tocsr().data
+    else:
+        data = np.asarray(covlocal)
+    return data.min() >= 1.-thresh
 
-        ndim1 = covlocal.shape[-1]
-        hx = np.empty((nanals,nlevob*nobs),np.float)
-        omf = np.empty(nlevob*nobs,np.float)
-        oberrvar = np.empty(nlevob*nobs, np.float)
-        covlocal_tmp = np.empty((nlevob*nobs,2,ndim1),np.float)
+def _global_transform(xens,xmean,xprime,hx,omf,oberrvar,fact,maxsize=2**24):
+    # ETKF update of xens[:,ndim] (one level) with no horizontal
+    # localization: a single ensemble space transform (obs weighted by
+    # vertical localization factors fact), applied to all points with
+    # matrix products over chunks of points (xprime can be the same array
+    # as xens).
+    nobs = len(omf)//len(fact)
+    weights = np.repeat(fact,nobs)
+    mask = weights > 1.e-10
+    indices = np.nonzero(mask)[0]
+    covlocal = csc_matrix((weights[mask],indices,[0,len(indices)]),\
+                          shape=(len(omf),1))
+    wts = _letkf_weights(hx,omf,oberrvar,covlocal,np.array([0]))[0].T
+    npts = max(1,maxsize//len(wts))
+    for n1 in range(0,xens.shape[1],npts):
+        p = slice(n1,n1+npts)
+        xens[:,p] = xmean[p] + np.dot(wts,xprime[:,p])
+
+def enkf_update(xens,hxens,obs,oberrs,covlocal,levob,vcovlocal_fact,obcovlocal=None,\
+                use_numba=None,weight_interval=1,weight_interp='bilinear',nx=None,\
+                nproc=1,tile_size=16,global_transform=None,min_phase_work=2**13):
+    """serial potter method or LETKF (if obcovlocal is None).
+    xens is updated in place (and returned).  The ensemble mean is
+    removed from xens in place, so the LETKF and global ETKF work on
+    views of xens with no ensemble sized copies (except weight_interval
+    > 1, which keeps a copy of the perturbations for one level at a
+    time).  The serial EnSRF makes one 'point-major' work copy of the
+    perturbations (so the gathers for each ob are contiguous).  If an
+    error is raised, xens may be left holding perturbations.
+
+    covlocal (nobs,ndim) and obcovlocal (nobs,nobs) localization weights can
+    be dense arrays or scipy.sparse matrices.  For the serial EnSRF only
+    the nonzero weights are visited.  If use_numba is None, a numba compiled
+    inner loop is used if numba is installed.
+
+    xens can be single or double precision.  Work arrays (and the
+    result) have the precision of xens, with ensemble means, inner products
+    and the local LETKF eigenproblems accumulated in double precision.
+
+    For the LETKF, if weight_interval > 1 the analysis weights are only
+    computed every weight_interval grid points in each direction and
+    interpolated to the full (periodic) grid, using weight_interp =
+    'bilinear' or 'spectral'.  nx is the number of grid points in the
+    x direction (default assumes a square grid, nx = sqrt(ndim)), and must be
+    divisible by weight_interval (as must ny = ndim/nx).
+
+    If nproc > 1 the serial EnSRF state points and ob priors are
+    partitioned among nproc worker processes (numba is not used), and
+    the prior for each ob is broadcast before it is assimilated
+    (Anderson and Collins 2007, doi:10.1175/JTECH2049.1).  Runs of
+    consecutive obs whose priors are not changed by each other (no
+    obcovlocal overlap) are broadcast together, with one barrier per
+    run, and then assimilated one at a time in the serial order.  The
+    analysis agrees with nproc=1 to roundoff.  A barrier costs tens of
+    microseconds, about as long as the numpy ob update takes for a few
+    thousand element updates (points x levels x members).  So with
+    little work per run (e.g. dense networks with small localization
+    radii, where runs are short) the workers mostly wait.  If the mean
+    number of element updates (state and ob priors) per worker per run
+    is less than min_phase_work, the update is done in this process
+    instead (as for nproc=1).
+
+    The LETKF update (weight_interval=1) is done by tiles of
+    tile_size x tile_size grid points, distributed over nproc worker
+    processes (the ensemble and localization are put in shared memory).
+    The result is the same for any nproc.  The parallel paths (nproc > 1)
+    use multiprocessing.shared_memory, and need python >= 3.8.
+
+    If global_transform is True (or None, and covlocal is None or all its
+    weights are one), there is no horizontal localization, and a single
+    global ETKF transform (per state level, including vertical
+    localization) is computed in ensemble space and applied to the whole
+    state, for either method (obcovlocal is then not used).  The serial
+    EnSRF gives the same analysis mean and covariance in this limit (if
+    vcovlocal_fact=1), but different perturbations."""
+
+    nanals, nlevs, ndim = xens.shape; nobs = obs.shape[-1]
+    # work arrays have the precision of xens (means accumulated in
+    # double precision).
+    dtype = xens.dtype
+    # xens holds the perturbations from here on (xprime is a view).
+    xmean = xens.mean(axis=0,dtype=accum_dtype).astype(dtype)
+    xens -= xmean; xprime = xens
+    hxmean = hxens.mean(axis=0,dtype=accum_dtype).astype(dtype)
+    hxprime = (hxens-hxmean).astype(dtype)
+    nlevob = len(levob)
+
+    # vertical localization factors for state levels and ob levels
+    # (1 for the level of the ob, vcovlocal_fact for the other level).
+    fact_state = np.empty((nlevob,nlevs),dtype)
+    fact_ob = np.empty((nlevob,nlevob),dtype)
+    for kob in range(nlevob):
+        for k in range(nlevs):
+            fact_state[kob,k] = 1. if k == levob[kob] else vcovlocal_fact
+        for k in range(nlevob):
+            fact_ob[kob,k] = 1. if levob[k] == levob[kob] else vcovlocal_fact
+
+    if global_transform is None:
+        global_transform = _no_localization(covlocal)
+    if global_transform or obcovlocal is None:
+        # ob space arrays for LETKF/ETKF (all ob levels)
+        hx = np.empty((nanals,nlevob*nobs),dtype)
+        omf = np.empty(nlevob*nobs,dtype)
+        oberrvar = np.empty(nlevob*nobs,dtype)
         for kob in range(nlevob):
-            fact[:] = 1.; fact[1-kob] = vcovlocal_fact
             oberrvar[kob*nobs:(kob+1)*nobs] = oberrs[:]
             omf[kob*nobs:(kob+1)*nobs] = obs[kob,:]-hxmean[kob,:]
             hx[:,kob*nobs:(kob+1)*nobs] = hxprime[:,kob,:]
-            for k in range(2):
-                covlocal_tmp[kob*nobs:(kob+1)*nobs,k,:] = fact[k]*covlocal[:,:]
-        def calcwts(hx,Rinv,ominusf):
-            YbRinv = np.dot(hx, Rinv)
-            pa = (nanals-1)*np.eye(nanals) + np.dot(YbRinv, hx.T)
-            evals, eigs = np.linalg.eigh(pa)
-            painv = np.dot(np.dot(eigs, np.diag(np.sqrt(1./evals))), eigs.T)
-            tmp = np.dot(np.dot(np.dot(painv, painv.T), YbRinv), ominusf)
-            return np.sqrt(nanals-1)*painv + tmp[:,np.newaxis]
-        for n in range(ndim1):
-            for k in range(2):
-                mask = covlocal_tmp[:,k,n] > 1.e-10
-                Rinv = np.diag(covlocal_tmp[mask,k,n]/oberrvar[mask])
-                wts = calcwts(hx[:,mask],Rinv,omf[mask])
-                xens[:,k,n] = xmean[k,n] + np.dot(wts.T, xprime[:,k,n])
+
+    if global_transform:  # ETKF update, no horizontal localization
+
+        for k in range(nlevs):
+            _global_transform(xens[:,k],xmean[k],xprime[:,k],hx,omf,oberrvar,\
+                              fact_state[:,k])
+        return xens
+
+    elif obcovlocal is not None:  # serial EnSRF update
+
+        covlocal = _localization_csr(covlocal)
+        obcovlocal = _localization_csr(obcovlocal)
+        # contiguous 'point-major' work arrays.
+        xmean = np.ascontiguousarray(xmean.T)
+        xprime = np.ascontiguousarray(xens.transpose((2,1,0)))
+        hxmean = np.ascontiguousarray(hxmean.T)
+        hxprime = np.ascontiguousarray(hxprime.transpose((2,1,0)))
+        if use_numba is None: use_numba = _serial_ensrf_numba is not None
+        if nproc > 1:
+            phases = _serial_ensrf_phases(obcovlocal,nlevob)
+            # element updates per worker per phase.
+            work = nlevob*nanals*(nlevs*covlocal.nnz+nlevob*obcovlocal.nnz)
+            if work < min_phase_work*nproc*(len(phases)-1): nproc = 1
+        if nproc > 1:
+            _serial_ensrf_parallel(xmean,xprime,hxmean,hxprime,\
+            np.asarray(obs,xprime.dtype),np.asarray(oberrs,xprime.dtype),\
+            fact_state,fact_ob,covlocal,obcovlocal,nproc,phases)
+        elif use_numba:
+            if _serial_ensrf_numba is None:
+                raise ValueError('numba not installed')
+            _serial_ensrf_numba(xmean,xprime,hxmean,hxprime,\
+            np.asarray(obs,xprime.dtype),np.asarray(oberrs,xprime.dtype),\
+            fact_state,fact_ob,covlocal.indptr,covlocal.indices,covlocal.data,\
+            obcovlocal.indptr,obcovlocal.indices,obcovlocal.data)
+        else:
+            _serial_ensrf_numpy(xmean,xprime,hxmean,hxprime,obs,oberrs,\
+                                fact_state,fact_ob,covlocal,obcovlocal)
+        xens[...] = xprime.transpose((2,1,0)); xprime = None
+        xens += xmean.T
         return xens
+
+    else:  # LETKF update
+
+        covlocal = _localization_csr(covlocal)
+        if nx is None:
+            nx = int(round(np.sqrt(ndim)))
+            if nx*nx != ndim: nx = ndim
+        ny = ndim//nx
+        if nx*ny != ndim:
+            raise ValueError('nx does not divide ndim')
+        if weight_interval > 1:
+            if nx % weight_interval or ny % weight_interval:
+                raise ValueError('grid dimensions must be divisible by weight_interval')
+            for k in range(nlevs):
+                covlocal_k = _letkf_covlocal(covlocal,fact_state[:,k])
+                # (all members are needed for each point, so the
+                # perturbations for this level are copied).
+                _letkf_update_interp(xens[:,k],xmean[k],xprime[:,k].copy(),hx,omf,\
+                oberrvar,covlocal_k,nx,ny,weight_interval,method=weight_interp)
+            return xens
+        # (xens holds the perturbations, updated in place by tiles).
+        arrays = {'xens':xens,'xmean':xmean,'hx':hx,'omf':omf,\
+                  'oberrvar':oberrvar}
+        for k in range(nlevs):
+            # localization weights for obs (rows, all ob levels) around
+            # each state point (columns).
+            covlocal_k = _letkf_covlocal(covlocal,fact_state[:,k])
+            arrays['indptr%s' % k] = covlocal_k.indptr
+            arrays['indices%s' % k] = covlocal_k.indices
+            arrays['data%s' % k] = covlocal_k.data
+        return _letkf_update_tiles(arrays,nx,nproc=nproc,tile_size=tile_size)
+
+def _fft_localized_cov(xprime,yprime,v,kernelspec,fact):
+    # localized covariance product (rho o X'Y'^T/(nanals-1)) v for obs at
+    # all grid points, with the horizontal taper rho applied by fft
+    # convolution with kernelspec and vertical factors fact[kob,k]:
+    # out[r,k] = sum_n x'_n[k] * (rho conv sum_kob fact[kob,k]*y'_n[kob]*v[r,kob]).
+    # xprime (nanals,nlevs,ny,nx), yprime (nanals,nlevob,ny,nx),
+    # v (nrhs,nlevob,ny,nx).  Members are done one at a time, all right
+    # hand sides and levels with one batched transform.
+    nanals, nlevs, ny, nx = xprime.shape
+    out = np.zeros((v.shape[0],nlevs,ny,nx),np.float64)
+    for nanal in range(nanals):
+        tmp = np.fft.rfft2(yprime[nanal]*v)
+        tmp = np.einsum('ok,royx->rkyx',fact,tmp)
+        out += xprime[nanal]*np.fft.irfft2(kernelspec*tmp,s=(ny,nx))
+    return out/(nanals-1)
+
+def _pcg(matvec,b,precond,tol=1.e-6,maxiter=500):
+    # jacobi preconditioned conjugate gradient solve of A x = b (A
+    # symmetric positive definite, applied by matvec) for a batch of
+    # right hand sides b[r,...], iterated until every residual norm is
+    # < tol times the norm of its right hand side.  Returns solution and
+    # number of iterations.
+    axes = tuple(range(1,b.ndim))
+    def dot(a,b):
+        return (a*b).sum(axis=axes)
+    def bcast(a):
+        return a.reshape((-1,)+(1,)*len(axes))
+    x = np.zeros(b.shape,np.float64)
+    r = b.astype(np.float64)
+    bnorm = np.sqrt(dot(r,r))
+    z = r/precond; p = z.copy(); rz = dot(r,z)
+    niter = 0
+    while niter < maxiter:
+        if (np.sqrt(dot(r,r)) <= tol*bnorm).all(): break
+        ap = matvec(p)
+        pap = dot(p,ap)
+        alpha = np.where(pap > 0., rz/np.where(pap > 0., pap, 1.), 0.)
+        x += bcast(alpha)*p; r -= bcast(alpha)*ap
+        z = r/precond; rznew = dot(r,z)
+        beta = np.where(rz > 0., rznew/np.where(rz > 0., rz, 1.), 0.)
+        p = z + bcast(beta)*p; rz = rznew
+        niter += 1
+    return x, niter
+
+def enkf_update_fft(xens,hxens,obs,oberrs,localization,levob,vcovlocal_fact,\
+                    tol=1.e-6,maxiter=500):
+    """
+    localized EnKF update for grid-complete ob networks (obs at every grid
+    point of the levels levob, in flat grid order, as for nobs=-1).
+    xens (nanals,nlevs,ny*nx) is updated in place.
+
+    The Gaspari-Cohn taper from localization (a GridLocalization
+    instance) is translation invariant on the periodic grid, so the
+    localized covariance products (rho o P)H^T v are convolutions, computed
+    with batched ffts (cost ~ nanals*N**2*log(N) instead of a dense
+    (nobs,nobs) localization).  (rho o HPH^T + R) z = d is solved
+    with a preconditioned conjugate gradient method (_pcg) in ob space,
+    for the mean innovation and (to update the perturbations with the
+    deterministic EnKF of Sakov and Oke 2008, x' -> x' - K Hx'/2) for each
+    member's ob prior perturbation at once.  The result is the same as
+    a batch update with the dense localized gain
+    K = (rho o PH^T)(rho o HPH^T + R)^-1 (up to the solver tolerance tol).
+    Returns xens and the number of iterations.
+    """
+    nanals, nlevs, ndim = xens.shape
+    nx = localization.nx; ny = localization.ny
+    nlevob = len(levob)
+    if hxens.shape[-1] != ndim:
+        raise ValueError('enkf_update_fft needs obs at every grid point')
+    dtype = xens.dtype
+    xmean = xens.mean(axis=0,dtype=accum_dtype)
+    xprime = (xens-xmean).reshape((nanals,nlevs,ny,nx))
+    hxmean = hxens.mean(axis=0,dtype=accum_dtype)
+    hxprime = (hxens-hxmean).reshape((nanals,nlevob,ny,nx))
+    omf = (obs-hxmean).reshape((nlevob,ny,nx))
+    oberrvar = np.asarray(oberrs,accum_dtype).reshape((ny,nx))
+
+    # vertical localization factors (as in enkf_update).
+    fact_state = np.empty((nlevob,nlevs),np.float64)
+    fact_ob = np.empty((nlevob,nlevob),np.float64)
+    for kob in range(nlevob):
+        for k in range(nlevs):
+            fact_state[kob,k] = 1. if k == levob[kob] else vcovlocal_fact
+        for k in range(nlevob):
+            fact_ob[kob,k] = 1. if levob[k] == levob[kob] else vcovlocal_fact
+
+    kernelspec = localization.kernelspec()
+    def matvec(v):
+        return _fft_localized_cov(hxprime,hxprime,v,kernelspec,fact_ob)+oberrvar*v
+    # diagonal of (rho o HPH^T + R) (taper is one at zero offset).
+    precond = (hxprime**2).sum(axis=0)/(nanals-1)+oberrvar
+    rhs = np.concatenate((omf[np.newaxis],hxprime),axis=0)
+    z, niter = _pcg(matvec,rhs,precond,tol=tol,maxiter=maxiter)
+    inc = _fft_localized_cov(xprime,hxprime,z,kernelspec,fact_state)
+    xprime -= 0.5*inc[1:]
+    xens[...] = (xmean+(xprime+inc[0]).reshape((nanals,nlevs,ndim))).astype(dtype)
+    return xens, niter
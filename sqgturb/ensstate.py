@@ -0,0 +1,106 @@
+from __future__ import print_function
+import numpy as np
+from .precision import get_dtype, accum_dtype
+from .enkf_utils import enkf_update
+from .ensstats import ensemble_moments
+
+class EnsembleState:
+    def __init__(self, nanals, ny, nx, nlevs=2, precision=None, data=None):
+        """
+        container for an ensemble of model states, stored in one
+        contiguous buffer.  The same memory is exposed as
+
+        grid:  (nanals,nlevs,ny,nx) view (model states),
+        flat:  (nanals,nlevs,ny*nx) view (EnKF state vectors),
+
+        so no copies are needed to go between the model and the EnKF.
+        The analysis (update) and inflation (inflate) are done in place.
+        Means and variances are accumulated in double precision, one member
+        at a time (no full size temporaries).
+
+        precision:  'single' or 'double' (default from precision.py).
+        data:  optional existing (nanals,nlevs,ny,nx) C contiguous array
+        to use as buffer.
+        """
+        if data is None:
+            data = np.empty((nanals,nlevs,ny,nx),get_dtype(precision))
+        elif data.shape != (nanals,nlevs,ny,nx) or not data.flags['C_CONTIGUOUS']:
+            raise ValueError('data must be a C contiguous (nanals,nlevs,ny,nx) array')
+        self.nanals = nanals; self.nlevs = nlevs; self.ny = ny; self.nx = nx
+        self.grid = data
+        self.flat = data.reshape((nanals,nlevs,ny*nx))
+        self.dtype = data.dtype
+
+    def __getitem__(self,nanal):
+        return self.grid[nanal]
+
+    def __setitem__(self,nanal,value):
+        self.grid[nanal] = value
+
+    def mean(self):
+        """ensemble mean (nlevs,ny,nx)"""
+        return self.grid.mean(axis=0,dtype=accum_dtype).astype(self.dtype)
+
+    def moments(self,truth=None):
+        """
+        ensemble mean, variance (and squared error of mean if truth
+        given), in double precision, from one pass over the members
+        (see ensstats.ensemble_moments).
+        """
+        return ensemble_moments(self.grid,truth)
+
+    def variance(self):
+        """ensemble variance (nlevs,ny,nx), in double precision"""
+        return self.moments()[1]
+
+    def remove_mean(self):
+        """
+        subtract ensemble mean in place (the buffer then holds the
+        perturbations) and return the mean.
+        """
+        mean = self.mean()
+        self.grid -= mean
+        return mean
+
+    def add_mean(self,mean):
+        """add mean to perturbations in place (inverse of remove_mean)"""
+        self.grid += mean
+
+    def update(self,hxens,obs,oberrs,covlocal,levob,vcovlocal_fact,**kwargs):
+        """
+        EnKF update of ensemble in place (arguments as for
+        enkf_utils.enkf_update).
+        """
+        enkf_update(self.flat,hxens,obs,oberrs,covlocal,levob,\
+                    vcovlocal_fact,**kwargs)
+
+    def inflate(self,fsprd,covinflate1,covinflate2=-1,ensmean_b=None,moments=None):
+        """
+        posterior multiplicative inflation in place, given prior variance
+        fsprd.  If covinflate2 < 0, relaxation to prior stdev (RTPS,
+        Whitaker and Hamill 2012) with relaxation factor covinflate1.
+        Otherwise Hodyss et al 2016 inflation (requires prior mean
+        ensmean_b).  moments can be the (mean, variance) of the
+        posterior ensemble, if already computed.  Returns inflation
+        factor.
+        """
+        if moments is None: moments = self.moments()
+        mean = moments[0]; asprd = moments[1]
+        if covinflate2 < 0:
+            # relaxation to prior stdev (Whitaker & Hamill 2012)
+            asprd = np.sqrt(asprd); fsprd = np.sqrt(fsprd)
+            inflation_factor = 1.+covinflate1*(fsprd-asprd)/asprd
+        else:
+            # Hodyss et al 2016 inflation (covinflate1=covinflate2=1 works well in perfect
+            # model, linear gaussian scenario)
+            # inflation = asprd + (asprd/fsprd)**2((fsprd/nanals)+2*inc**2/(nanals-1))
+            inc = mean - ensmean_b
+            inflation_factor = covinflate1*asprd + \
+            (asprd/fsprd)**2*((fsprd/self.nanals) + covinflate2*(2.*inc**2/(self.nanals-1)))
+            inflation_factor = np.sqrt(inflation_factor/asprd)
+        mean = mean.astype(self.dtype)
+        inflation_factor_tmp = inflation_factor.astype(self.dtype)
+        for nanal in range(self.nanals):
+            x = self.grid[nanal]
+            x -= mean; x *= inflation_factor_tmp; x += mean
+        return inflation_factor
@@ -0,0 +1,77 @@
+from __future__ import print_function
+import numpy as np
+from .precision import accum_dtype
+
+def ensemble_moments(ens, truth=None):
+    """
+    ensemble mean and variance over the leading (member) dimension of ens,
+    computed in one pass (each member read once) with Welford's
+    algorithm, in double precision.  Works for model space
+    (nanals,2,ny,nx) or ob space (nanals,nlevob,nobs) ensembles.
+
+    returns mean, variance (divided by nanals-1), and if truth is given
+    (truth state, or obs for an ob space ensemble) also the squared error
+    of the mean, (mean-truth)**2.
+    """
+    nanals = len(ens)
+    mean = np.zeros(ens.shape[1:],accum_dtype)
+    m2 = np.zeros(ens.shape[1:],accum_dtype)
+    for nanal in range(nanals):
+        x = ens[nanal]
+        delta = x - mean
+        mean += delta/(nanal+1)
+        m2 += delta*(x - mean)
+    var = m2/(nanals-1)
+    if truth is None:
+        return mean, var
+    else:
+        return mean, var, (mean - np.asarray(truth,accum_dtype))**2
+
+class RunningStats:
+    def __init__(self, reduce_axes=None):
+        """
+        streaming mean and variance of a sequence of samples (e.g. over
+        assimilation cycles, for one forecast lead time), with Welford
+        updates (update) and Chan et al (1979) merging of partial
+        results (merge), in double precision.  Only the running mean,
+        sum of squared deviations and count are stored.
+
+        reduce_axes:  if not None, each sample is first averaged over these
+        axes (e.g. (-2,-1) for a domain mean), so only the reduced
+        statistics are kept.
+        """
+        self.reduce_axes = reduce_axes
+        self.count = 0
+        self.mean = None; self.m2 = None
+
+    def update(self, x):
+        """add sample x"""
+        x = np.asarray(x,accum_dtype)
+        if self.reduce_axes is not None:
+            x = x.mean(axis=self.reduce_axes)
+        if self.count == 0:
+            self.mean = np.zeros(x.shape,accum_dtype)
+            self.m2 = np.zeros(x.shape,accum_dtype)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(x - self.mean)
+
+    def merge(self, other):
+        """combine with statistics accumulated (separately) in other"""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean.copy(); self.m2 = other.m2.copy()
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta*(float(other.count)/count)
+        self.m2 = self.m2 + other.m2 + delta**2*(float(self.count)*other.count/count)
+        self.count = count
+
+    @property
+    def variance(self):
+        """sample variance (divided by count-1)"""
+        return self.m2/max(self.count-1,1)
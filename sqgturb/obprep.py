@@ -0,0 +1,103 @@
+from __future__ import print_function
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+# observation preprocessing ahead of the EnKF update:  averaging obs into
+# superobs (superob) or thinning to a target density (thin), so the
+# update (cost ~ nobs, ob-ob localization ~ nobs**2) runs on fewer obs.
+
+def group_locations(groups,xob,yob,L):
+    """
+    mean locations of groups of obs on the doubly periodic domain of size L.
+    groups is a sparse (ngroups,nobs) matrix with the averaging weights of
+    each group in a row (rows sum to one).  Offsets are taken relative to
+    the first ob in each group, so groups that straddle the periodic
+    boundary are handled.
+    """
+    groups = csr_matrix(groups); groups.sort_indices()
+    ngroups = groups.shape[0]
+    rows = np.repeat(np.arange(ngroups),np.diff(groups.indptr))
+    first = groups.indices[groups.indptr[:-1]]
+    def mean(x):
+        x = np.asarray(x,np.float64)
+        dx = np.mod(x[groups.indices]-x[first][rows]+0.5*L,L)-0.5*L
+        return np.mod(x[first]+np.bincount(rows,groups.data*dx,ngroups),L)
+    return mean(xob), mean(yob)
+
+def _box_groups(xob,yob,L,size):
+    # group index of each ob for a partition of the domain into
+    # size x size boxes.
+    nbox = int(np.ceil(L/size))
+    i = np.floor(np.mod(xob,L)/size).astype(np.int64)
+    j = np.floor(np.mod(yob,L)/size).astype(np.int64)
+    return np.unique(j*nbox+i,return_inverse=True)[1].ravel()
+
+def _radius_groups(xob,yob,L,size):
+    # greedy clustering:  each ob not yet assigned (in order) starts a
+    # group containing all unassigned obs within distance size.
+    pts = np.column_stack((np.mod(xob,L),np.mod(yob,L))).astype(np.float64)
+    tree = cKDTree(pts,boxsize=(L,L))
+    group = -np.ones(len(pts),np.int64)
+    ngroups = 0
+    for nob in range(len(pts)):
+        if group[nob] >= 0: continue
+        near = np.asarray(tree.query_ball_point(pts[nob],size),np.int64)
+        group[near[group[near] < 0]] = ngroups
+        ngroups += 1
+    return group
+
+def superob(xob,yob,pvob,oberrvar,L,size,method='box',obcorr=0.):
+    """
+    average obs into superobs.
+
+    xob,yob:  ob locations (meters) on doubly periodic domain of size L.
+    pvob:  ob values (...,nobs) (e.g. (nlevob,nobs)), oberrvar: ob error
+    variances (nobs).
+    method:  'box' (obs in each size x size box of a grid covering the
+    domain are averaged) or 'radius' (greedy clusters of obs within
+    distance size of the first unassigned ob).
+    obcorr:  correlation of errors of obs in the same superob.  The superob
+    error variance is the variance of the mean of the n obs,
+    (sum_i r_i + obcorr*sum_{i!=j} sqrt(r_i*r_j))/n**2, which is r/n for
+    uncorrelated errors and r for obcorr=1.
+
+    returns superob values (...,nsuper), error variances (nsuper),
+    locations xob,yob (nsuper) and the sparse (nsuper,nobs) averaging
+    matrix groups (to pass to ObservationOperator, so that H is the
+    average of the operators for the original obs).
+    """
+    if method == 'box':
+        group = _box_groups(xob,yob,L,size)
+    elif method == 'radius':
+        group = _radius_groups(xob,yob,L,size)
+    else:
+        raise ValueError("method must be 'box' or 'radius'")
+    nobs = len(group); nsuper = group.max()+1
+    count = np.bincount(group,minlength=nsuper).astype(np.float64)
+    groups = csr_matrix((1./count[group],(group,np.arange(nobs))),shape=(nsuper,nobs))
+    groups.sort_indices()
+    pvob = np.asarray(pvob)
+    pvob_s = groups.dot(pvob.reshape((-1,nobs)).T).T.reshape(pvob.shape[:-1]+(nsuper,))
+    r = np.asarray(oberrvar,np.float64)
+    sumr = np.bincount(group,r,nsuper)
+    sumsqrtr = np.bincount(group,np.sqrt(r),nsuper)
+    oberrvar_s = (sumr + obcorr*(sumsqrtr**2-sumr))/count**2
+    xob_s, yob_s = group_locations(groups,xob,yob,L)
+    return pvob_s.astype(pvob.dtype), oberrvar_s.astype(np.asarray(oberrvar).dtype),\
+           xob_s, yob_s, groups
+
+def thin(xob,yob,L,spacing):
+    """
+    thin obs to a density of (at most) one ob per spacing x spacing box
+    (e.g. spacing = L/sqrt(target_nobs)), keeping the ob nearest the
+    center of each box.  Returns sorted indices of the obs kept.
+    """
+    xob = np.mod(np.asarray(xob,np.float64),L); yob = np.mod(np.asarray(yob,np.float64),L)
+    group = _box_groups(xob,yob,L,spacing)
+    dist = (np.mod(xob,spacing)-0.5*spacing)**2+(np.mod(yob,spacing)-0.5*spacing)**2
+    # sort by group, then distance from box center; keep first in each group.
+    order = np.lexsort((dist,group))
+    first = np.ones(len(order),bool)
+    first[1:] = group[order][1:] != group[order][:-1]
+    return np.sort(order[first])
@@ -0,0 +1,130 @@
+from __future__ import print_function
+import numpy as np
+try: # netCDF4 needed to read/write ob database files (optional)
+    from netCDF4 import Dataset
+except ImportError:
+    Dataset = None
+
+# observation database:  obs for all assimilation cycles in one netCDF
+# (HDF5) file, so an ob set is generated once (enkf/make_obsdb.py) and
+# reused by any number of experiments.
+#
+# All obs are stored along one (unlimited) 'obs' dimension, cycle by cycle,
+# with one entry per ob and level:
+#   x, y (meters), indx (flat grid index, -1 if not at a grid point),
+#   lev (model level), value, oberrvar (error variance).
+# and a per-cycle index along the 'cycle' dimension:
+#   time, offset (first ob of cycle), count (number of entries),
+# so the obs for one cycle are read with one contiguous slice.
+
+def _check_netcdf():
+    if Dataset is None:
+        raise ImportError('netCDF4 is needed for ob database files')
+
+class ObsDatabaseWriter:
+    def __init__(self, filename, L, nx, ny=None, dtype=np.float32,\
+                 chunksize=65536, **attrs):
+        """
+        create ob database filename for a (ny,nx) doubly periodic grid of
+        size L.  Ob values and error variances are stored with dtype.
+        Extra keyword arguments are stored as global attributes (e.g.
+        how the obs were generated).  Cycles are added (in time order)
+        with add_cycle.
+        """
+        _check_netcdf()
+        if ny is None: ny = nx
+        self.nc = Dataset(filename,mode='w',format='NETCDF4')
+        self.nc.L = L; self.nc.nx = nx; self.nc.ny = ny
+        for name, value in attrs.items():
+            setattr(self.nc,name,value)
+        self.nc.createDimension('obs',None)
+        self.nc.createDimension('cycle',None)
+        def obvar(name,vtype):
+            return self.nc.createVariable(name,vtype,('obs',),zlib=True,\
+                   chunksizes=(chunksize,))
+        self.x = obvar('x',np.float64); self.x.units = 'meters'
+        self.y = obvar('y',np.float64); self.y.units = 'meters'
+        self.indx = obvar('indx',np.int32)
+        self.lev = obvar('lev',np.int8)
+        self.value = obvar('value',dtype)
+        self.oberrvar = obvar('oberrvar',dtype)
+        self.time = self.nc.createVariable('time',np.float64,('cycle',))
+        self.time.units = 'seconds'
+        self.offset = self.nc.createVariable('offset',np.int64,('cycle',))
+        self.count = self.nc.createVariable('count',np.int32,('cycle',))
+        self.ncycles = 0; self.nobs_total = 0
+
+    def add_cycle(self, time, xob, yob, pvob, oberrvar, levob, indxob=None):
+        """
+        append obs for one cycle:  values pvob (nlevob,nobs) at locations
+        xob,yob (and flat grid indices indxob, if at grid points) for model
+        levels levob, with error variances oberrvar (nobs).
+        """
+        pvob = np.asarray(pvob); nlevob, nobs = pvob.shape
+        n1 = self.nobs_total; n2 = n1 + nlevob*nobs
+        self.x[n1:n2] = np.tile(xob,nlevob)
+        self.y[n1:n2] = np.tile(yob,nlevob)
+        if indxob is None: indxob = -np.ones(nobs,np.int32)
+        self.indx[n1:n2] = np.tile(indxob,nlevob)
+        self.lev[n1:n2] = np.repeat(levob,nobs)
+        self.value[n1:n2] = pvob.ravel()
+        self.oberrvar[n1:n2] = np.tile(oberrvar,nlevob)
+        self.time[self.ncycles] = time
+        self.offset[self.ncycles] = n1
+        self.count[self.ncycles] = n2 - n1
+        self.ncycles += 1; self.nobs_total = n2
+
+    def close(self):
+        self.nc.close()
+
+class ObsDatabase:
+    def __init__(self, filename):
+        """
+        open ob database filename for reading.  The per-cycle index (times,
+        offsets, counts) is read here, the obs for a cycle are read on
+        demand (read, cycle).  Global attributes are available in attrs.
+        """
+        _check_netcdf()
+        self.nc = Dataset(filename)
+        self.attrs = dict((name,self.nc.getncattr(name)) for name in self.nc.ncattrs())
+        self.L = self.nc.L; self.nx = self.nc.nx; self.ny = self.nc.ny
+        self.times = self.nc.variables['time'][:]
+        self.offsets = self.nc.variables['offset'][:]
+        self.counts = self.nc.variables['count'][:]
+        self.ncycles = len(self.times)
+
+    def read(self, ncycle):
+        """
+        all entries for cycle ncycle, as a dict of 1d arrays (x, y,
+        indx, lev, value, oberrvar) and the cycle time.
+        """
+        n1 = self.offsets[ncycle]; n2 = n1 + self.counts[ncycle]
+        obs = dict((name,np.asarray(self.nc.variables[name][n1:n2])) for name in\
+                   ['x','y','indx','lev','value','oberrvar'])
+        obs['time'] = self.times[ncycle]
+        return obs
+
+    def cycle(self, ncycle, levob):
+        """
+        obs for cycle ncycle in the form used by the EnKF, for obs at the
+        same locations on each of the levels levob:  returns pvob
+        (nlevob,nobs), oberrvar (nobs), xob, yob and indxob (nobs) (None if
+        the obs are not at grid points).
+        """
+        obs = self.read(ncycle)
+        sel = [obs['lev'] == lev for lev in levob]
+        nobs = sel[0].sum()
+        if nobs == 0:
+            raise ValueError('no obs for level %s' % levob[0])
+        if any(s.sum() != nobs for s in sel) or \
+           any((obs['x'][s] != obs['x'][sel[0]]).any() or\
+               (obs['y'][s] != obs['y'][sel[0]]).any() for s in sel[1:]):
+            raise ValueError('obs not at the same locations on levels %s' % levob)
+        pvob = np.array([obs['value'][s] for s in sel])
+        s = sel[0]
+        indxob = obs['indx'][s]
+        if (indxob < 0).any(): indxob = None
+        return pvob, obs['oberrvar'][s], obs['x'][s], obs['y'][s], indxob
+
+    def close(self):
+        self.nc.close()
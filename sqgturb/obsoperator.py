@@ -0,0 +1,196 @@
+from __future__ import print_function
+import numpy as np
+from scipy.sparse import csr_matrix
+from .obprep import group_locations
+
+def _cubic_weights(t):
+    # cubic convolution (Keys 1981, a=-0.5) weights for points at
+    # offsets -1,0,1,2 from interpolation point at fractional offset t.
+    t = t[...,np.newaxis]
+    d = np.abs(t-np.arange(-1,3))
+    return np.where(d <= 1., 1.5*d**3-2.5*d**2+1.,\
+           np.where(d < 2., -0.5*d**3+2.5*d**2-4.*d+2., 0.))
+
+class ObservationOperator:
+    def __init__(self, L, nx, xob=None, yob=None, indxob=None, ny=None,\
+                 levob=(0,), method='nearest', scalefact=1.0, var='pv',\
+                 model=None, groups=None):
+        """
+        forward operator for point obs of boundary pv (or temp), or
+        streamfunction or winds, on the doubly periodic (ny,nx) grid of
+        size L.
+
+        Ob locations are given either by flat grid indices indxob
+        (obs at grid points) or by coordinates (xob,yob) in meters.
+        method:  'nearest' (value at nearest grid point), 'bilinear',
+        'bicubic' (cubic convolution) or 'spectral' (exact interpolation
+        of the fourier series).  For the grid point methods the flat
+        indices and weights of the points used for each ob are computed
+        here (padded to the same number of points), so H can be applied
+        to a whole ensemble at once.
+        levob:  model levels (boundaries) observed.
+        scalefact:  factor applied to model values (e.g. to convert pv
+        to temperature).
+        var:  observed variable, 'pv' (default), 'psi' (streamfunction),
+        'u' or 'v' (winds).  For psi, u and v the SQG model instance
+        'model' is needed, to build the spectral multipliers that map
+        boundary pv to the observed variable (inversion and
+        derivatives combined), which are applied to all members and
+        levels at once. The observed field is then evaluated with one
+        batched inverse transform and interpolated (grid point methods),
+        or evaluated directly at the ob locations (method='spectral',
+        cheaper when nobs is small).
+        groups:  optional sparse (nsuper,nobs) averaging matrix for
+        superobs (from obprep.superob).  The operator is then the
+        average of the operators for the obs in each superob, and the
+        xob,yob attributes are the superob locations.
+        """
+        if ny is None: ny = nx
+        self.L = L; self.nx = nx; self.ny = ny
+        self.levob = list(levob)
+        self.method = method
+        self.scalefact = scalefact
+        self.var = var
+        if var != 'pv':
+            self._multipliers(model)
+        dx = float(L)/nx; dy = float(L)/ny
+        if indxob is not None:
+            jo, io = np.divmod(np.asarray(indxob),nx)
+            xob = io*dx; yob = jo*dy
+        # ob locations in grid units (0 <= xi < nx).
+        xi = np.mod(np.asarray(xob,np.float64)/dx,nx)
+        yi = np.mod(np.asarray(yob,np.float64)/dy,ny)
+        self.xob = xi*dx; self.yob = yi*dy
+        self.nobs = len(xi)
+        if method == 'nearest':
+            i = np.round(xi).astype(np.int64) % nx
+            j = np.round(yi).astype(np.int64) % ny
+            self.indx = (j*nx+i)[:,np.newaxis]
+            self.weights = np.ones((self.nobs,1),np.float64)
+        elif method in ['bilinear','bicubic']:
+            i0 = np.floor(xi).astype(np.int64); j0 = np.floor(yi).astype(np.int64)
+            tx = xi-i0; ty = yi-j0
+            if method == 'bilinear':
+                offsets = np.arange(0,2)
+                wx = np.column_stack((1.-tx,tx)); wy = np.column_stack((1.-ty,ty))
+            else:
+                offsets = np.arange(-1,3)
+                wx = _cubic_weights(tx); wy = _cubic_weights(ty)
+            i = (i0[:,np.newaxis]+offsets) % nx
+            j = (j0[:,np.newaxis]+offsets) % ny
+            self.indx = (nx*j[:,:,np.newaxis]+i[:,np.newaxis,:]).reshape((self.nobs,-1))
+            self.weights = (wy[:,:,np.newaxis]*wx[:,np.newaxis,:]).reshape((self.nobs,-1))
+        elif method == 'spectral':
+            self._spectral_setup()
+        else:
+            raise ValueError("method must be 'nearest','bilinear','bicubic' or 'spectral'")
+        self.groups = None
+        if groups is not None:
+            self._average(groups)
+
+    def _average(self,groups):
+        # superobs: combine the operators for the obs in each group
+        # (row of groups).  For the grid point methods the indices and
+        # weights are merged (padded to the largest group), for
+        # method='spectral' the values at the ob locations are averaged.
+        groups = csr_matrix(groups); groups.sort_indices()
+        nsuper = groups.shape[0]
+        if self.method != 'spectral':
+            count = np.diff(groups.indptr)
+            rows = np.repeat(np.arange(nsuper),count)
+            cols = np.arange(groups.nnz)-groups.indptr[rows]
+            member = np.zeros((nsuper,count.max()),np.int64)
+            wts = np.zeros((nsuper,count.max()),np.float64)
+            member[rows,cols] = groups.indices; wts[rows,cols] = groups.data
+            self.indx = self.indx[member].reshape((nsuper,-1))
+            self.weights = (wts[:,:,np.newaxis]*self.weights[member]).reshape((nsuper,-1))
+        else:
+            self.groups = groups
+        self.xob, self.yob = group_locations(groups,self.xob,self.yob,self.L)
+        self.nobs = nsuper
+
+    def _multipliers(self,model):
+        # spectral multipliers (nlevob,2,ny,nx//2+1) that map boundary pv
+        # to var on the observed levels (see SQG.invert).  u = -dpsi/dy,
+        # v = dpsi/dx.
+        if model is None:
+            raise ValueError('model instance needed for var=%s' % self.var)
+        if model.N != self.nx or model.N != self.ny or \
+           not np.allclose(model.L,self.L):
+            raise ValueError('model grid does not match observation operator')
+        hm = model.Hovermu.astype(np.float64)
+        th = model.tanhmu.astype(np.float64); sh = model.sinhmu.astype(np.float64)
+        inv = np.array([[-hm/th,hm/sh],[-hm/sh,hm/th]],np.complex128)
+        inv[:,:,0,0] = 0. # area mean streamfunction is arbitrary
+        if self.var == 'psi':
+            mult = inv
+        elif self.var == 'u':
+            mult = -model.il.astype(np.complex128)*inv
+        elif self.var == 'v':
+            mult = model.ik.astype(np.complex128)*inv
+        else:
+            raise ValueError("var must be 'pv','psi','u' or 'v'")
+        self.multipliers = mult[self.levob]
+
+    def _spectral_setup(self):
+        # fourier basis functions at ob locations (for rfft2 coefficients).
+        # Nyquist wavenumbers use cosines (coefficient split evenly between
+        # +/- wavenumbers), so the interpolant is real.
+        nx = self.nx; ny = self.ny
+        k = 2.*np.pi*np.arange(nx//2+1)/self.L
+        l = 2.*np.pi*np.fft.fftfreq(ny,1./ny)/self.L
+        ex = np.exp(1.j*self.xob[:,np.newaxis]*k)
+        ey = np.exp(1.j*self.yob[:,np.newaxis]*l)
+        # weight 2 for wavenumbers with hermitian partner (not in rfft).
+        wk = 2.*np.ones(nx//2+1); wk[0] = 1.
+        if nx % 2 == 0:
+            wk[-1] = 1.; ex[:,-1] = np.cos(self.xob*k[-1])
+        if ny % 2 == 0:
+            ey[:,ny//2] = np.cos(self.yob*np.abs(l[ny//2]))
+        self.ex = (wk*ex/(nx*ny)).T # (nx//2+1,nobs)
+        self.ey = ey # (nobs,ny)
+
+    def _grid(self,fld):
+        # gather/interpolate grid point values fld[...,nlevob,ny,nx].
+        fld = fld.reshape(fld.shape[:-2]+(-1,))
+        if self.indx.shape[1] == 1:
+            return fld[...,self.indx[:,0]]
+        else:
+            return np.einsum('...op,op->...o',fld[...,self.indx],\
+                             self.weights.astype(fld.dtype))
+
+    def spectral(self,pvspec):
+        """
+        apply operator to spectral coefficients pvspec[...,nlevs,ny,nx//2+1]
+        (rfft2 of model pv, e.g. model.pvspec), returning
+        hx[...,nlevob,nobs].  For method='spectral' the fourier series is
+        evaluated exactly at the ob locations, for all members and levels
+        in one matrix multiply.
+        """
+        pvspec = np.asarray(pvspec)
+        dtype = pvspec.real.dtype
+        if self.var == 'pv':
+            hxspec = pvspec[...,self.levob,:,:]
+        else:
+            hxspec = (self.multipliers*pvspec[...,np.newaxis,:,:,:]).sum(axis=-3)
+        if self.method == 'spectral':
+            tmp = np.matmul(hxspec,self.ex) # (...,nlevob,ny,nobs)
+            hx = np.einsum('...lo,ol->...o',tmp,self.ey).real
+            if self.groups is not None:
+                shape = hx.shape[:-1]
+                hx = self.groups.dot(hx.reshape((-1,hx.shape[-1])).T).T
+                hx = hx.reshape(shape+(self.nobs,))
+        else:
+            hx = self._grid(np.fft.irfft2(hxspec,s=(self.ny,self.nx)))
+        return (self.scalefact*hx).astype(dtype)
+
+    def __call__(self,pv):
+        """
+        apply operator to grid point pv[...,nlevs,ny,nx] (a single state or
+        an ensemble), returning hx[...,nlevob,nobs].
+        """
+        pv = np.asarray(pv)
+        if self.method == 'spectral' or self.var != 'pv':
+            return self.spectral(np.fft.rfft2(pv)).astype(pv.dtype)
+        hx = self._grid(pv[...,self.levob,:,:])
+        return (self.scalefact*hx).astype(hx.dtype)
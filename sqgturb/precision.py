@@ -0,0 +1,51 @@
+import numpy as np
+
+# package-wide floating point precision policy.
+# 'single':  model state, ensemble, localization weights, innovations and
+# random patterns are float32 (half the memory traffic of float64).
+# Reductions that need it (ensemble means, variances, inner products
+# in the EnKF, local LETKF eigenproblems) are accumulated in float64.
+# 'double':  everything float64 (use to check single precision results,
+# see rel_diff).
+
+_precision = 'single'
+
+# dtype used for accumulations.
+accum_dtype = np.float64
+
+def get_dtype(precision=None):
+    """
+    return numpy float dtype for precision ('single' or 'double').
+    If None, the package default (set_precision) is used.
+    """
+    if precision is None: precision = _precision
+    if precision == 'single':
+        return np.dtype(np.float32)
+    elif precision == 'double':
+        return np.dtype(np.float64)
+    else:
+        msg="precision must be 'single' or 'double'"
+        raise ValueError(msg)
+
+def set_precision(precision):
+    """
+    set package default precision ('single' or 'double').
+    """
+    global _precision
+    get_dtype(precision) # check value
+    _precision = precision
+
+def get_precision():
+    """
+    return package default precision ('single' or 'double').
+    """
+    return _precision
+
+def rel_diff(x,xref):
+    """
+    relative rms difference between x (e.g. a single precision result)
+    and xref (e.g. a double precision result), computed in double
+    precision.
+    """
+    x = np.asarray(x,accum_dtype); xref = np.asarray(xref,accum_dtype)
+    return np.sqrt(((x-xref)**2).mean()/(xref**2).mean())
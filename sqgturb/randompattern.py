@@ -1,9 +1,12 @@
 import numpy as np
+from .rngstreams import get_randomstate
+from .precision import get_dtype
 from scipy.ndimage import gaussian_filter
 
 class RandomPattern:
     def __init__(self, spatial_corr_efold, temporal_corr_efold, L, N, dt, \
-            nsamples=1, stdev=1.0, seed=None, truncate=6.0, norm='psi'):
+            nsamples=1, stdev=1.0, seed=None, truncate=6.0, norm='psi',\
+            precision=None):
         """
         define an ensemble of random patterns with specified temporal
         and spatial covariance structure by applying Gaussian blur to
@@ -25,14 +28,19 @@ class RandomPattern:
         scale).
         norm:  'psi' (default), random pattern represents streamfunction.
         'pv': random pattern represents PV (boundary pot. temp.)
+        seed:  random seed (int), or a numpy Generator/RandomState
+        (e.g. from RandomStreams.generator).
+        precision:  'single' or 'double' (default from precision.py).
+        patterns are generated in double precision, and stored in
+        this precision.
         """
-        self.hcorr = np.array(spatial_corr_efold,np.float)
+        self.hcorr = np.array(spatial_corr_efold,float)
         if self.hcorr.shape == ():
             self.hcorr.shape = (1,)
-        self.tcorr = np.array(temporal_corr_efold,np.float)
+        self.tcorr = np.array(temporal_corr_efold,float)
         if self.tcorr.shape == ():
             self.tcorr.shape = (1,)
-        self.stdev = np.array(stdev,np.float)
+        self.stdev = np.array(stdev,float)
         if self.stdev.shape == ():
             self.stdev.shape = (1,)
         self.npatterns = len(self.stdev)
@@ -40,20 +48,18 @@ class RandomPattern:
         self.L = float(L)
         self.nsamples = nsamples
         self.N = N
-        self.filter_stdev = self.hcorr*self.N/(self.L*np.sqrt(4.))*np.ones(self.npatterns, np.float)
+        self.filter_stdev = self.hcorr*self.N/(self.L*np.sqrt(4.))*np.ones(self.npatterns, float)
         self.truncate=truncate
         self.norm = norm
         # initialize random coefficients.
-        if seed is None:
-            self.rs = np.random.RandomState()
-        else:
-            self.rs = np.random.RandomState(seed)
-        self.pattern = self.genpattern()
+        self.rs = get_randomstate(seed)
+        self.dtype = get_dtype(precision)
+        self.pattern = self.genpattern().astype(self.dtype)
 
     def genpattern(self,seed=None):
         # initialize patterns.
         # generate white noise.
-        pattern = np.zeros((2,self.N,self.N),np.float)
+        pattern = np.zeros((2,self.N,self.N),float)
         for npattern in range(self.npatterns):
             newpattern = self.stdev[npattern]*self.rs.normal(\
                          size=(2,self.N,self.N))
@@ -83,8 +89,8 @@ class RandomPattern:
     def copy(self,seed):
         import copy
         newself = copy.copy(self)
-        newself.rs = np.random.RandomState(seed)
-        newself.pattern = self.genpattern()
+        newself.rs = get_randomstate(seed)
+        newself.pattern = newself.genpattern().astype(self.dtype)
         return newself
 
     def evolve(self,dt=None):
@@ -98,6 +104,37 @@ class RandomPattern:
             lag1corr = np.exp(-1.0)**(dt/self.tcorr[npattern])
             self.pattern[npattern] = np.sqrt(1.-lag1corr**2)*newpattern[npattern] + lag1corr*self.pattern[npattern]
 
+class RandomPatternBatch:
+    def __init__(self, patterns, shape=None):
+        """
+        batch of independent random patterns (e.g. RandomPattern copies
+        with different seeds, or amplitudes), for use as the random_pattern
+        of a batched SQG model (pv[...,2,N,N]).  The pattern attribute
+        stacks the member patterns, reshaped to shape+(2,N,N) (shape
+        defaults to (len(patterns),)), and evolve evolves each member.
+        All patterns must have the same norm.
+        """
+        self.patterns = list(patterns)
+        if shape is None: shape = (len(self.patterns),)
+        self.shape = tuple(shape)
+        norms = set(rp.norm for rp in self.patterns)
+        if len(norms) != 1:
+            raise ValueError('all patterns must have the same norm')
+        self.norm = norms.pop()
+        self.N = self.patterns[0].N; self.dt = self.patterns[0].dt
+
+    @property
+    def pattern(self):
+        pattern = np.array([rp.pattern for rp in self.patterns])
+        return pattern.reshape(self.shape+pattern.shape[1:])
+
+    def evolve(self,dt=None):
+        """
+        evolve random patterns one time step
+        """
+        for rp in self.patterns:
+            rp.evolve(dt)
+
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
     nsamples = 2; stdev = [1.,2]
@@ -125,14 +162,14 @@ if __name__ == "__main__":
         x = rp.pattern[0]
         lag1cov = lag1cov + x*xold/(ntimes-1)
         lag1var = lag1var + x*x/(ntimes-1)
-        spatial_cov = spatial_cov + x[rp.N/2,rp.N/2]*x/(ntimes-1)
+        spatial_cov = spatial_cov + x[rp.N//2,rp.N//2]*x/(ntimes-1)
     plt.figure()
     x = (rp.L/rp.N)*np.arange(rp.N)-rp.L/2
-    plt.plot(x,0.5*(spatial_cov[:,rp.N/2]+spatial_cov[rp.N/2,:]),'r')
+    plt.plot(x,0.5*(spatial_cov[:,rp.N//2]+spatial_cov[rp.N//2,:]),'r')
     plt.plot(x,np.exp(-(x/rp.hcorr)**2),'k')
     plt.axhline(0); plt.axvline(0)
     plt.show()
     lag1corr = lag1cov/lag1var
     lag1corr_exp = np.exp(-1)**(rp.dt/rp.tcorr)
-    print 'lag 1 autocorr = ',lag1corr.mean(), ', expected ',lag1corr_exp
-    print 'variance = ',lag1var.mean(),' (expected ',stdev**2,')'
+    print('lag 1 autocorr = ',lag1corr.mean(), ', expected ',lag1corr_exp)
+    print('variance = ',lag1var.mean(),' (expected ',stdev**2,')')
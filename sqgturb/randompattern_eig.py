@@ -1,5 +1,7 @@
+from __future__ import print_function
 import numpy as np
-from scipy.linalg import eigh
+from .rngstreams import get_randomstate
+from .precision import get_dtype
 from scipy.special import gamma,kv
 
 def _gaussian(rr,corrl):
@@ -25,7 +27,25 @@ def _cartdist(x1,y1,x2,y2,xmax,ymax):
 
 class RandomPatternEig:
     def __init__(self, spatial_corr_efold, temporal_corr_efold, L, N,\
-                 dt, nsamples=1, stdev=1.0, thresh = 0.99, verbose=False, seed=None):
+                 dt, nsamples=1, stdev=1.0, thresh = 0.99, verbose=False, seed=None,\
+                 precision=None):
+        """
+        define random patterns with a Matern spatial covariance and
+        AR(1) temporal correlation, truncated to the leading eigenvectors
+        of the covariance matrix that explain a fraction 'thresh' of the
+        total variance.
+
+        on the doubly periodic domain the covariance matrix is block
+        circulant, so its eigenvectors are Fourier modes and the
+        eigenvalues are the 2d FFT of the covariance between the
+        origin and every other grid point.  The dense (N**2,N**2) matrix
+        is never formed.
+
+        precision:  'single' or 'double' precision for pattern (default
+        from precision.py).  The AR(1) coefficients are kept in double
+        precision.
+        """
+        self.dtype = get_dtype(precision)
         self.hcorr = spatial_corr_efold
         self.tcorr = temporal_corr_efold
         self.dt = dt
@@ -35,82 +55,85 @@ class RandomPatternEig:
         self.nsamples = nsamples
         self.N = N
         self.thresh = thresh
-        # construct covariance matrix.
+        # covariance between grid point (0,0) and all others (first row
+        # of circulant covariance matrix).
         x1 = np.arange(0,self.L,self.L/self.N)
         y1 = np.arange(0,self.L,self.L/self.N)
         x, y = np.meshgrid(x1, y1)
-        x2 = x.flatten(); y2 = y.flatten()
-        cov = np.zeros((N**2,N**2),np.float64)
-        n = 0
-        for x0,y0 in zip(x2,y2):
-            r = _cartdist(x0,y0,x2,y2,self.L,self.L)
-            cov[n,:] = _matern(r,self.hcorr)
-            n = n + 1
-        # eigenanalysis
-        evals, evecs = eigh(cov)
+        r = _cartdist(0.,0.,x,y,self.L,self.L)
+        # eigenvalues of circulant matrix (real, since covariance is
+        # symmetric).
+        evals = np.fft.fft2(_matern(r,self.hcorr)).real
         if self.thresh == 1.0:
             evals = np.where(evals > 1.e-10, evals, 1.e-10)
-            self.scaledevecs = evecs*np.sqrt(evals)
             self.nevecs = self.N**2
         else:
-            evalsum = evals.sum(); neig = 0; frac = 0.
-            while frac < self.thresh:
-                frac = evals[self.N**2-neig-1:self.N**2].sum()/evalsum
-                neig += 1
-            self.scaledevecs = (evecs*np.sqrt(evals/frac))[:,self.N**2-neig:self.N**2]
+            evals = np.where(evals > 0., evals, 0.)
+            # keep all modes with eigenvalue >= cutoff value, so that
+            # +/- wavenumber pairs are retained together (pattern stays real).
+            evalsort = np.sort(evals.ravel())[::-1]
+            neig = np.searchsorted(np.cumsum(evalsort)/evals.sum(),self.thresh)+1
+            neig = min(neig, self.N**2)
+            evals = np.where(evals >= evalsort[neig-1], evals, 0.)
+            frac = evals.sum()/evalsort.sum()
+            evals = evals/frac
+            self.nevecs = np.count_nonzero(evals)
             if verbose:
-                print '%s eigenvectors explain %s percent of variance' %\
-                (neig,100*self.thresh)
-            self.nevecs = neig
+                print('%s eigenvectors explain %s percent of variance' %\
+                (self.nevecs,100*frac))
+        # spectral filter (sqrt of eigenvalues) for rfft2 coefficients.
+        self.sqrtevals = np.sqrt(evals[:,0:(self.N//2)+1])
         # initialize random coefficients.
-        if seed is None:
-            self.rs = np.random.RandomState() 
-        else:
-            self.rs = np.random.RandomState(seed) 
-        self.coeffs = self.rs.normal(size=(self.nsamples,self.nevecs))
+        # (white noise in grid space, AR(1) in time)
+        self.rs = get_randomstate(seed)
+        self.coeffs = self.rs.normal(size=(self.nsamples,self.N,self.N))
         self.pattern = self.random_sample()
 
     def copy(self,seed):
         import copy
         newself = copy.copy(self)
-        newself.rs = np.random.RandomState(seed)
-        newself.coeffs = newself.rs.normal(size=(self.nsamples,self.nevecs))
+        newself.rs = get_randomstate(seed)
+        newself.coeffs = newself.rs.normal(size=(self.nsamples,self.N,self.N))
         newself.pattern = newself.random_sample()
         return newself
-     
+
     def random_sample(self):
         """
         return random sample
         """
-        xens = np.dot(self.stdev*self.coeffs,self.scaledevecs.T)
-        #xens = np.zeros((nsamples,self.N*self.N),np.float32)
-        #for n in range(nsamples):
-        #    for j in range(self.nevecs):
-        #        xens[n] = xens[n]+self.stdev*self.coeffs[n,j]*self.scaledevecs[:,j]
-        return xens.reshape((self.nsamples, self.N, self.N)).squeeze()
+        # multiply fourier coefficients of white noise by sqrt of
+        # eigenvalues (equivalent to np.dot(coeffs,scaledevecs.T) in
+        # eigenvector space).
+        xens = np.fft.irfft2(self.sqrtevals*np.fft.rfft2(self.stdev*self.coeffs),\
+                             s=(self.N,self.N))
+        return xens.squeeze().astype(self.dtype)
 
-    def evolve(self):
+    def evolve(self,dt=None):
         """
         evolve sample one time step
         """
+        if dt is None:
+            lag1corr = self.lag1corr
+        else:
+            lag1corr = np.exp(-1)**(dt/self.tcorr)
         self.coeffs = \
-        np.sqrt(1.-self.lag1corr**2)* \
-        self.rs.normal(size=(self.nsamples,self.nevecs)) + \
-        self.lag1corr*self.coeffs
+        np.sqrt(1.-lag1corr**2)* \
+        self.rs.normal(size=(self.nsamples,self.N,self.N)) + \
+        lag1corr*self.coeffs
         self.pattern = self.random_sample()
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
-    import cPickle
+    import pickle
     nsamples = 10; stdev = 2
     rp=RandomPatternEig(0.5*20.e6/64.,3600.,20.e6,64,1800,nsamples=nsamples,stdev=stdev,verbose=True)
     rp1 = rp.copy(seed=42)
     # test pickling/unpickling
     f = open('saved_rp.pickle','wb')
-    cPickle.dump(rp1, f, protocol=cPickle.HIGHEST_PROTOCOL)
+    pickle.dump(rp1, f, protocol=pickle.HIGHEST_PROTOCOL)
     f.close()
     f = open('saved_rp.pickle','rb')
-    rp = cPickle.load(f)
+    rp = pickle.load(f)
     f.close()
     # plot random sample.
     xens = rp.pattern
@@ -120,8 +143,8 @@ if __name__ == "__main__":
         plt.imshow(xens[n],plt.cm.bwr,interpolation='nearest',origin='lower',vmin=-minmax,vmax=minmax)
         plt.title('pattern %s' % n)
         plt.colorbar()
-    print 'variance =', ((xens**2).sum(axis=0)/(nsamples-1)).mean()
-    print '(expected ',stdev**2,')'
+    print('variance =',((xens**2).sum(axis=0)/(nsamples-1)).mean())
+    print('(expected ',stdev**2,')')
     plt.show()
     nsamples = 1; stdev = 2
     rp = RandomPatternEig(500.e3,3600.,20.e6,64,1800,nsamples=nsamples,stdev=stdev)
@@ -136,5 +159,5 @@ if __name__ == "__main__":
         lag1cov = lag1cov + x*xold/(ntimes-1)
         lag1var = lag1var + x*x/(ntimes-1)
     lag1corr = lag1cov/lag1var
-    print 'lag 1 autocorr = ',lag1corr.mean(), ', expected ',rp.lag1corr
-    print 'variance = ',lag1var.mean()
+    print('lag 1 autocorr = ',lag1corr.mean(), ', expected ',rp.lag1corr)
+    print('variance = ',lag1var.mean())
@@ -0,0 +1,269 @@
+from __future__ import print_function
+import os, hashlib
+import numpy as np
+from .rngstreams import get_randomstate
+from .precision import get_dtype
+from scipy.sparse.linalg import eigsh, LinearOperator
+from .randompattern_eig import _matern, _cartdist
+
+class RandomPatternEigsh:
+    def __init__(self, spatial_corr_efold, temporal_corr_efold, L, N,\
+                 dt, nsamples=1, stdev=1.0, thresh = 0.99, bankratio=1.2,\
+                 neig=None, method='randomized', cachedir=None, verbose=False,\
+                 seed=None, precision=None):
+        """
+        define random patterns with a (possibly non-stationary) Matern
+        spatial covariance and AR(1) temporal correlation, truncated to the
+        leading eigenvectors that explain a fraction 'thresh' of the
+        total variance.
+
+        spatial_corr_efold:  horizontal correlation length scale.  Can be
+        a scalar, an (N,N) array giving the local length scale at each
+        grid point, or a function of (x,y) returning such an array.
+        A spatially varying length scale gives the non-stationary
+        covariance of a process convolution (Higdon 1998), see bankratio.
+        bankratio:  for a spatially varying length scale, the covariance
+        is applied as an operator (never formed as a matrix) by FFT
+        convolution with a bank of stationary kernels whose length scales
+        differ by this ratio, blended (modulated) by spatially varying
+        weights.
+        neig:  initial number of eigenpairs requested (increased until
+        'thresh' is reached).  Default is estimated from the stationary
+        covariance with the smallest length scale.
+        method:  'randomized' (randomized eigensolver, default) or
+        'lanczos' (scipy.sparse.linalg.eigsh).
+        cachedir:  if not None, eigenvalues/eigenvectors are cached
+        in this directory, keyed by the covariance parameters.
+        precision:  'single' or 'double' precision for pattern (default
+        from precision.py).
+
+        For a stationary covariance use RandomPatternEig (FFT based).
+        """
+        self.tcorr = temporal_corr_efold
+        self.dtype = get_dtype(precision)
+        self.dt = dt
+        self.lag1corr = np.exp(-1)**(self.dt/self.tcorr)
+        self.L = L
+        self.stdev = stdev
+        self.nsamples = nsamples
+        self.N = N
+        self.thresh = thresh
+        self.bankratio = bankratio
+        x1 = np.arange(0,self.L,self.L/self.N)
+        y1 = np.arange(0,self.L,self.L/self.N)
+        x, y = np.meshgrid(x1, y1)
+        if callable(spatial_corr_efold):
+            self.hcorr = spatial_corr_efold(x,y)*np.ones((N,N))
+        else:
+            self.hcorr = np.asarray(spatial_corr_efold,np.float64)*np.ones((N,N))
+        self.rs = get_randomstate(seed)
+        evals = evecs = None
+        if cachedir is not None:
+            key = hashlib.sha1(self.hcorr.tobytes())
+            key.update(repr((float(L),N,float(thresh),float(bankratio),method)).encode())
+            cachefile = os.path.join(cachedir,'rpeigsh_%s.npz' % key.hexdigest())
+            if os.path.exists(cachefile):
+                data = np.load(cachefile)
+                evals = data['evals']; evecs = data['evecs']
+                if verbose: print('eigenvectors read from %s' % cachefile)
+        if evals is None:
+            self._kernels()
+            evals, evecs = self._eigs(neig=neig,method=method,verbose=verbose)
+            if cachedir is not None:
+                np.savez(cachefile,evals=evals,evecs=evecs)
+        # total variance is trace of covariance matrix (unit variance at
+        # each grid point).
+        frac = evals.sum()/self.N**2
+        evecs *= np.sqrt(evals/frac) # (in place, evecs not used after this)
+        self.scaledevecs = evecs
+        self.nevecs = len(evals)
+        if verbose:
+            print('%s eigenvectors explain %s percent of variance' %\
+            (self.nevecs,100*frac))
+        # initialize random coefficients.
+        self.coeffs = self.rs.normal(size=(self.nsamples,self.nevecs))
+        self.pattern = self.random_sample()
+
+    def _kernels(self):
+        # spectra of a bank of stationary smoothing kernels (square root of
+        # the Matern covariance spectrum), and the weights used to blend
+        # them at each grid point.  The covariance A*A.T of the resulting
+        # process convolution (Higdon 1998) is positive definite, and
+        # equal to the Matern covariance if the length scale is constant.
+        x1 = np.arange(0,self.L,self.L/self.N)
+        x, y = np.meshgrid(x1, x1)
+        r = _cartdist(0.,0.,x,y,self.L,self.L)
+        hmin = self.hcorr.min(); hmax = self.hcorr.max()
+        nbank = int(np.ceil(np.log(hmax/hmin)/np.log(self.bankratio)))+1
+        hbank = hmin*(hmax/hmin)**(np.arange(nbank)/max(nbank-1,1.))
+        kernelspec = np.empty((nbank,self.N,self.N//2+1),np.float64)
+        for j in range(nbank):
+            evals = np.fft.rfft2(_matern(r,hbank[j])).real.clip(0)
+            kernelspec[j] = np.sqrt(evals)
+        # linear interpolation in log(length scale) between bank members.
+        weights = np.zeros((nbank,self.N,self.N),np.float64)
+        if nbank == 1:
+            weights[0] = 1.
+        else:
+            pos = (nbank-1)*np.log(self.hcorr/hmin)/np.log(hmax/hmin)
+            j = np.minimum(pos.astype(np.int64),nbank-2)
+            frac = pos-j
+            for jj in range(nbank-1):
+                weights[jj] += np.where(j==jj,1.-frac,0.)
+                weights[jj+1] += np.where(j==jj,frac,0.)
+        # rescale weights so variance is one at each grid point.
+        # zero lag cross-covariance between bank members i and j.
+        spec = np.concatenate((kernelspec,kernelspec[...,1:self.N//2]),axis=-1)
+        cov0 = np.einsum('ikl,jkl->ij',spec,spec)/self.N**2
+        var = np.einsum('ij,ikl,jkl->kl',cov0,weights,weights)
+        self.kernelspec = kernelspec; self.weights = weights/np.sqrt(var)
+
+    def _apply(self,x):
+        # apply process convolution operator A to x[...,N,N].
+        xspec = np.fft.rfft2(x)
+        y = np.zeros(x.shape,np.float64)
+        for j in range(len(self.kernelspec)):
+            y += self.weights[j]*np.fft.irfft2(self.kernelspec[j]*xspec,s=(self.N,self.N))
+        return y
+
+    def _apply_transpose(self,y):
+        # apply A.T to y[...,N,N].
+        xspec = 0.
+        for j in range(len(self.kernelspec)):
+            xspec = xspec + self.kernelspec[j]*np.fft.rfft2(self.weights[j]*y)
+        return np.fft.irfft2(xspec,s=(self.N,self.N))
+
+    def _apply_columns(self,fn,x,out=None,chunksize=64):
+        # apply fn (_apply or _apply_transpose) to the columns of
+        # x[N**2,ncols], chunksize columns at a time, so the FFT work
+        # arrays are only chunk sized.
+        N = self.N
+        if out is None: out = np.empty(x.shape,np.float64)
+        for n1 in range(0,x.shape[1],chunksize):
+            c = slice(n1,n1+chunksize)
+            out[:,c] = fn(x[:,c].T.reshape((-1,N,N))).reshape((-1,N**2)).T
+        return out
+
+    def covariance(self):
+        """
+        return covariance as a scipy.sparse.linalg.LinearOperator
+        (never formed as a matrix).
+        """
+        N = self.N
+        if not hasattr(self,'kernelspec'): self._kernels()
+        def matmat(x):
+            x = x.reshape((N**2,-1)).T.reshape((-1,N,N))
+            return self._apply(self._apply_transpose(x)).reshape((-1,N**2)).T
+        return LinearOperator((N**2,N**2),matvec=matmat,matmat=matmat,\
+                              dtype=np.float64)
+
+    def _neig_estimate(self):
+        # number of eigenvectors needed for a stationary covariance with
+        # the smallest length scale (an upper bound for the
+        # non-stationary case), from the FFT of the circulant matrix.
+        x1 = np.arange(0,self.L,self.L/self.N)
+        x, y = np.meshgrid(x1, x1)
+        r = _cartdist(0.,0.,x,y,self.L,self.L)
+        evals = np.fft.fft2(_matern(r,self.hcorr.min())).real.clip(0)
+        evals = np.sort(evals.ravel())[::-1]
+        return np.searchsorted(np.cumsum(evals)/evals.sum(),self.thresh)+1
+
+    def _eigs(self,neig=None,method='randomized',verbose=False):
+        # leading eigenpairs of the covariance explaining fraction thresh
+        # of total variance.
+        ndim = self.N**2; N = self.N
+        if neig is None:
+            neig = int(1.1*self._neig_estimate())+10
+        # random vectors for the eigensolvers from a fixed seed (not self.rs),
+        # so the eigenvectors only depend on the covariance, and the random
+        # coefficients do not depend on whether they were read from the cache.
+        rs = np.random.RandomState(42)
+        while True:
+            neig = min(neig, ndim-1)
+            if method == 'lanczos':
+                evals, evecs = eigsh(self.covariance(),k=neig,which='LA',\
+                                     v0=rs.uniform(-1.,1.,ndim))
+                evals = evals[::-1]; evecs = evecs[:,::-1]
+            elif method == 'randomized':
+                # randomized eigensolver for A*A.T (Halko et al 2011) with
+                # one power iteration.  The only (N**2,neig) array is the
+                # range basis q (operators applied a chunk of columns at
+                # a time), the eigenproblem is solved for the projected
+                # (neig,neig) matrix q.T*A*A.T*q, and only the
+                # eigenvectors that are kept are formed.
+                q = np.empty((ndim,neig),np.float64)
+                for n1 in range(0,neig,64):
+                    nc = min(64,neig-n1)
+                    q[:,n1:n1+nc] = self._apply(rs.normal(size=(nc,N,N))).reshape((nc,ndim)).T
+                q = np.linalg.qr(q)[0]
+                q = np.linalg.qr(self._apply_columns(self._apply_transpose,q,out=q))[0]
+                q = np.linalg.qr(self._apply_columns(self._apply,q,out=q))[0]
+                proj = np.empty((neig,neig),np.float64)
+                for n1 in range(0,neig,64):
+                    c = slice(n1,n1+64)
+                    proj[:,c] = np.dot(q.T,self._apply_columns(self._apply,\
+                                self._apply_columns(self._apply_transpose,q[:,c])))
+                evals, u = np.linalg.eigh(0.5*(proj+proj.T))
+                evals = evals[::-1].clip(0); u = u[:,::-1]
+                evecs = None
+            else:
+                raise ValueError("method must be 'randomized' or 'lanczos'")
+            frac = np.cumsum(evals)/ndim
+            if frac[-1] >= self.thresh or neig == ndim-1:
+                break
+            if verbose:
+                print('%s eigenvectors explain %s percent of variance, increasing' %\
+                (neig,100*frac[-1]))
+            neig = int(1.5*neig)
+        neig = min(np.searchsorted(frac,self.thresh)+1,len(evals))
+        if evecs is None:
+            evecs = np.dot(q,u[:,:neig])
+        elif neig < evecs.shape[1]:
+            evecs = evecs[:,:neig].copy() # so the full array can be freed
+        return evals[:neig], evecs
+
+    def copy(self,seed):
+        import copy
+        newself = copy.copy(self)
+        newself.rs = get_randomstate(seed)
+        newself.coeffs = newself.rs.normal(size=(self.nsamples,self.nevecs))
+        newself.pattern = newself.random_sample()
+        return newself
+
+    def random_sample(self):
+        """
+        return random sample
+        """
+        xens = np.dot(self.stdev*self.coeffs,self.scaledevecs.T)
+        return xens.reshape((self.nsamples, self.N, self.N)).squeeze().astype(self.dtype)
+
+    def evolve(self,dt=None):
+        """
+        evolve sample one time step
+        """
+        if dt is None:
+            lag1corr = self.lag1corr
+        else:
+            lag1corr = np.exp(-1)**(dt/self.tcorr)
+        self.coeffs = \
+        np.sqrt(1.-lag1corr**2)* \
+        self.rs.normal(size=(self.nsamples,self.nevecs)) + \
+        lag1corr*self.coeffs
+        self.pattern = self.random_sample()
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    # length scale varies across the jet (larger near center of domain).
+    N = 128; L = 20.e6; nsamples = 4; stdev = 2
+    def hcorr(x,y):
+        return 250.e3*(1.+np.sin(np.pi*y/L)**2)
+    rp = RandomPatternEigsh(hcorr,3600.,L,N,1800,nsamples=nsamples,stdev=stdev,
+                            verbose=True)
+    xens = rp.pattern
+    minmax = max(np.abs(xens.min()), np.abs(xens.max()))
+    for n in range(nsamples):
+        plt.figure()
+        plt.imshow(xens[n],plt.cm.bwr,interpolation='nearest',origin='lower',vmin=-minmax,vmax=minmax)
+        plt.title('pattern %s' % n)
+        plt.colorbar()
+    plt.show()
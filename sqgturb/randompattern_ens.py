@@ -1,9 +1,11 @@
 import numpy as np
+from .rngstreams import get_randomstate
+from .precision import get_dtype
 from scipy.ndimage import gaussian_filter
 
 class RandomPatternEns:
     def __init__(self, spatial_corr_efold, temporal_corr_efold, L, N, dt, nens, \
-                 stdev=1.0, order=0):
+                 stdev=1.0, order=0, seed=None, precision=None):
         """
         define an ensemble of random patterns with specified temporal
         and spatial covariance structure by applying Gaussian blur to
@@ -19,7 +21,13 @@ class RandomPatternEns:
         then pattern is duplicated..  If set to 2, independent
         patterns are generated for each boundary.
         stdev:  spatial standard deviation (amplitude).
+        seed:  random seed (int), or a numpy Generator/RandomState
+        (e.g. from RandomStreams.generator).  If None, the global
+        numpy random state is used.
+        precision:  'single' or 'double' precision for pattern (default
+        from precision.py).
         """
+        self.dtype = get_dtype(precision)
         self.hcorr = spatial_corr_efold
         self.tcorr = temporal_corr_efold
         self.dt = dt
@@ -28,9 +36,13 @@ class RandomPatternEns:
         self.N = N
         self.order = order
         self.nens = nens
+        if seed is None:
+            self.rs = np.random
+        else:
+            self.rs = get_randomstate(seed)
         # initialize patterns.
         # generate white noise.
-        self.pattern = self.stdev*np.random.normal(\
+        self.pattern = self.stdev*self.rs.normal(\
                        size=(nens,2,self.N,self.N))
         if self.hcorr > 0:
             # apply gaussian filter
@@ -48,7 +60,7 @@ class RandomPatternEns:
                     for n in range(2):
                         stdev_computed = np.sqrt((self.pattern[ne,n,:,:]**2).mean())
                         self.pattern[ne,n,:,:] = self.pattern[ne,n,:,:]*stdev/stdev_computed
-        self.pattern = self.pattern - self.pattern.mean(axis=0) # ensure zero mean          
+        self.pattern = (self.pattern - self.pattern.mean(axis=0,dtype=np.float64)).astype(self.dtype) # ensure zero mean
 
     def evolve(self,dt=None):
         """
@@ -57,7 +69,7 @@ class RandomPatternEns:
         if dt is None: dt = self.dt
         lag1corr = np.exp(-1)**(dt/self.tcorr)
         # generate white noise.
-        newpattern = self.stdev*np.random.normal(\
+        newpattern = self.stdev*self.rs.normal(\
                      size=(self.nens,2,self.N,self.N))
         if self.hcorr > 0:
             for ne in range(self.nens):
@@ -76,7 +88,8 @@ class RandomPatternEns:
                         self.pattern[ne,n,:,:]  = self.pattern[ne,n,:,:]*self.stdev/stdev_computed
                 # blend new pattern with old pattern.
                 self.pattern[ne] = np.sqrt(1.-lag1corr**2)*newpattern[ne] + lag1corr*self.pattern[ne]
-        self.pattern = self.pattern - self.pattern.mean(axis=0) # ensure zero mean          
+        # ensure zero mean (mean accumulated in double precision).
+        self.pattern = (self.pattern - self.pattern.mean(axis=0,dtype=np.float64)).astype(self.dtype)
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
@@ -87,7 +100,7 @@ if __name__ == "__main__":
     # plot random sample.
     xens = rp.pattern
     xensmean = xens.mean(axis=0)
-    print xensmean.min(), xensmean.max(), xensmean.mean()
+    print(xensmean.min(), xensmean.max(), xensmean.mean())
     minmax = max(np.abs(xens.min()), np.abs(xens.max()))
     for n in range(nens):
         plt.figure()
@@ -107,14 +120,14 @@ if __name__ == "__main__":
         x = rp.pattern[0,1]
         lag1cov = lag1cov + x*xold/(ntimes-1)
         lag1var = lag1var + x*x/(ntimes-1)
-        spatial_cov = spatial_cov + x[rp.N/2,rp.N/2]*x/(ntimes-1)
+        spatial_cov = spatial_cov + x[rp.N//2,rp.N//2]*x/(ntimes-1)
     plt.figure()
     x = (rp.L/rp.N)*np.arange(rp.N)-rp.L/2
-    plt.plot(x,0.5*(spatial_cov[:,rp.N/2]+spatial_cov[rp.N/2,:]),'r')
+    plt.plot(x,0.5*(spatial_cov[:,rp.N//2]+spatial_cov[rp.N//2,:]),'r')
     plt.plot(x,np.exp(-(x/rp.hcorr)**2),'k')
     plt.axhline(0); plt.axvline(0)
     plt.show()
     lag1corr = lag1cov/lag1var
     lag1corr_exp = np.exp(-1)**(rp.dt/rp.tcorr)
-    print 'lag 1 autocorr = ',lag1corr.mean(), ', expected ',lag1corr_exp
-    print 'variance = ',lag1var.mean(),' (expected ',stdev**2,')'
+    print('lag 1 autocorr = ',lag1corr.mean(), ', expected ',lag1corr_exp)
+    print('variance = ',lag1var.mean(),' (expected ',stdev**2,')')
@@ -1,28 +1,43 @@
 import numpy as np
+from .rngstreams import get_randomstate
+from .precision import get_dtype
 from scipy.ndimage import gaussian_filter
 
 class RandomPatternSample:
-    def __init__(self, ncvar, temporal_corr_efold=0, dt=600, scale = 1.0):
+    def __init__(self, ncvar, temporal_corr_efold=0, dt=600, scale = 1.0, seed=None,\
+                 precision=None):
         self.dt = dt
         self.ncvar = ncvar
         self.ntimes = ncvar.shape[0]
         self.tcorr = temporal_corr_efold
         self.scale = scale
+        # precision of pattern ('single' or 'double', default from precision.py)
+        self.dtype = get_dtype(precision)
         self.N = ncvar.shape[-1]
         if self.tcorr == 0:
             self.lag1corr = 0.
         else:
             self.lag1corr = np.exp(-1)**(self.dt/self.tcorr)
-        nt = np.random.randint(0,self.ntimes)
-        self.pattern = self.scale*self.ncvar[nt]
+        # seed can be an int or a numpy Generator/RandomState
+        # (if None, global numpy random state is used).
+        if seed is None:
+            self.rs = np.random
+        else:
+            self.rs = get_randomstate(seed)
+        nt = self.rs.choice(self.ntimes)
+        self.pattern = (self.scale*self.ncvar[nt]).astype(self.dtype)
 
-    def evolve(self):
-        nt = np.random.randint(0,self.ntimes)
+    def evolve(self,dt=None):
+        if dt is None or self.tcorr == 0:
+            lag1corr = self.lag1corr
+        else:
+            lag1corr = np.exp(-1)**(dt/self.tcorr)
+        nt = self.rs.choice(self.ntimes)
         newpattern = self.scale*self.ncvar[nt]
         # blend new pattern with old pattern.
         self.pattern = \
-        np.sqrt(1.-self.lag1corr**2)*newpattern + \
-        self.lag1corr*self.pattern
+        (np.sqrt(1.-lag1corr**2)*newpattern + \
+        lag1corr*self.pattern).astype(self.dtype)
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
@@ -54,11 +69,11 @@ if __name__ == "__main__":
         x = rp.pattern[1]
         lag1cov = lag1cov + x*xold/(ntimes-1)
         lag1var = lag1var + x*x/(ntimes-1)
-        spatial_cov = spatial_cov + x[rp.N/2,rp.N/2]*x/(ntimes-1)
+        spatial_cov = spatial_cov + x[rp.N//2,rp.N//2]*x/(ntimes-1)
     plt.figure()
-    x = np.arange(rp.N)-rp.N/2
-    plt.plot(x,0.5*(spatial_cov[:,rp.N/2]+spatial_cov[rp.N/2,:]),'r')
+    x = np.arange(rp.N)-rp.N//2
+    plt.plot(x,0.5*(spatial_cov[:,rp.N//2]+spatial_cov[rp.N//2,:]),'r')
     plt.axhline(0); plt.axvline(0)
     plt.show()
     lag1corr = lag1cov/lag1var
-    print 'lag 1 autocorr = ',lag1corr.mean(), ', expected ',rp.lag1corr
+    print('lag 1 autocorr = ',lag1corr.mean(), ', expected ',rp.lag1corr)
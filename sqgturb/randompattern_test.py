@@ -1,5 +1,6 @@
 import numpy as np
-from scipy.ndimage import convolve
+from .rngstreams import get_randomstate
+from .precision import get_dtype
 from scipy.special import gamma,kv
 
 def _gaussian(rr,corrl):
@@ -23,10 +24,32 @@ def _cartdist(x1,y1,x2,y2,xmax,ymax):
     dy = np.where(dy > 0.5*ymax, ymax - dy, dy)
     return np.sqrt(dx**2 + dy**2)
 
+# cache of filter spectra, keyed by (calcweights,hcorr,N,L,truncate).
+_kernelspec_cache = {}
+
+def _kernelspec(calcweights,hcorr,N,L,truncate):
+    # spectrum of (2*nwindow+1)**2 weight stencil wrapped onto periodic
+    # grid, normalized so filtered white noise has unit variance.
+    key = (calcweights,hcorr,N,L,truncate)
+    if key not in _kernelspec_cache:
+        dx = L/N
+        nwindow = int(truncate*hcorr/dx)
+        i = np.arange(-nwindow,nwindow+1)
+        i, j = np.meshgrid(i,i)
+        weights = calcweights(np.sqrt(i**2+j**2),hcorr/dx)
+        weights = weights/weights.sum()
+        kernel = np.zeros((N,N),np.float64)
+        np.add.at(kernel,(j%N,i%N),weights)
+        # variance of white noise convolved with kernel is sum of
+        # squared weights.
+        kernelspec = np.fft.rfft2(kernel).real/np.sqrt((kernel**2).sum())
+        _kernelspec_cache[key] = kernelspec
+    return _kernelspec_cache[key]
+
 class RandomPattern:
     def __init__(self, spatial_corr_efold, temporal_corr_efold, L, N, dt, \
             nsamples=1, stdev=1.0, seed=None, truncate=4,
-            calcweights=_gaussian):
+            calcweights=_gaussian, precision=None):
         """
         define an ensemble of random patterns with specified temporal
         and spatial covariance structure by applying Gaussian blur to
@@ -42,6 +65,8 @@ class RandomPattern:
         then pattern is duplicated..  If set to 2, independent
         patterns are generated for each boundary.
         stdev:  spatial standard deviation (amplitude).
+        precision:  'single' or 'double' precision for pattern (default
+        from precision.py).
         """
         self.hcorr = spatial_corr_efold
         self.tcorr = temporal_corr_efold
@@ -51,22 +76,12 @@ class RandomPattern:
         self.nsamples = nsamples
         self.N = N
         # initialize random coefficients.
-        if seed is None:
-            self.rs = np.random.RandomState()
-        else:
-            self.rs = np.random.RandomState(seed)
-        # generate weights.
-        dx = L/N
-        nwindow = int(truncate*self.hcorr/dx)
-        npts = 2*nwindow+1
-        self.weights = np.zeros((npts,npts),np.float)
-        for j in range(-nwindow,nwindow+1):
-            for i in range(-nwindow,nwindow+1):
-                self.weights[i+nwindow,j+nwindow] =\
-                calcweights(np.sqrt(i**2+j**2),self.hcorr/dx)
-        self.weights = self.weights/self.weights.sum()
+        self.rs = get_randomstate(seed)
+        # generate spectrum of filter weights (cached).
+        self.kernelspec = _kernelspec(calcweights,self.hcorr,self.N,self.L,truncate)
         # initialize random pattern.
-        self.pattern = self.genpattern()
+        self.dtype = get_dtype(precision)
+        self.pattern = self.genpattern().astype(self.dtype)
 
     def genpattern(self,seed=None):
         # initialize patterns.
@@ -79,28 +94,22 @@ class RandomPattern:
             pattern[1] = pattern[0]
         else:
             raise ValueError('nsamples must be 1 or 2')
-        # apply filter
+        # apply filter (periodic convolution, multiplication in spectral
+        # space). kernel spectrum is normalized so variance is preserved.
         if self.nsamples == 2:
-            for n in range(self.nsamples):
-                pattern[n] = convolve(pattern[n],
-                self.weights,output=None,
-                mode='wrap', cval=0.0)
+            pattern = np.fft.irfft2(self.kernelspec*np.fft.rfft2(pattern),\
+                                    s=(self.N,self.N))
         else:
-            pattern[0] = convolve(pattern[0],
-            self.weights,output=None,
-            mode='wrap', cval=0.0)
+            pattern[0] = np.fft.irfft2(self.kernelspec*np.fft.rfft2(pattern[0]),\
+                                       s=(self.N,self.N))
             pattern[1]=pattern[0]
-        # restore variance removed by filter
-        for n in range(2):
-            stdev_computed = np.sqrt((pattern[n,:,:]**2).mean())
-            pattern[n,:,:] = pattern[n,:,:]*self.stdev/stdev_computed
         return pattern
 
     def copy(self,seed):
         import copy
         newself = copy.copy(self)
-        newself.rs = np.random.RandomState(seed)
-        newself.pattern = self.genpattern()
+        newself.rs = get_randomstate(seed)
+        newself.pattern = newself.genpattern().astype(self.dtype)
         return newself
 
     def evolve(self,dt=None):
@@ -111,7 +120,8 @@ class RandomPattern:
         pattern = self.genpattern()
         # blend new pattern with old pattern.
         lag1corr = np.exp(-1.0)**(dt/self.tcorr)
-        self.pattern = np.sqrt(1.-lag1corr**2)*pattern + lag1corr*self.pattern
+        self.pattern = (np.sqrt(1.-lag1corr**2)*pattern + \
+                        lag1corr*self.pattern).astype(self.dtype)
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
@@ -141,14 +151,14 @@ if __name__ == "__main__":
         x = rp.pattern[0]
         lag1cov = lag1cov + x*xold/(ntimes-1)
         lag1var = lag1var + x*x/(ntimes-1)
-        spatial_cov = spatial_cov + x[rp.N/2,rp.N/2]*x/(ntimes-1)
+        spatial_cov = spatial_cov + x[rp.N//2,rp.N//2]*x/(ntimes-1)
     plt.figure()
     x = (rp.L/rp.N)*np.arange(rp.N)-rp.L/2
-    plt.plot(x,0.5*(spatial_cov[:,rp.N/2]+spatial_cov[rp.N/2,:]),'r')
+    plt.plot(x,0.5*(spatial_cov[:,rp.N//2]+spatial_cov[rp.N//2,:]),'r')
     plt.plot(x,np.exp(-(x/rp.hcorr)**2),'k')
     plt.axhline(0); plt.axvline(0)
     plt.show()
     lag1corr = lag1cov/lag1var
     lag1corr_exp = np.exp(-1)**(rp.dt/rp.tcorr)
-    print 'lag 1 autocorr = ',lag1corr.mean(), ', expected ',lag1corr_exp
-    print 'variance = ',lag1var.mean(),' (expected ',stdev**2,')'
+    print('lag 1 autocorr = ',lag1corr.mean(), ', expected ',lag1corr_exp)
+    print('variance = ',lag1var.mean(),' (expected ',stdev**2,')')
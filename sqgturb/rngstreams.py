@@ -0,0 +1,91 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+def _purpose_key(purpose):
+    # map purpose name to an integer (a checksum, so keys do not depend on
+    # the order in which purposes are first used).
+    return zlib.crc32(str(purpose).encode()) & 0xffffffff
+
+def get_randomstate(seed=None):
+    """
+    return random number generator for seed.  A numpy Generator (e.g. from
+    RandomStreams.generator) or RandomState is returned unchanged,
+    otherwise a legacy RandomState is created (seed=None for an
+    unseeded one).
+    """
+    if isinstance(seed, (np.random.Generator, np.random.RandomState)):
+        return seed
+    else:
+        return np.random.RandomState(seed)
+
+class RandomStreams:
+    def __init__(self, seed=None, bitgen='philox'):
+        """
+        counter-based random number streams.
+
+        Each stream is an independent numpy Generator keyed by
+        (member, level, purpose, cycle), so the numbers drawn for one key
+        do not depend on which other streams were used, or in what order.
+        Noise for different members/levels can be generated in
+        parallel threads or processes and remains bit-reproducible.
+
+        seed:  root seed (int).  If None, fresh entropy is used (and saved
+        as the seed attribute so the streams can be recreated).
+        bitgen:  'philox' (default) or 'pcg64' bit generator.
+        """
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+        if bitgen == 'philox':
+            self._bitgen = np.random.Philox
+        elif bitgen == 'pcg64':
+            self._bitgen = np.random.PCG64
+        else:
+            raise ValueError("bitgen must be 'philox' or 'pcg64'")
+        self.bitgen = bitgen
+
+    def generator(self, member=0, level=0, purpose='default', cycle=0):
+        """
+        return numpy Generator for stream (member, level, purpose, cycle).
+        Calling twice with the same key returns a generator that
+        reproduces the same sequence.
+        """
+        key = (_purpose_key(purpose), int(member), int(level), int(cycle))
+        ss = np.random.SeedSequence(self.seed, spawn_key=key)
+        return np.random.Generator(self._bitgen(ss))
+
+    def normal(self, size=None, scale=1.0, dtype=np.float32, out=None,\
+               member=0, level=0, purpose='default', cycle=0):
+        """
+        draw normal random numbers (ziggurat sampler) from stream
+        (member, level, purpose, cycle), in single precision by default.
+        If out is given the numbers are written to it in place
+        (size and dtype are then taken from out).
+        """
+        gen = self.generator(member=member,level=level,purpose=purpose,cycle=cycle)
+        if out is None:
+            out = gen.standard_normal(size=size,dtype=dtype)
+        else:
+            gen.standard_normal(dtype=out.dtype,out=out)
+        if scale != 1.0:
+            out *= scale
+        return out
+
+    def normal_members(self, out, scale=1.0, level=0, purpose='default',\
+                       cycle=0, threads=1):
+        """
+        fill out[nmember,...] in place, with out[nmember] drawn from stream
+        (nmember, level, purpose, cycle).  Members are filled in parallel
+        using threads; the result does not depend on threads.
+        """
+        def fill(member):
+            self.normal(scale=scale,out=out[member],member=member,\
+                        level=level,purpose=purpose,cycle=cycle)
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(fill, range(out.shape[0])))
+        else:
+            for member in range(out.shape[0]):
+                fill(member)
+        return out
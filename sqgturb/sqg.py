@@ -1,6 +1,7 @@
 from __future__ import print_function
 import os
 import numpy as np
+from .precision import get_dtype
 try: # pyfftw is *much* faster
     from pyfftw.interfaces import numpy_fft, cache
     #print('# using pyfftw...')
@@ -15,16 +16,31 @@ except ImportError: # fall back on numpy fft.
         kwargs.pop('threads',None)
         return np.fft.irfft2(*args,**kwargs)
 
+def batch_param(value, dtype):
+    # model parameter, scalar or array over batch dimensions (shape
+    # S, reshaped to S+(1,1,1) to broadcast against spectral arrays
+    # [...,2,N,N/2+1]).
+    value = np.array(value,dtype)
+    if value.ndim:
+        value = value.reshape(value.shape+(1,1,1))
+    return value
+
 class SQG:
 
     def __init__(self,pv,f=1.e-4,nsq=1.e-4,L=20.e6,H=10.e3,U=30.,\
                  r=0.,tdiab=10.*86400,diff_order=8,diff_efold=None,random_pattern=None,
-                 random_pattern_skebs=None,
-                 symmetric=True,dt=None,dealias=True,threads=1,precision='single'):
+                 random_pattern_skebs=None,pattern_update_interval=1,
+                 symmetric=True,dt=None,dealias=True,threads=1,precision=None):
         # initialize SQG model.
-        if pv.shape[0] != 2:
-            raise ValueError('1st dim of pv should be 2')
-        N = pv.shape[1] # number of grid points in each direction
+        # pv can have leading (batch) dimensions, pv[...,2,N,N], e.g. for
+        # ensemble members and/or start times integrated together (all
+        # FFTs and tendencies computed for the whole batch at once).
+        # r, tdiab, diff_order and diff_efold can be arrays over the batch
+        # dimensions (e.g. one value per member for a calibration sweep),
+        # each state then gets its own damping and hyperdiffusion.
+        if pv.ndim < 3 or pv.shape[-3] != 2:
+            raise ValueError('pv should have shape (...,2,N,N)')
+        N = pv.shape[-1] # number of grid points in each direction
         # N should be even
         if N%2:
             raise ValueError('N must be even (powers of 2 are fastest)')
@@ -35,15 +51,9 @@ class SQG:
         # number of openmp threads to use for FFTs (only for pyfftw)
         self.threads = threads
         self.N = N
-        if precision == 'single':
-            # ffts in single precision (faster)
-            dtype = np.float32
-        elif precision == 'double':
-            # ffts in double precision
-            dtype = np.float64
-        else:
-            msg="precision must be 'single' or 'double'"
-            raise ValueError(msg)
+        # ffts in single precision (faster) or double precision
+        # (precision=None uses package default, see precision.py).
+        dtype = get_dtype(precision)
         # force arrays to be float32 for precision='single' (ffts are twice as fast)
         self.nsq = np.array(nsq,dtype) # Brunt-Vaisalla (buoyancy) freq squared
         self.f = np.array(f,dtype) # coriolis
@@ -52,12 +62,12 @@ class SQG:
         self.L = np.array(L,dtype) # size of square domain.
         self.dt = np.array(dt,dtype) # time step (seconds)
         self.dealias = dealias  # if True, dealiasing applied using 2/3 rule.
-        if r < 1.e-10:
+        if (np.asarray(r) < 1.e-10).all():
             self.ekman = False
         else:
             self.ekman = True
-        self.r = np.array(r,dtype) # Ekman damping (at z=0)
-        self.tdiab = np.array(tdiab,dtype) # thermal relaxation damping.
+        self.r = batch_param(r,dtype) # Ekman damping (at z=0)
+        self.tdiab = batch_param(tdiab,dtype) # thermal relaxation damping.
         self.t = 0 # initialize time counter
         # setup basic state pv (for thermal relaxation)
         self.symmetric = symmetric # symmetric jet, or jet with U=0 at sfc.
@@ -89,7 +99,7 @@ class SQG:
         self.pvspec_eq = rfft2(pvbar) # state to relax to with timescale tdiab
         self.pvspec = rfft2(pv) # initial pv field (spectral)
         # spectral stuff
-        k = (N*np.fft.fftfreq(N))[0:(N/2)+1]
+        k = (N*np.fft.fftfreq(N))[0:(N//2)+1]
         l = N*np.fft.fftfreq(N)
         k,l = np.meshgrid(k,l)
         k = k.astype(dtype); l = l.astype(dtype)
@@ -100,8 +110,8 @@ class SQG:
         self.ik = (1.j*k).astype(np.complex64)
         self.il = (1.j*l).astype(np.complex64)
         if dealias: # arrays needed for dealiasing nonlinear Jacobian
-            k_pad = ((3*N/2)*np.fft.fftfreq(3*N/2))[0:(3*N/4)+1]
-            l_pad = (3*N/2)*np.fft.fftfreq(3*N/2)
+            k_pad = ((3*N//2)*np.fft.fftfreq(3*N//2))[0:(3*N//4)+1]
+            l_pad = (3*N//2)*np.fft.fftfreq(3*N//2)
             k_pad,l_pad = np.meshgrid(k_pad,l_pad)
             k_pad = k_pad.astype(dtype); l_pad = l_pad.astype(dtype)
             k_pad = 2.*pi*k_pad/self.L; l_pad = 2.*pi*l_pad/self.L
@@ -113,8 +123,8 @@ class SQG:
         mu = mu.astype(np.float64) # cast to avoid overflow in sinh
         self.tanhmu = np.tanh(mu).astype(dtype) # cast back to original type
         self.sinhmu = np.sinh(mu).astype(dtype)
-        self.diff_order = np.array(diff_order,dtype) # hyperdiffusion order
-        self.diff_efold = np.array(diff_efold,dtype) # hyperdiff time scale
+        self.diff_order = batch_param(diff_order,dtype) # hyperdiffusion order
+        self.diff_efold = batch_param(diff_efold,dtype) # hyperdiff time scale
         ktot = np.sqrt(ksqlsq)
         ktotcutoff = np.array(pi*N/self.L, dtype)
         # integrating factor for hyperdiffusion
@@ -129,26 +139,32 @@ class SQG:
         # random pattern class for stochastic backscatter additive noise
         # (default None, no stochastic backsatter)
         self.random_pattern_skebs = random_pattern_skebs
+        # random patterns evolved every pattern_update_interval time steps
+        # (with lag-1 correlation for pattern_update_interval*dt), stochastic
+        # forcing linearly interpolated in time between updates.
+        self.pattern_update_interval = pattern_update_interval
+        self.pattern_step = 0 # time steps since first pattern update
+        self.upert_next = None; self.pvspec_pert_next = None
 
     def invert(self,pvspec=None):
         if pvspec is None: pvspec = self.pvspec
         # invert boundary pv to get streamfunction
-        psispec = np.empty((2,self.N,self.N/2+1),dtype=pvspec.dtype)
-        psispec[0] = self.Hovermu*((pvspec[1]/self.sinhmu) -\
-                                   (pvspec[0]/self.tanhmu))
-        psispec[1] = self.Hovermu*((pvspec[1]/self.tanhmu) -\
-                                   (pvspec[0]/self.sinhmu))
+        psispec = np.empty(pvspec.shape,dtype=pvspec.dtype)
+        psispec[...,0,:,:] = self.Hovermu*((pvspec[...,1,:,:]/self.sinhmu) -\
+                                           (pvspec[...,0,:,:]/self.tanhmu))
+        psispec[...,1,:,:] = self.Hovermu*((pvspec[...,1,:,:]/self.tanhmu) -\
+                                           (pvspec[...,0,:,:]/self.sinhmu))
         return psispec
 
     def invert_inverse(self,psispec=None):
         if psispec is None: psispec = self.invert(self.pvspec)
         # given streamfunction, return PV
-        pvspec = np.empty((2,self.N,self.N/2+1),dtype=psispec.dtype)
+        pvspec = np.empty(psispec.shape,dtype=psispec.dtype)
         alpha = self.Hovermu; th = self.tanhmu; sh = self.sinhmu
         tmp1 = 1./sh**2 - 1./th**2; tmp1[0,0]=1.
-        pvspec[0] = ((psispec[0]/th)-(psispec[1]/sh))/(alpha*tmp1)
-        pvspec[1] = ((psispec[0]/sh)-(psispec[1]/th))/(alpha*tmp1)
-        pvspec[:,0,0] = 0. # area mean PV not determined by streamfunction
+        pvspec[...,0,:,:] = ((psispec[...,0,:,:]/th)-(psispec[...,1,:,:]/sh))/(alpha*tmp1)
+        pvspec[...,1,:,:] = ((psispec[...,0,:,:]/sh)-(psispec[...,1,:,:]/th))/(alpha*tmp1)
+        pvspec[...,0,0] = 0. # area mean PV not determined by streamfunction
         return pvspec
 
     def advance(self,pv=None):
@@ -165,19 +181,19 @@ class SQG:
         # pad spectral arrays with zeros to get
         # interpolation to 3/2 larger grid using inverse fft.
         # take care of normalization factor for inverse transform.
-        specarr_pad = np.zeros((2, 3*self.N/2, 3*self.N/4+1), specarr.dtype)
-        specarr_pad[:,0:self.N/2,0:self.N/2] = 2.25*specarr[:,0:self.N/2,0:self.N/2]
-        specarr_pad[:,-self.N/2:,0:self.N/2] = 2.25*specarr[:,-self.N/2:,0:self.N/2]
+        specarr_pad = np.zeros(specarr.shape[:-2]+(3*self.N//2, 3*self.N//4+1), specarr.dtype)
+        specarr_pad[...,0:self.N//2,0:self.N//2] = 2.25*specarr[...,0:self.N//2,0:self.N//2]
+        specarr_pad[...,-self.N//2:,0:self.N//2] = 2.25*specarr[...,-self.N//2:,0:self.N//2]
         # include negative Nyquist frequency.
-        specarr_pad[:,0:self.N/2,self.N/2]=np.conjugate(2.25*specarr[:,0:self.N/2,-1])
-        specarr_pad[:,-self.N/2:,self.N/2]=np.conjugate(2.25*specarr[:,-self.N/2:,-1])
+        specarr_pad[...,0:self.N//2,self.N//2]=np.conjugate(2.25*specarr[...,0:self.N//2,-1])
+        specarr_pad[...,-self.N//2:,self.N//2]=np.conjugate(2.25*specarr[...,-self.N//2:,-1])
         return specarr_pad
 
     def spectrunc(self, specarr):
         # truncate spectral array using 2/3 rule.
-        specarr_trunc = np.zeros((2, self.N, self.N/2+1), specarr.dtype)
-        specarr_trunc[:,0:self.N/2,0:self.N/2] = specarr[:,0:self.N/2,0:self.N/2]
-        specarr_trunc[:,-self.N/2:,0:self.N/2] = specarr[:,-self.N/2:,0:self.N/2]
+        specarr_trunc = np.zeros(specarr.shape[:-2]+(self.N, self.N//2+1), specarr.dtype)
+        specarr_trunc[...,0:self.N//2,0:self.N//2] = specarr[...,0:self.N//2,0:self.N//2]
+        specarr_trunc[...,-self.N//2:,0:self.N//2] = specarr[...,-self.N//2:,0:self.N//2]
         return specarr_trunc
 
     def xyderiv(self, specarr):
@@ -190,6 +206,38 @@ class SQG:
            yderiv = irfft2(self.il_pad*specarr_pad,threads=self.threads)
         return xderiv,yderiv
 
+    def random_winds(self):
+        # perturbation u,v for randomized advection from random pattern.
+        rp_norm = self.random_pattern.norm
+        if rp_norm == 'pv':
+            # random pattern represents pv (theta)
+            psispec_pert = self.invert(rfft2(self.random_pattern.pattern,threads=self.threads))
+        elif rp_norm == 'psi':
+            # random patter represents psi (streamfunction).
+            psispec_pert = rfft2(self.random_pattern.pattern,threads=self.threads)
+        else:
+            msg="unrecognized 'norm' attribute for RandomPattern instance"
+            raise ValueError(msg)
+        vpert, upert = self.xyderiv(psispec_pert)
+        return -upert, vpert
+
+    def skebs_forcing(self):
+        # spectral pv forcing for SKEBS from random pattern.
+        rp_norm = self.random_pattern_skebs.norm
+        rpattern = self.random_pattern_skebs.pattern
+        # ensure area mean is zero for each level
+        rpattern -= rpattern.mean(axis=(-2,-1),keepdims=True)
+        if rp_norm == 'pv':
+            # random pattern represents pv (theta)
+            pvspec_pert = rfft2(rpattern,threads=self.threads)
+        elif rp_norm == 'psi':
+            # random patter represents psi (streamfunction).
+            pvspec_pert = self.invert_inverse(rfft2(rpattern,threads=self.threads))
+        else:
+            msg="unrecognized 'norm' attribute for RandomPattern instance"
+            raise ValueError(msg)
+        return pvspec_pert
+
     def gettend(self,pvspec=None):
         # compute tendencies of pv on z=0,H
         # invert pv to get streamfunction
@@ -201,23 +249,29 @@ class SQG:
         pvx,pvy = self.xyderiv(pvspec)
         # compute stochastic forcings
         # (held constant over RK4 time step)
+        nupdate = self.pattern_update_interval
         if self.random_pattern is not None and self.rkstep == 0:
             # compute perturbation u,v for randomized advection.
             # assume random winds constant over RK4 step
-            rp_norm = self.random_pattern.norm
-            if rp_norm == 'pv':
-                # random pattern represents pv (theta)
-                psispec_pert = self.invert(rfft2(self.random_pattern.pattern,threads=self.threads))
-            elif rp_norm == 'psi':
-                # random patter represents psi (streamfunction).
-                psispec_pert = rfft2(self.random_pattern.pattern,threads=self.threads)
+            if nupdate == 1:
+                self.upert, self.vpert = self.random_winds()
+                self.random_pattern.evolve()
             else:
-                msg="unrecognized 'norm' attribute for RandomPattern instance"
-                raise ValueError(msg)
-            self.vpert, self.upert = self.xyderiv(psispec_pert); self.upert = -self.upert
-            ke = 0.5*(self.upert**2+self.vpert**2).mean()
+                nstep = self.pattern_step % nupdate
+                if nstep == 0:
+                    if self.upert_next is None:
+                        self.upert_prev, self.vpert_prev = self.random_winds()
+                    else:
+                        self.upert_prev = self.upert_next
+                        self.vpert_prev = self.vpert_next
+                    self.random_pattern.evolve(nupdate*self.dt)
+                    self.upert_next, self.vpert_next = self.random_winds()
+                wt = float(nstep)/nupdate
+                self.upert = (1.-wt)*self.upert_prev + wt*self.upert_next
+                self.vpert = (1.-wt)*self.vpert_prev + wt*self.vpert_next
+            # (domain mean for each state in batch)
+            ke = 0.5*(self.upert**2+self.vpert**2).mean(axis=(-3,-2,-1),keepdims=True)
             self.diffcoeff = ke/self.dt
-            self.random_pattern.evolve()
             #print(ke,self.upert.min(),self.upert.max())
             #import matplotlib.pyplot as plt
             #plt.imshow(self.vpert[1],plt.cm.bwr,interpolation='nearest',origin='lower',vmin=-10,vmax=10)
@@ -228,20 +282,20 @@ class SQG:
             # compute pv forcing for SKEBS (random additive noise,
             # dissipation rate assumed constant over domain)
             # assume stochastic forcing constant over RK4 step
-            rp_norm = self.random_pattern_skebs.norm
-            rpattern = self.random_pattern_skebs.pattern
-            for k in range(2): # ensure area mean is zero for each level
-                rpattern[k] = rpattern[k] - rpattern[k].mean()
-            if rp_norm == 'pv':
-                # random pattern represents pv (theta)
-                self.pvspec_pert = rfft2(rpattern,threads=self.threads)
-            elif rp_norm == 'psi':
-                # random patter represents psi (streamfunction).
-                self.pvspec_pert = self.invert_inverse(rfft2(rpattern,threads=self.threads))
+            if nupdate == 1:
+                self.pvspec_pert = self.skebs_forcing()
+                self.random_pattern_skebs.evolve()
             else:
-                msg="unrecognized 'norm' attribute for RandomPattern instance"
-                raise ValueError(msg)
-            self.random_pattern_skebs.evolve()
+                nstep = self.pattern_step % nupdate
+                if nstep == 0:
+                    if self.pvspec_pert_next is None:
+                        self.pvspec_pert_prev = self.skebs_forcing()
+                    else:
+                        self.pvspec_pert_prev = self.pvspec_pert_next
+                    self.random_pattern_skebs.evolve(nupdate*self.dt)
+                    self.pvspec_pert_next = self.skebs_forcing()
+                wt = float(nstep)/nupdate
+                self.pvspec_pert = (1.-wt)*self.pvspec_pert_prev + wt*self.pvspec_pert_next
         if self.random_pattern is not None:  # add random velocity to determinstic velocity
             u += self.upert
             v += self.vpert
@@ -258,10 +312,11 @@ class SQG:
         #    dpvspecdt += -self.ksqlsq*self.diffcoeff*pvspec
         # Ekman damping at boundaries.
         if self.ekman:
-            dpvspecdt[0] += self.r*self.ksqlsq*psispec[0]
+            # (level dimension kept so per-state r broadcasts)
+            dpvspecdt[...,0:1,:,:] += self.r*self.ksqlsq*psispec[...,0:1,:,:]
             # for asymmetric jet (U=0 at sfc), no Ekman layer at lid
             if self.symmetric:
-                dpvspecdt[1] -= self.r*self.ksqlsq*psispec[1]
+                dpvspecdt[...,1:2,:,:] -= self.r*self.ksqlsq*psispec[...,1:2,:,:]
         # save wind field
         self.u = u; self.v = v
         return dpvspecdt
@@ -279,3 +334,4 @@ class SQG:
         k4 = self.dt*self.gettend(self.pvspec + k3)
         self.pvspec = self.hyperdiff*(self.pvspec + (k1+2.*k2+2.*k3+k4)/6.)
         self.t += self.dt # increment time
+        self.pattern_step += 1
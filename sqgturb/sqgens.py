@@ -1,6 +1,7 @@
 from __future__ import print_function
 import os
 import numpy as np
+from .precision import get_dtype
 try: # pyfftw is *much* faster
     from pyfftw.interfaces import numpy_fft, cache
     #print('# using pyfftw...')
@@ -19,7 +20,7 @@ class SQGEns:
 
     def __init__(self,pv,f=1.e-4,nsq=1.e-4,L=20.e6,H=10.e3,U=30.,\
                  r=0.,tdiab=10.*86400,diff_order=8,diff_efold=None,
-                 symmetric=True,dt=None,dealias=True,threads=1,precision='single'):
+                 symmetric=True,dt=None,dealias=True,threads=1,precision=None):
         # initialize SQG model.
         if pv.shape[0] != 2:
             raise ValueError('1st dim of pv should be 2')
@@ -34,15 +35,9 @@ class SQGEns:
         # number of openmp threads to use for FFTs (only for pyfftw)
         self.threads = threads
         self.N = N
-        if precision == 'single':
-            # ffts in single precision (faster)
-            dtype = np.float32
-        elif precision == 'double':
-            # ffts in double precision
-            dtype = np.float64
-        else:
-            msg="precision must be 'single' or 'double'"
-            raise ValueError(msg)
+        # ffts in single precision (faster) or double precision
+        # (precision=None uses package default, see precision.py).
+        dtype = get_dtype(precision)
         # force arrays to be float32 for precision='single' (ffts are twice as fast)
         self.nsq = np.array(nsq,dtype) # Brunt-Vaisalla (buoyancy) freq squared
         self.f = np.array(f,dtype) # coriolis
@@ -88,7 +83,7 @@ class SQGEns:
         self.pvspec_eq = rfft2(pvbar) # state to relax to with timescale tdiab
         self.pvspec = rfft2(pv) # initial pv field (spectral)
         # spectral stuff
-        k = (N*np.fft.fftfreq(N))[0:(N/2)+1]
+        k = (N*np.fft.fftfreq(N))[0:(N//2)+1]
         l = N*np.fft.fftfreq(N)
         k,l = np.meshgrid(k,l)
         k = k.astype(dtype); l = l.astype(dtype)
@@ -100,8 +95,8 @@ class SQGEns:
         self.ik = (1.j*k).astype(np.complex64)
         self.il = (1.j*l).astype(np.complex64)
         if dealias: # arrays needed for dealiasing nonlinear Jacobian
-            k_pad = ((3*N/2)*np.fft.fftfreq(3*N/2))[0:(3*N/4)+1]
-            l_pad = (3*N/2)*np.fft.fftfreq(3*N/2)
+            k_pad = ((3*N//2)*np.fft.fftfreq(3*N//2))[0:(3*N//4)+1]
+            l_pad = (3*N//2)*np.fft.fftfreq(3*N//2)
             k_pad,l_pad = np.meshgrid(k_pad,l_pad)
             k_pad = k_pad.astype(dtype); l_pad = l_pad.astype(dtype)
             k_pad = 2.*pi*k_pad/self.L; l_pad = 2.*pi*l_pad/self.L
@@ -118,14 +113,14 @@ class SQGEns:
         ktot = np.sqrt(ksqlsq)
         ktotcutoff = np.array(pi*N/self.L, dtype)
         # integrating factor for hyperdiffusion
-        # with efolding time scale for diffusion of shortest wave (N/2)
+        # with efolding time scale for diffusion of shortest wave (N//2)
         self.hyperdiff =\
         np.exp((-self.dt/self.diff_efold)*(ktot/ktotcutoff)**self.diff_order)
 
     def invert(self,pvspec=None):
         if pvspec is None: pvspec = self.pvspec
         # invert boundary pv to get streamfunction
-        psispec = np.empty((2,self.N,self.N/2+1),dtype=pvspec.dtype)
+        psispec = np.empty((2,self.N,self.N//2+1),dtype=pvspec.dtype)
         psispec[0] = self.Hovermu*((pvspec[1]/self.sinhmu) -\
                                    (pvspec[0]/self.tanhmu))
         psispec[1] = self.Hovermu*((pvspec[1]/self.tanhmu) -\
@@ -135,7 +130,7 @@ class SQGEns:
     def invert_inverse(self,psispec=None):
         if psispec is None: psispec = self.invert(self.pvspec)
         # given streamfunction, return PV
-        pvspec = np.empty((2,self.N,self.N/2+1),dtype=psispec.dtype)
+        pvspec = np.empty((2,self.N,self.N//2+1),dtype=psispec.dtype)
         alpha = self.Hovermu; th = self.tanhmu; sh = self.sinhmu
         tmp1 = 1./sh**2 - 1./th**2; tmp1[0,0]=1.
         pvspec[0] = ((psispec[0]/th)-(psispec[1]/sh))/(alpha*tmp1)
@@ -147,19 +142,19 @@ class SQGEns:
         # pad spectral arrays with zeros to get
         # interpolation to 3/2 larger grid using inverse fft.
         # take care of normalization factor for inverse transform.
-        specarr_pad = np.zeros((2, 3*self.N/2, 3*self.N/4+1), specarr.dtype)
-        specarr_pad[:,0:self.N/2,0:self.N/2] = 2.25*specarr[:,0:self.N/2,0:self.N/2]
-        specarr_pad[:,-self.N/2:,0:self.N/2] = 2.25*specarr[:,-self.N/2:,0:self.N/2]
+        specarr_pad = np.zeros((2, 3*self.N//2, 3*self.N//4+1), specarr.dtype)
+        specarr_pad[:,0:self.N//2,0:self.N//2] = 2.25*specarr[:,0:self.N//2,0:self.N//2]
+        specarr_pad[:,-self.N//2:,0:self.N//2] = 2.25*specarr[:,-self.N//2:,0:self.N//2]
         # include negative Nyquist frequency.
-        specarr_pad[:,0:self.N/2,self.N/2]=np.conjugate(2.25*specarr[:,0:self.N/2,-1])
-        specarr_pad[:,-self.N/2:,self.N/2]=np.conjugate(2.25*specarr[:,-self.N/2:,-1])
+        specarr_pad[:,0:self.N//2,self.N//2]=np.conjugate(2.25*specarr[:,0:self.N//2,-1])
+        specarr_pad[:,-self.N//2:,self.N//2]=np.conjugate(2.25*specarr[:,-self.N//2:,-1])
         return specarr_pad
 
     def spectrunc(self, specarr):
         # truncate spectral array using 2/3 rule.
-        specarr_trunc = np.zeros((2, self.N, self.N/2+1), specarr.dtype)
-        specarr_trunc[:,0:self.N/2,0:self.N/2] = specarr[:,0:self.N/2,0:self.N/2]
-        specarr_trunc[:,-self.N/2:,0:self.N/2] = specarr[:,-self.N/2:,0:self.N/2]
+        specarr_trunc = np.zeros((2, self.N, self.N//2+1), specarr.dtype)
+        specarr_trunc[:,0:self.N//2,0:self.N//2] = specarr[:,0:self.N//2,0:self.N//2]
+        specarr_trunc[:,-self.N//2:,0:self.N//2] = specarr[:,-self.N//2:,0:self.N//2]
         return specarr_trunc
 
     def xyderiv(self, specarr):
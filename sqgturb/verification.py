@@ -0,0 +1,139 @@
+from __future__ import print_function
+import numpy as np
+from .precision import accum_dtype
+from .ensstats import ensemble_moments, RunningStats
+from .sqg import rfft2, irfft2
+
+class ForecastStats:
+    def __init__(self, leads, spectra_leads=()):
+        """
+        forecast verification statistics accumulated over start times
+        (streaming, see ensstats.RunningStats) for each lead time in leads
+        (in units of the nature run output interval).
+
+        errsq, sprd:  domain mean squared error of ensemble mean and
+        ensemble variance (per lead).
+        kespec_err, kespec_sprd:  kinetic energy spectra (2,N,N//2+1) of
+        ensemble mean error and ensemble spread (mean over members), for
+        the leads in spectra_leads.
+        """
+        self.leads = list(leads)
+        self.spectra_leads = [lead for lead in spectra_leads if lead in self.leads]
+        self.errsq = dict((lead,RunningStats(reduce_axes=(-3,-2,-1))) for lead in self.leads)
+        self.sprd = dict((lead,RunningStats(reduce_axes=(-3,-2,-1))) for lead in self.leads)
+        self.kespec_err = dict((lead,RunningStats()) for lead in self.spectra_leads)
+        self.kespec_sprd = dict((lead,RunningStats()) for lead in self.spectra_leads)
+
+    def merge(self, other):
+        """combine with statistics accumulated separately in other"""
+        for lead in self.leads:
+            self.errsq[lead].merge(other.errsq[lead])
+            self.sprd[lead].merge(other.sprd[lead])
+        for lead in self.spectra_leads:
+            self.kespec_err[lead].merge(other.kespec_err[lead])
+            self.kespec_sprd[lead].merge(other.kespec_sprd[lead])
+
+    @property
+    def count(self):
+        return self.errsq[self.leads[0]].count
+
+    def rmse(self, lead):
+        """rms error of ensemble mean at lead"""
+        return np.sqrt(self.errsq[lead].mean)
+
+    def spread(self, lead):
+        """rms ensemble spread (standard deviation) at lead"""
+        return np.sqrt(self.sprd[lead].mean)
+
+    def spectra(self, lead):
+        """
+        total wavenumber kinetic energy spectra of error and spread at lead
+        (mean over levels), returns wavenumbers, error and spread spectra.
+        """
+        return (np.arange(self.kespec_err[lead].mean.shape[-2]//2+1),)+\
+               tuple(total_wavenumber_spectrum(stats[lead].mean) for stats in\
+                     [self.kespec_err,self.kespec_sprd])
+
+def total_wavenumber_spectrum(kespec):
+    """
+    sum 2d spectrum kespec[...,N,N//2+1] (mean over levels) in bins of
+    total wavenumber 0..N//2.
+    """
+    N = kespec.shape[-2]
+    k = np.abs((N*np.fft.fftfreq(N))[0:(N//2)+1])
+    l = N*np.fft.fftfreq(N)
+    k,l = np.meshgrid(k,l)
+    ktot = np.sqrt(k**2+l**2).astype(np.int64)
+    ktotmax = N//2+1
+    spec = kespec.reshape((-1,)+kespec.shape[-2:]).mean(axis=0)
+    mask = ktot < ktotmax
+    return np.bincount(ktot[mask],spec[mask],ktotmax)
+
+def kespec(model, pvspec):
+    """
+    kinetic energy spectrum (...,2,N,N//2+1) of pv perturbation pvspec
+    (spectral, any leading dimensions), as in the run_forecast scripts.
+    """
+    psispec = model.invert(pvspec)
+    psispec = psispec/(model.N*np.sqrt(2.))
+    return (model.ksqlsq*(psispec*np.conjugate(psispec))).real
+
+def verify_forecasts(model, truth, starts, leads, timesteps, nanals=1,\
+                     lead_interval=1, scalefact=1.0, spectra_leads=(),\
+                     batch_size=None, stats=None, verbose=False):
+    """
+    integrate forecasts from many start times and members together as one
+    batched spectral state, and verify against the nature run.
+
+    model:  SQG instance set up for batches of (batch_size,nanals) states
+    (pv[batch_size,nanals,2,N,N]), with a RandomPatternBatch of shape
+    (batch_size,nanals) for stochastic members.  Its state is overwritten.
+    truth:  nature run pv (ntimes,2,N,N) (array or netCDF variable).
+    starts:  indices of start times in truth.  Forecasts from batch_size
+    start times are run at once (the last batch is padded with copies of
+    its last start time, which are not verified).
+    leads:  lead times to verify (in units of lead_interval nature run
+    times), timesteps:  model time steps per nature run time interval.
+    scalefact:  factor to convert pv to temperature.
+    spectra_leads:  leads at which error/spread spectra are accumulated.
+    stats:  ForecastStats to add to (default new).
+
+    returns ForecastStats.
+    """
+    leads = sorted(leads)
+    if stats is None: stats = ForecastStats(leads,spectra_leads)
+    starts = list(starts)
+    if batch_size is None: batch_size = len(starts)
+    for n1 in range(0,len(starts),batch_size):
+        batch = starts[n1:n1+batch_size]
+        nvalid = len(batch)
+        batch = batch + [batch[-1]]*(batch_size-nvalid)
+        pvic = np.asarray(truth[sorted(set(batch))])
+        pvic = pvic[np.searchsorted(sorted(set(batch)),batch)]
+        pvspec = rfft2(pvic.astype(model.pvbar.dtype),threads=model.threads)
+        model.pvspec = np.repeat(pvspec[:,np.newaxis],nanals,axis=1)
+        nsteps = 0
+        for lead in leads:
+            for nt in range(lead*timesteps*lead_interval-nsteps):
+                model.timestep()
+            nsteps = lead*timesteps*lead_interval
+            pvens = irfft2(model.pvspec,threads=model.threads)[:nvalid]
+            verif = [start+lead*lead_interval for start in batch[:nvalid]]
+            pvtruth = np.asarray(truth[sorted(set(verif))],accum_dtype)
+            pvtruth = pvtruth[np.searchsorted(sorted(set(verif)),verif)]
+            # ensemble mean, variance and error (one pass over members).
+            pvmean, pvvar, pverrsq = ensemble_moments(np.swapaxes(pvens,0,1),pvtruth)
+            for nb in range(nvalid):
+                stats.errsq[lead].update(scalefact**2*pverrsq[nb])
+                stats.sprd[lead].update(scalefact**2*pvvar[nb])
+            if lead in stats.spectra_leads:
+                kespec_err = kespec(model,scalefact*rfft2(pvmean-pvtruth))
+                kespec_sprd = kespec(model,scalefact*\
+                rfft2(pvens-pvmean[:,np.newaxis].astype(pvens.dtype))).mean(axis=1)
+                for nb in range(nvalid):
+                    stats.kespec_err[lead].update(kespec_err[nb])
+                    stats.kespec_sprd[lead].update(kespec_sprd[nb])
+            if verbose:
+                print(batch[0],lead,np.sqrt(scalefact**2*pverrsq.mean()),\
+                      np.sqrt(scalefact**2*pvvar.mean()))
+    return stats
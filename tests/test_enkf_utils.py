@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from sqgturb import enkf_utils
+
+def _setup(nx=16, nanals=10, nobs=60, hcovlocal_scale=4.e6, seed=0):
+    # random ensemble and obs at grid points on a doubly periodic plane.
+    rs = np.random.RandomState(seed)
+    L = 20.e6
+    x1 = np.arange(0,L,L/nx); x, y = np.meshgrid(x1,x1)
+    x = x.ravel(); y = y.ravel()
+    indxob = rs.choice(nx*nx,nobs,replace=False)
+    xob = x[indxob]; yob = y[indxob]
+    covlocal = np.array([enkf_utils.gaspcohn(enkf_utils.cartdist(xo,yo,x,y,L,L)/\
+               hcovlocal_scale) for xo,yo in zip(xob,yob)])
+    obcovlocal = covlocal[:,indxob]
+    xens = rs.standard_normal((nanals,2,nx*nx))
+    obs = rs.standard_normal((2,nobs)); oberrs = np.ones(nobs)
+    return xens, indxob, obs, oberrs, covlocal, obcovlocal
+
+def _serial_ensrf_reference(xens,hxens,obs,oberrs,covlocal,obcovlocal,vcovlocal_fact):
+    # original serial potter loop (levob = [0,1], dense localization).
+    nanals = xens.shape[0]; nobs = obs.shape[-1]
+    xmean = xens.mean(axis=0); xprime = xens-xmean
+    hxmean = hxens.mean(axis=0); hxprime = hxens-hxmean
+    fact = np.ones(2)
+    for kob in range(2):
+        fact[:] = 1.; fact[1-kob] = vcovlocal_fact
+        for nob,ob,oberr in zip(range(nobs),obs[kob],oberrs):
+            ominusf = ob-hxmean[kob,nob]
+            hxens1 = hxprime[:,kob,nob].copy().reshape((nanals,1))
+            hpbht = (hxens1**2).sum()/(nanals-1)
+            gainfact = (hpbht+oberr)/hpbht*(1.-np.sqrt(oberr/(hpbht+oberr)))
+            for mean,prime,loc in [(xmean,xprime,covlocal),(hxmean,hxprime,obcovlocal)]:
+                mask = loc[nob,:] > 1.e-10
+                for k in range(2):
+                    pbht = (prime[:,k,mask].T*hxens1[:,0]).sum(axis=1)/float(nanals-1)
+                    kfgain = fact[k]*loc[nob,mask]*pbht/(hpbht+oberr)
+                    mean[k,mask] = mean[k,mask] + kfgain*ominusf
+                    prime[:,k,mask] = prime[:,k,mask] - gainfact*kfgain*hxens1
+    return xmean + xprime
+
+@pytest.mark.parametrize('use_numba',[False,True])
+def test_serial_ensrf(use_numba):
+    # serial EnSRF (dense or sparse localization) agrees with the
+    # original loop to roundoff.
+    if use_numba: pytest.importorskip('numba')
+    xens, indxob, obs, oberrs, covlocal, obcovlocal = _setup()
+    hxens = xens[:,:,indxob]
+    ref = _serial_ensrf_reference(xens,hxens,obs,oberrs,covlocal,obcovlocal,0.3)
+    for loc, obloc in [(covlocal,obcovlocal),(csr_matrix(covlocal),csr_matrix(obcovlocal))]:
+        new = enkf_utils.enkf_update(xens.copy(),hxens,obs,oberrs,loc,[0,1],0.3,\
+              obcovlocal=obloc,use_numba=use_numba)
+        assert np.abs(new-ref).max() < 1.e-12
+
+@pytest.mark.parametrize('nx,ny,hcovlocal_scale',[(16,16,4.e6),(16,12,3.e6),(16,16,30.e6)])
+def test_grid_localization(nx,ny,hcovlocal_scale):
+    # stencil localization agrees with the kd-tree distances (including
+    # radii larger than the domain), and the cache follows the network.
+    L = 20.e6; rs = np.random.RandomState(0)
+    x, y = np.meshgrid(np.arange(nx)*L/nx,np.arange(ny)*L/ny)
+    x = x.ravel(); y = y.ravel()
+    gl = enkf_utils.GridLocalization(nx,ny,L,hcovlocal_scale,precision='double')
+    for nobs in [40,60]:
+        indxob = rs.choice(nx*ny,nobs,replace=False)
+        xob = x[indxob]; yob = y[indxob]
+        covlocal = enkf_utils.gaspcohn_sparse(xob,yob,x,y,L,L,hcovlocal_scale)
+        obcovlocal = enkf_utils.gaspcohn_sparse(xob,yob,xob,yob,L,L,hcovlocal_scale)
+        assert np.abs(gl.covlocal(indxob).toarray()-covlocal.toarray()).max() < 1.e-12
+        assert np.abs(gl.obcovlocal(indxob).toarray()-obcovlocal.toarray()).max() < 1.e-12
+
+def test_letkf_tiles():
+    # LETKF analysis is bitwise identical for any nproc and tile_size.
+    xens, indxob, obs, oberrs, covlocal, obcovlocal = _setup()
+    hxens = xens[:,:,indxob]
+    ref = enkf_utils.enkf_update(xens.copy(),hxens,obs,oberrs,covlocal,[0,1],0.3)
+    for nproc in [1,2]:
+        for tile_size in [16,5,1]:
+            new = enkf_utils.enkf_update(xens.copy(),hxens,obs,oberrs,covlocal,[0,1],0.3,\
+                  nproc=nproc,tile_size=tile_size)
+            assert np.array_equal(new,ref)
+
+def test_serial_ensrf_parallel():
+    # partitioned serial EnSRF (forced with min_phase_work=0) agrees with
+    # the original loop to roundoff.
+    xens, indxob, obs, oberrs, covlocal, obcovlocal = _setup()
+    hxens = xens[:,:,indxob]
+    ref = _serial_ensrf_reference(xens,hxens,obs,oberrs,covlocal,obcovlocal,0.3)
+    for nproc in [2,3]:
+        new = enkf_utils.enkf_update(xens.copy(),hxens,obs,oberrs,csr_matrix(covlocal),\
+              [0,1],0.3,obcovlocal=csr_matrix(obcovlocal),nproc=nproc,min_phase_work=0)
+        assert np.abs(new-ref).max() < 1.e-12
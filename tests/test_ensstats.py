@@ -0,0 +1,31 @@
+import numpy as np
+from sqgturb.ensstats import ensemble_moments, RunningStats
+
+def test_ensemble_moments():
+    rs = np.random.RandomState(0)
+    ens = (10.+rs.standard_normal((8,2,6,6))).astype(np.float32)
+    truth = rs.standard_normal((2,6,6))
+    mean, var, errsq = ensemble_moments(ens,truth)
+    ens = ens.astype(np.float64)
+    assert np.allclose(mean,ens.mean(axis=0),rtol=0,atol=1.e-12)
+    assert np.allclose(var,ens.var(axis=0,ddof=1),rtol=0,atol=1.e-12)
+    assert np.allclose(errsq,(ens.mean(axis=0)-truth)**2,rtol=0,atol=1.e-12)
+
+def test_running_stats_merge():
+    # statistics merged from partial sequences (including an empty one)
+    # match a single pass over all samples.
+    rs = np.random.RandomState(0)
+    samples = 5.+rs.standard_normal((11,2,4,4))
+    for reduce_axes in [None,(-2,-1)]:
+        single = RunningStats(reduce_axes=reduce_axes)
+        for x in samples: single.update(x)
+        parts = [RunningStats(reduce_axes=reduce_axes) for n in range(4)]
+        for x,n in zip(samples,[0,0,0,2,2,3,3,3,3,3,3]):
+            parts[n].update(x)
+        merged = RunningStats(reduce_axes=reduce_axes)
+        for part in parts: merged.merge(part)
+        x = samples if reduce_axes is None else samples.mean(axis=reduce_axes)
+        for stats in [single,merged]:
+            assert stats.count == len(samples)
+            assert np.allclose(stats.mean,x.mean(axis=0),rtol=0,atol=1.e-12)
+            assert np.allclose(stats.variance,x.var(axis=0,ddof=1),rtol=0,atol=1.e-12)
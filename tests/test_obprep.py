@@ -0,0 +1,40 @@
+import numpy as np
+from sqgturb.obprep import superob, thin
+
+L = 100.
+
+def test_superob_box():
+    # obs 0,1 share a box, ob 2 is alone.
+    xob = np.array([12.,18.,75.]); yob = np.array([31.,39.,55.])
+    pvob = np.array([[1.,3.,5.],[2.,4.,6.]]); oberrvar = np.array([1.,4.,2.])
+    pvob_s, oberrvar_s, xob_s, yob_s, groups = superob(xob,yob,pvob,oberrvar,L,25.)
+    assert np.allclose(pvob_s,[[2.,5.],[3.,6.]])
+    assert np.allclose(oberrvar_s,[5./4.,2.])
+    assert np.allclose(xob_s,[15.,75.]) and np.allclose(yob_s,[35.,55.])
+    assert np.allclose(groups.toarray(),[[0.5,0.5,0.],[0.,0.,1.]])
+    # fully correlated errors:  variance of the mean of sqrt(r)
+    oberrvar_s = superob(xob,yob,pvob,oberrvar,L,25.,obcorr=1.)[1]
+    assert np.allclose(oberrvar_s,[9./4.,2.])
+
+def test_superob_radius_periodic():
+    # cluster straddling the periodic boundary is located across it.
+    xob = np.array([98.,3.,50.]); yob = np.array([50.,50.,50.])
+    pvob = np.array([1.,2.,3.]); oberrvar = np.ones(3)
+    pvob_s, oberrvar_s, xob_s, yob_s, groups = \
+    superob(xob,yob,pvob,oberrvar,L,10.,method='radius')
+    assert np.allclose(pvob_s,[1.5,3.])
+    assert np.allclose(oberrvar_s,[0.5,1.])
+    assert np.allclose(xob_s,[0.5,50.]) and np.allclose(yob_s,[50.,50.])
+
+def test_thin():
+    # at most one ob per box, the one nearest the box center.
+    rs = np.random.RandomState(0)
+    xob = L*rs.uniform(size=500); yob = L*rs.uniform(size=500)
+    spacing = 20.
+    kept = thin(xob,yob,L,spacing)
+    assert np.all(np.diff(kept) > 0)
+    box = (yob//spacing)*(L//spacing)+xob//spacing
+    assert len(np.unique(box[kept])) == len(kept) == len(np.unique(box))
+    dist = (xob%spacing-0.5*spacing)**2+(yob%spacing-0.5*spacing)**2
+    for nob in kept:
+        assert dist[nob] == dist[box == box[nob]].min()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+pytest.importorskip('netCDF4')
+from sqgturb.obsdb import ObsDatabaseWriter, ObsDatabase
+
+def test_round_trip(tmp_path):
+    # cycles (different ob counts and levels, obs at grid points or not)
+    # read back as written.
+    filename = str(tmp_path/'obs.nc')
+    rs = np.random.RandomState(0)
+    L = 20.e6; nx = 16
+    cycles = []
+    for ncycle, (nobs, levob, gridded) in enumerate([(10,[0,1],True),(7,[1],False),(12,[0,1],False)]):
+        indxob = np.sort(rs.choice(nx*nx,nobs,replace=False)) if gridded else None
+        if gridded:
+            xob = (indxob%nx)*L/nx; yob = (indxob//nx)*L/nx
+        else:
+            xob = L*rs.uniform(size=nobs); yob = L*rs.uniform(size=nobs)
+        pvob = rs.standard_normal((len(levob),nobs)).astype(np.float32)
+        oberrvar = rs.uniform(0.5,1.5,size=nobs).astype(np.float32)
+        cycles.append((10800.*ncycle,xob,yob,pvob,oberrvar,levob,indxob))
+    writer = ObsDatabaseWriter(filename,L,nx,nobs=-1,oberr=1.0)
+    for cycle in cycles:
+        writer.add_cycle(*cycle)
+    writer.close()
+    db = ObsDatabase(filename)
+    assert db.ncycles == 3 and db.nx == db.ny == nx and db.L == L
+    assert db.attrs['nobs'] == -1 and db.attrs['oberr'] == 1.0
+    assert np.array_equal(db.times,[0.,10800.,21600.])
+    for ncycle, (time,xob,yob,pvob,oberrvar,levob,indxob) in enumerate(cycles):
+        pvob1, oberrvar1, xob1, yob1, indxob1 = db.cycle(ncycle,levob)
+        assert np.array_equal(pvob1,pvob) and np.array_equal(oberrvar1,oberrvar)
+        assert np.array_equal(xob1,xob) and np.array_equal(yob1,yob)
+        if indxob is None:
+            assert indxob1 is None
+        else:
+            assert np.array_equal(indxob1,indxob)
+        obs = db.read(ncycle)
+        assert obs['time'] == time
+        assert np.array_equal(obs['lev'],np.repeat(levob,len(xob)))
+    with pytest.raises(ValueError):
+        db.cycle(1,[0])
+    db.close()
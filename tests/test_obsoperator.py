@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from sqgturb import SQG
+from sqgturb.obsoperator import ObservationOperator
+
+@pytest.mark.parametrize('method',['nearest','spectral'])
+@pytest.mark.parametrize('var',['psi','u','v'])
+def test_psi_winds(var,method):
+    # psi, u and v operators (at grid points) agree with fields from
+    # SQG.invert, for an ensemble and both levels.
+    N = 16
+    pv = 1.e-3*np.random.RandomState(0).standard_normal((3,2,N,N))
+    model = SQG(pv[0],dt=600.,diff_efold=86400.,precision='double')
+    psispec = model.invert(np.fft.rfft2(pv))
+    psispec[...,0,0] = 0. # area mean streamfunction is arbitrary
+    deriv = {'psi':1.,'u':-model.il,'v':model.ik}[var]
+    fld = np.fft.irfft2(deriv*psispec,s=(N,N)).reshape((3,2,N*N))
+    indxob = np.random.RandomState(1).choice(N*N,20,replace=False)
+    H = ObservationOperator(model.L,N,indxob=indxob,levob=(0,1),method=method,\
+                            var=var,model=model)
+    hx = H(pv)
+    assert hx.shape == (3,2,20)
+    assert np.abs(hx-fld[...,indxob]).max() < 1.e-10*np.abs(fld).max()
@@ -0,0 +1,40 @@
+import numpy as np
+from sqgturb import RandomPattern, RandomStreams
+
+def _pattern(seed=None):
+    return RandomPattern(500.e3,3600.,20.e6,32,600.,nsamples=2,stdev=1.0,seed=seed)
+
+def test_copy_same_seed():
+    # copies with the same seed have the same pattern, independent of
+    # the state of the pattern they were copied from.
+    rp1 = _pattern(seed=1); rp2 = _pattern(seed=2)
+    rp2.evolve()
+    assert np.array_equal(rp1.copy(seed=42).pattern,rp2.copy(seed=42).pattern)
+    assert np.array_equal(rp1.copy(seed=42).pattern,rp1.copy(seed=42).pattern)
+    assert not np.array_equal(rp1.copy(seed=42).pattern,rp1.copy(seed=43).pattern)
+
+def test_copy_keyed_streams():
+    # members drawn from RandomStreams are reproducible.
+    rp = _pattern()
+    patterns = []
+    for n in range(2):
+        rng = RandomStreams(seed=7)
+        patterns.append([rp.copy(seed=rng.generator(member=nanal,purpose='pattern')).pattern\
+                         for nanal in range(3)])
+    for p1, p2 in zip(*patterns):
+        assert np.array_equal(p1,p2)
+
+def test_eigsh_cache(tmp_path):
+    # patterns (and their evolution) for a seed do not depend on whether
+    # the eigenvectors were computed or read from the cache.
+    from sqgturb.randompattern_eigsh import RandomPatternEigsh
+    L = 20.e6; N = 16
+    def hcorr(x,y):
+        return 1000.e3*(1.+np.sin(np.pi*y/L)**2)
+    for method in ['randomized','lanczos']:
+        rps = [RandomPatternEigsh(hcorr,3600.,L,N,600.,nsamples=2,method=method,\
+               cachedir=cachedir,seed=7) for cachedir in [None,str(tmp_path),str(tmp_path)]]
+        for rp in rps: rp.evolve()
+        for rp in rps[1:]:
+            assert np.array_equal(rp.scaledevecs,rps[0].scaledevecs)
+            assert np.array_equal(rp.pattern,rps[0].pattern)
@@ -0,0 +1,20 @@
+import numpy as np
+from sqgturb import SQG
+
+def _pv(N=16, seed=0):
+    return 1.e-3*np.random.RandomState(seed).standard_normal((2,N,N))
+
+def test_batched_member_parameters():
+    # batched model with per-member parameters gives the same result as
+    # separate models.
+    pv = _pv()
+    diff_efold = [3600.,43200.]; tdiab = [5.*86400,10.*86400]; r = [0.,1.e-6]
+    kwargs = dict(dt=600.,diff_order=8,precision='double')
+    models = [SQG(pv,diff_efold=diff_efold[n],tdiab=tdiab[n],r=r[n],**kwargs)\
+              for n in range(2)]
+    modelb = SQG(np.array([pv,pv]),diff_efold=diff_efold,tdiab=tdiab,r=r,**kwargs)
+    for model in models+[modelb]:
+        model.timesteps = 4
+    pvb = modelb.advance()
+    for n in range(2):
+        assert np.allclose(pvb[n],models[n].advance(),rtol=0,atol=1.e-12)
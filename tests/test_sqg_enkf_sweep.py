@@ -0,0 +1,25 @@
+import os, subprocess, sys
+import pytest
+
+pytest.importorskip('netCDF4')
+pytest.importorskip('matplotlib')
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _sweep(cwd):
+    env = dict(os.environ,PYTHONPATH=os.pathsep.join([root,os.getenv('PYTHONPATH','')]))
+    return subprocess.run([sys.executable,os.path.join(root,'enkf','sqg_enkf_sweep.py'),'smoke'],\
+                          cwd=str(cwd),env=env,check=True,stdout=subprocess.PIPE,\
+                          universal_newlines=True).stdout
+
+def test_smoke_sweep(tmp_path):
+    # both experiments finish, and are skipped when the sweep is restarted.
+    out = _sweep(tmp_path)
+    assert '2 experiments (2 to run)' in out
+    outdir = tmp_path/'smoke'
+    assert len(list(outdir.glob('*.done'))) == 2
+    summary = [line.split() for line in open(str(outdir/'sweep_summary.txt')) if not line.startswith('#')]
+    assert len(summary) == 2
+    for row in summary:
+        assert row[6] == 'True' and int(row[5]) == 4
+    assert '2 experiments (0 to run)' in _sweep(tmp_path)
@@ -0,0 +1,21 @@
+import numpy as np
+from sqgturb import SQG
+from sqgturb.verification import verify_forecasts
+
+def test_batch_size():
+    # verification statistics do not depend on how start times are
+    # batched (including a padded last batch).
+    N = 16; nanals = 2
+    truth = 1.e-3*np.random.RandomState(0).standard_normal((8,2,N,N))
+    leads = [1,2]; starts = [0,1,2,3,4]
+    results = []
+    for batch_size in [1,2,5]:
+        model = SQG(np.zeros((batch_size,nanals,2,N,N)),dt=600.,diff_efold=86400.,\
+                    precision='double')
+        stats = verify_forecasts(model,truth,starts,leads,3,nanals=nanals,\
+                spectra_leads=[2],batch_size=batch_size)
+        assert stats.count == len(starts)
+        results.append([stats.rmse(lead) for lead in leads]+list(stats.spectra(2)))
+    for result in results[1:]:
+        for a, b in zip(result,results[0]):
+            assert np.allclose(a,b,rtol=1.e-12,atol=0)